@@ -0,0 +1,286 @@
+"""
+alerts on stories as soon as they're scored
+
+rules are compiled once: sentiment thresholds become float comparisons, ticker
+watchlists become sets, and the keywords of every rule go into one Aho-Corasick
+automaton so a story is scanned once however many rules there are. a rule fires
+when all of its conditions hold, e.g.
+
+AlertRule('negative_legal', max_compound=-0.5, keywords=['SEC', 'subpoena', 'sue'])
+
+alerts go out to sinks (stdout, a webhook, SMTP) on a small thread pool, so a slow
+sink never holds up the NLP stage. the same rule firing on the same story twice
+within dedup_seconds is dropped, and each sink has a token bucket so a burst of
+news can't flood it
+
+publish-to-alert time (article publish time to the sink finishing) is kept per
+rule for latency_report()
+"""
+
+import json
+import time
+import smtplib
+import threading
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+import numpy as np
+import ahocorasick
+import requests as req
+
+Alert = namedtuple('Alert', ['rule', 'link', 'title', 'tickers', 'compound', 'keywords', 'published', 'alerted_at'])
+
+
+class AlertRule:
+    """
+    args:
+    name -- shows up in the alert
+    min_compound -- fires only if the overall compound score is above this
+    max_compound -- fires only if the overall compound score is below this
+    keywords -- fires only if any of these is in the title or body; all-caps
+        keywords (e.g. SEC) are matched case-sensitively, others aren't
+    tickers -- fires only if the story mentions any of these tickers
+    """
+    def __init__(self, name, min_compound=None, max_compound=None, keywords=None, tickers=None):
+        self.name = name
+        self.min_compound = min_compound
+        self.max_compound = max_compound
+        self.keywords = list(keywords or [])
+        self.tickers = set(tickers or [])
+
+    def matches(self, compound, found_keywords, tickers):
+        if self.min_compound is not None and not compound > self.min_compound:
+            return False
+        if self.max_compound is not None and not compound < self.max_compound:
+            return False
+        if self.keywords and not found_keywords.intersection(self.keywords):
+            return False
+        if self.tickers and not self.tickers.intersection(tickers):
+            return False
+        return True
+
+
+# the alerts from the old TODOs in analyze_story
+DEFAULT_RULES = [AlertRule('strong_positive', min_compound=0.5),
+                 AlertRule('strong_negative', max_compound=-0.5),
+                 AlertRule('legal', keywords=['SEC', 'subpoena', 'sue', 'sued', 'lawsuit', 'fraud', 'probe'])]
+
+
+def load_rules(path):
+    """
+    rules from a json list of AlertRule keyword arguments
+    """
+    with open(path) as f:
+        return [AlertRule(**r) for r in json.load(f)]
+
+
+def format_alert(alert):
+    return '[{}] {} ({}) compound {:.2f}{}\n{}'.format(
+            alert.rule, alert.title, ', '.join(alert.tickers) or 'no tickers', alert.compound,
+            '; keywords: ' + ', '.join(alert.keywords) if alert.keywords else '', alert.link)
+
+
+class StdoutSink:
+    name = 'stdout'
+
+    def send(self, alert):
+        print('ALERT', format_alert(alert))
+
+
+class WebhookSink:
+    """
+    POSTs each alert as json to url
+    """
+    name = 'webhook'
+
+    def __init__(self, url, timeout=5, session=None):
+        self.url = url
+        self.timeout = timeout
+        self.session = session or req.Session()
+
+    def send(self, alert):
+        payload = alert._asdict()
+        payload['tickers'] = list(alert.tickers)
+        payload['keywords'] = list(alert.keywords)
+        res = self.session.post(self.url, json=payload, timeout=self.timeout)
+        res.raise_for_status()
+
+
+class SMTPSink:
+    """
+    emails each alert; defaults to a local SMTP server, e.g. a stand-in started with
+    python -m aiosmtpd -n -l localhost:1025
+    """
+    name = 'smtp'
+
+    def __init__(self, to_addrs, from_addr='alerts@localhost', host='localhost', port=1025):
+        self.to_addrs = to_addrs
+        self.from_addr = from_addr
+        self.host = host
+        self.port = port
+
+    def send(self, alert):
+        msg = EmailMessage()
+        msg['Subject'] = '[{}] {}'.format(alert.rule, alert.title)
+        msg['From'] = self.from_addr
+        msg['To'] = ', '.join(self.to_addrs)
+        msg.set_content(format_alert(alert))
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(msg)
+
+
+class TokenBucket:
+    """
+    allows bursts of up to `burst`, refilling at rate_per_minute
+    """
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time()
+
+    def take(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class AlertEngine:
+    """
+    args:
+    rules -- list of AlertRule
+    sinks -- list of sinks, anything with a send(alert) method and a name
+    dedup_seconds -- the same rule on the same link only alerts once in this window
+    rate_per_minute, burst -- token bucket for each sink
+    max_workers -- threads sending alerts
+    max_samples -- latency samples kept per rule
+    """
+    def __init__(self, rules=None, sinks=None, dedup_seconds=3600, rate_per_minute=30, burst=10,
+                 max_workers=4, max_samples=1000):
+        self.rules = rules if rules is not None else DEFAULT_RULES
+        self.sinks = sinks if sinks is not None else [StdoutSink()]
+        self.dedup_seconds = dedup_seconds
+        self.buckets = {id(sink): TokenBucket(rate_per_minute, burst) for sink in self.sinks}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        # (rule name, link) -> time alerted
+        self.recent = {}
+        self.last_prune = time.time()
+        self.stats = {'evaluated': 0, 'fired': 0, 'deduped': 0, 'rate_limited': 0, 'sent': 0, 'send_errors': 0}
+        self.publish_to_alert = {rule.name: deque(maxlen=max_samples) for rule in self.rules}
+
+        # one automaton over every rule's keywords, on lowercased text
+        self.automaton = ahocorasick.Automaton()
+        keywords = {k for rule in self.rules for k in rule.keywords}
+        for k in keywords:
+            self.automaton.add_word(k.lower(), (len(k), k, k.isupper()))
+        self.has_keywords = len(keywords) > 0
+        if self.has_keywords:
+            self.automaton.make_automaton()
+
+    def find_keywords(self, text):
+        """
+        set of rule keywords in text, as whole words
+        """
+        found = set()
+        if not self.has_keywords:
+            return found
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+        for end, (length, keyword, case_sensitive) in self.automaton.iter(lowered):
+            start = end - length + 1
+            if start > 0 and lowered[start - 1].isalnum():
+                continue
+            if end + 1 < len(lowered) and lowered[end + 1].isalnum():
+                continue
+            if case_sensitive and text[start:end + 1] != keyword:
+                continue
+            found.add(keyword)
+        return found
+
+    def evaluate(self, link, title, body, tickers, compound, published=None):
+        """
+        checks a scored story against the rules and sends any alerts
+
+        args:
+        tickers -- tickers mentioned in the story
+        compound -- overall VADER compound score
+        published -- article publish time (a datetime/Timestamp or epoch seconds), for latency
+
+        returns list of Alerts sent out (after dedup and before rate limiting)
+        """
+        if hasattr(published, 'timestamp'):
+            published = published.timestamp()
+        tickers = sorted(set(tickers))
+        found = self.find_keywords(title + '\n' + body)
+        now = time.time()
+        alerts = []
+        with self.lock:
+            self.stats['evaluated'] += 1
+            for rule in self.rules:
+                if not rule.matches(compound, found, tickers):
+                    continue
+                self.stats['fired'] += 1
+                key = (rule.name, link)
+                if now - self.recent.get(key, -np.inf) < self.dedup_seconds:
+                    self.stats['deduped'] += 1
+                    continue
+                self.recent[key] = now
+                alerts.append(Alert(rule.name, link, title, tickers, compound,
+                                    sorted(found.intersection(rule.keywords)), published, now))
+            self._prune(now)
+
+        for alert in alerts:
+            for sink in self.sinks:
+                with self.lock:
+                    allowed = self.buckets[id(sink)].take()
+                    if not allowed:
+                        self.stats['rate_limited'] += 1
+                if allowed:
+                    self.executor.submit(self._send, sink, alert)
+        return alerts
+
+    def _prune(self, now):
+        # forget dedup keys once they're out of the window; called with self.lock held
+        if now - self.last_prune < self.dedup_seconds:
+            return
+        self.recent = {k: t for k, t in self.recent.items() if now - t < self.dedup_seconds}
+        self.last_prune = now
+
+    def _send(self, sink, alert):
+        try:
+            sink.send(alert)
+        except Exception as e:
+            print('alert sink', sink.name, 'failed:', repr(e))
+            with self.lock:
+                self.stats['send_errors'] += 1
+            return
+
+        with self.lock:
+            self.stats['sent'] += 1
+            if alert.published is not None:
+                self.publish_to_alert[alert.rule].append(time.time() - alert.published)
+
+    def latency_report(self):
+        """
+        dict of rule name -> {'n', 'median', 'p99'} publish-to-alert seconds
+        """
+        report = {}
+        with self.lock:
+            samples = {name: list(s) for name, s in self.publish_to_alert.items() if len(s) > 0}
+        for name, s in samples.items():
+            median, p99 = np.percentile(np.array(s), [50, 99])
+            report[name] = {'n': len(s), 'median': median, 'p99': p99}
+        return report
+
+    def close(self):
+        """
+        waits for alerts still being sent
+        """
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,95 @@
+"""
+pulls the published time and body text out of story pages
+
+each site gets an extractor registered under its domain; an extractor parses the
+page once with lxml and reads the date and body with precompiled XPath selectors,
+then trims the dateline and boilerplate with compiled regexes. new sources (see
+sites_to_scrape.md) just need their own selectors and date parser:
+
+register_extractor('marketwatch.com', XPathExtractor(date_xpath, body_xpath, parse_date))
+"""
+
+import re
+from urllib.parse import urlparse
+
+import pandas as pd
+from lxml import etree, html
+
+# dateline and agency at the start of the body, e.g. NEW YORK (Reuters) -
+DATELINE_RE = re.compile(r'^.{0,100}? - ', re.S)
+# everything from the first credit line or trust badge on is boilerplate
+BOILERPLATE_RE = re.compile(r'(Additional reporting by|Reporting by|Writing by|Editing by|Compiled by|Our Standards:).*$', re.S)
+
+# domain -> extractor
+_extractors = {}
+
+
+def class_xpath(tag, cls):
+    """
+    compiled XPath for tag elements with cls as one of their classes, like bs4's class_ matching
+    """
+    return etree.XPath("//{}[contains(concat(' ', normalize-space(@class), ' '), ' {} ')]".format(tag, cls))
+
+
+def clean_body(body, dateline_re=DATELINE_RE, boilerplate_re=BOILERPLATE_RE):
+    body = dateline_re.sub('', body, count=1)
+    return boilerplate_re.sub('', body).strip()
+
+
+class XPathExtractor:
+    """
+    args:
+    date_xpath, body_xpath -- compiled XPaths for the published time and body elements
+    parse_date -- function from the date element's text to a UTC Timestamp
+    clean -- function to tidy up the body text
+    """
+    def __init__(self, date_xpath, body_xpath, parse_date, clean=clean_body):
+        self.date_xpath = date_xpath
+        self.body_xpath = body_xpath
+        self.parse_date = parse_date
+        self.clean = clean
+
+    def extract(self, content):
+        """
+        returns article_datetime, body
+        """
+        tree = html.fromstring(content)
+        date_els = self.date_xpath(tree)
+        body_els = self.body_xpath(tree)
+        if len(date_els) == 0 or len(body_els) == 0:
+            raise ValueError('story date or body not found in page')
+
+        article_datetime = self.parse_date(date_els[0].text_content())
+        return article_datetime, self.clean(body_els[0].text_content())
+
+
+def register_extractor(domain, extractor):
+    """
+    uses extractor for pages on domain and its subdomains
+    """
+    _extractors[domain.lower()] = extractor
+
+
+def get_extractor(url):
+    """
+    extractor for the most specific registered domain of url, or None
+    """
+    labels = urlparse(url).netloc.lower().split(':')[0].split('.')
+    for i in range(len(labels)):
+        extractor = _extractors.get('.'.join(labels[i:]))
+        if extractor is not None:
+            return extractor
+    return None
+
+
+def parse_reuters_date(text):
+    # e.g. August 15, 2018 / 5:30 PM / a year ago; with base requests this is in UTC/GMT
+    datetime_str = text.split('/')
+    return pd.to_datetime(datetime_str[0].strip() + ' ' + datetime_str[1].strip()).tz_localize('UTC')
+
+
+REUTERS_EXTRACTOR = XPathExtractor(class_xpath('div', 'ArticleHeader_date'),
+                                   class_xpath('div', 'StandardArticleBody_body'),
+                                   parse_reuters_date)
+
+register_extractor('reuters.com', REUTERS_EXTRACTOR)
@@ -0,0 +1,73 @@
+"""
+benchmark: AlertEngine rule evaluation and publish-to-alert latency
+
+runs synthetic scored stories through the default rules plus a ticker watchlist,
+with one fast sink and one slow sink (standing in for SMTP/webhooks), and prints
+the time evaluate() takes per story -- which is all the NLP stage waits for --
+and the publish-to-alert latency per rule once the sinks are done
+
+run from the repo root:
+python -m benchmarks.bench_alerts
+"""
+
+import time
+import random
+
+import numpy as np
+
+from alerts import AlertEngine, AlertRule, DEFAULT_RULES
+
+WORDS = ['shares', 'fell', 'rose', 'percent', 'company', 'said', 'on', 'Wednesday',
+         'quarterly', 'revenue', 'analysts', 'deal', 'billion', 'the', 'a', 'second']
+# these trip the legal rule; 'sec' in lowercase shouldn't
+FLAGS = ['SEC', 'subpoena', 'sued', 'sec']
+TICKERS = ['MTCH', 'IAC', 'XEL', 'AAPL', 'TMUS', 'S']
+
+
+class CountingSink:
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.sent = 0
+
+    def send(self, alert):
+        time.sleep(self.delay)
+        self.sent += 1
+
+
+def make_story(i):
+    words = [random.choice(WORDS) for _ in range(600)]
+    if random.random() < 0.2:
+        words[random.randrange(len(words))] = random.choice(FLAGS)
+    return {'link': 'https://www.reuters.com/article/bench-{}'.format(i),
+            'title': 'Story {} about {}'.format(i, random.choice(TICKERS)),
+            'body': ' '.join(words),
+            'tickers': random.sample(TICKERS, 2),
+            'compound': random.uniform(-1, 1)}
+
+
+def run(n_stories=1000, slow_delay=0.05):
+    rules = DEFAULT_RULES + [AlertRule('watchlist_negative', max_compound=-0.3, tickers=['MTCH', 'IAC'])]
+    fast, slow = CountingSink('fast', 0), CountingSink('slow', slow_delay)
+    engine = AlertEngine(rules, [fast, slow], rate_per_minute=6000, burst=100, max_workers=8)
+    stories = [make_story(i) for i in range(n_stories)]
+
+    eval_times = []
+    for s in stories:
+        # stories are scored a few seconds after they're published
+        published = time.time() - random.uniform(1, 5)
+        start = time.time()
+        engine.evaluate(s['link'], s['title'], s['body'], s['tickers'], s['compound'], published)
+        eval_times.append(time.time() - start)
+    engine.close()
+
+    eval_times = np.array(eval_times) * 1000
+    print('evaluate: median {:.3f}ms, p99 {:.3f}ms per story'.format(np.median(eval_times), np.percentile(eval_times, 99)))
+    print('stats:', engine.stats)
+    print('sent: fast sink {}, slow sink {}'.format(fast.sent, slow.sent))
+    for rule, r in engine.latency_report().items():
+        print('{}: {n} alerts, publish-to-alert median {median:.2f}s, p99 {p99:.2f}s'.format(rule, **r))
+
+
+if __name__ == '__main__':
+    run()
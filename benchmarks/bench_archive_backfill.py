@@ -0,0 +1,171 @@
+"""
+benchmark: walking paginated archive listings one page at a time vs partitioned,
+stopping/resuming from the checkpoint, and walking while new stories come out
+
+serves generated reuters-style archive pages (two sections, some latency per page)
+from a local stand-in and walks them with walk_archive, collecting the listed
+stories in a dict instead of the DB. the pages are files rewritten in place, so
+the live case can publish new stories mid-walk; that pushes every older story
+towards later pages, which is what partitions have to catch up with at their
+boundaries. every story listed before the walk started has to be seen
+
+run from the repo root:
+python -m benchmarks.bench_archive_backfill
+"""
+
+import os
+import time
+import tempfile
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+from reuters_archive import ArchivePlan, walk_archive
+from rss_dedup import canonical_url
+from benchmarks.fixture_server import FixtureServer
+
+SECTIONS = {'archive': '', 'hotStocksNews': 'hotStocksNews'}
+PAGE_SIZE = 10
+
+PAGE_TEMPLATE = """<html><body><div class="column1">
+<section class="module-content"><div class="news-headline-list">
+{}
+</div></section></div></body></html>"""
+STORY_TEMPLATE = """<article class="story ">
+<div class="story-photo lazy-photo "><a href="/article/{link}"><img src="x.jpg"></a></div>
+<div class="story-content"><a href="/article/{link}?feedType=RSS">
+<h3 class="story-title">
+  {title}</h3></a>
+<p>Shares of the company moved after the announcement on {day}.</p>
+<time class="article-time"><span class="timestamp">{day}</span></time></div>
+</article>"""
+
+
+class ArchiveFixture:
+    """
+    archive pages for SECTIONS written to fixture_dir, newest story first;
+    publish() adds stories to the front and rewrites the pages
+    """
+    def __init__(self, fixture_dir, n_pages, max_pages):
+        self.fixture_dir = fixture_dir
+        self.max_pages = max_pages
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.stories = {name: [] for name in SECTIONS}
+        self.routes = {}
+        for name, path in SECTIONS.items():
+            for page in range(1, max_pages + 1):
+                url_path = '/news/archive/{}?view=page&page={}&pageSize={}'.format(path, page, PAGE_SIZE)
+                self.routes[url_path] = '{}_{}.html'.format(name, page)
+        self.publish(n_pages * PAGE_SIZE)
+
+    def publish(self, n_stories):
+        with self.lock:
+            for name, stories in self.stories.items():
+                new = []
+                for _ in range(n_stories):
+                    i = next(self.ids)
+                    day = (datetime(2019, 10, 18) + timedelta(minutes=i)).strftime('%b %d %Y %H:%M')
+                    new.append({'link': '{}-{}-idUS{}'.format(name, i, i), 'title': '{} story {}'.format(name, i), 'day': day})
+                stories[:0] = reversed(new)
+            self.write()
+
+    def write(self):
+        for name, stories in self.stories.items():
+            for page in range(1, self.max_pages + 1):
+                listed = stories[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+                html = PAGE_TEMPLATE.format('\n'.join(STORY_TEMPLATE.format(**s) for s in listed))
+                path = os.path.join(self.fixture_dir, '{}_{}.html'.format(name, page))
+                # replace whole files so the server never reads a half-written page
+                with open(path + '.tmp', 'w') as f:
+                    f.write(html)
+                os.replace(path + '.tmp', path)
+
+    def listed_links(self, server):
+        with self.lock:
+            return {canonical_url(server.url('/article/' + s['link'])) for stories in self.stories.values() for s in stories}
+
+
+def walk(server, checkpoint, n_fetchers, host_rate, max_pages, pages_per_partition, stories, stop_after=None, max_overrun=50):
+    lock = threading.Lock()
+    stop = threading.Event()
+    walked = []
+
+    def save_stories(section, df):
+        with lock:
+            for link in df['feedburner_origlink']:
+                link = canonical_url(link)
+                stories[link] = stories.get(link, 0) + 1
+            walked.append(section)
+            if stop_after is not None and len(walked) >= stop_after:
+                stop.set()
+
+    plan = ArchivePlan.load_or_create(checkpoint, SECTIONS, max_pages, pages_per_partition)
+    start = time.time()
+    stats = walk_archive(plan, save_stories, n_fetchers=n_fetchers, host_rate=host_rate, page_size=PAGE_SIZE,
+                         url_template=server.url('/news/archive/{section}?view=page&page={page}&pageSize={page_size}'),
+                         stop=stop, max_overrun=max_overrun)
+    return stats, time.time() - start
+
+
+def report(label, expected, stories):
+    missed = len(expected - set(stories))
+    repeated = sum(n - 1 for n in stories.values())
+    print('{}: {} of {} stories missed, {} listed more than once (partition boundaries)'.format(
+            label, missed, len(expected), repeated))
+    return missed
+
+
+def run(n_pages=60, max_pages=120, pages_per_partition=10, latency=0.1, host_rate=20, n_fetchers=8,
+        publish_every=0.5, publish_n=3):
+    fixture_dir = tempfile.mkdtemp()
+    fixture = ArchiveFixture(fixture_dir, n_pages, max_pages)
+    delays = {path: latency for path in fixture.routes}
+    print('{} sections x {} pages, {:.2f}s per page, at most {} pages/sec'.format(
+            len(SECTIONS), n_pages, latency, host_rate))
+
+    with FixtureServer(fixture.routes, delays, fixture_dir=fixture_dir, content_type='text/html') as server:
+        expected = fixture.listed_links(server)
+        for label, fetchers in [('one page at a time', 1), ('{} partitions at once'.format(n_fetchers), n_fetchers)]:
+            checkpoint = os.path.join(fixture_dir, 'checkpoint_{}.json'.format(fetchers))
+            stories = {}
+            stats, elapsed = walk(server, checkpoint, fetchers, host_rate, max_pages, pages_per_partition, stories)
+            print('{}: {} pages in {:.2f}s, {:.1f} pages/sec'.format(label, stats['pages'], elapsed, stats['pages'] / elapsed))
+            assert report(label, expected, stories) == 0
+
+        # stopped partway, then resumed from the checkpoint
+        checkpoint = os.path.join(fixture_dir, 'checkpoint_resume.json')
+        stories = {}
+        stats, elapsed = walk(server, checkpoint, n_fetchers, host_rate, max_pages, pages_per_partition, stories,
+                              stop_after=n_pages)
+        print('stopped after {} pages ({:.2f}s)'.format(stats['pages'], elapsed))
+        stats, elapsed = walk(server, checkpoint, n_fetchers, host_rate, max_pages, pages_per_partition, stories)
+        print('resumed: {} more pages in {:.2f}s'.format(stats['pages'], elapsed))
+        assert report('stop + resume', expected, stories) == 0
+
+        # new stories published while walking, with and without catching up at boundaries
+        for label, max_overrun in [('live, no catching up', 0), ('live, catching up', 50)]:
+            expected = fixture.listed_links(server)
+            publishing = threading.Event()
+
+            def publish():
+                while not publishing.wait(publish_every):
+                    fixture.publish(publish_n)
+
+            publisher = threading.Thread(target=publish)
+            publisher.start()
+            stories = {}
+            checkpoint = os.path.join(fixture_dir, 'checkpoint_live_{}.json'.format(max_overrun))
+            try:
+                stats, elapsed = walk(server, checkpoint, n_fetchers, host_rate, max_pages, pages_per_partition, stories,
+                                      max_overrun=max_overrun)
+            finally:
+                publishing.set()
+                publisher.join()
+            print('{}: {} pages in {:.2f}s'.format(label, stats['pages'], elapsed))
+            missed = report(label, expected, stories)
+        assert missed == 0
+
+
+if __name__ == '__main__':
+    run()
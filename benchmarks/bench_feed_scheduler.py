@@ -0,0 +1,65 @@
+"""
+benchmark: FeedScheduler with a few hundred feeds on different intervals
+
+serves the recorded rss xml (with conditional GET) from a local stand-in for
+n_feeds feeds, split between fast, medium and slow poll intervals, runs the
+scheduler for a while and prints how many polls each group got compared to
+what its interval asks for, and how late polls ran compared to their due time
+
+run from the repo root:
+python -m benchmarks.bench_feed_scheduler
+"""
+
+import time
+
+from feed_poller import FeedPoller
+from feed_scheduler import FeedScheduler
+from benchmarks.fixture_server import FixtureServer
+
+# group -> poll interval in seconds
+GROUPS = {'fast': 1, 'medium': 3, 'slow': 10}
+
+
+def run(n_feeds=300, seconds=20, latency=0.05, max_in_flight=50):
+    names = ['{}_{}'.format(group, i) for i in range(n_feeds // len(GROUPS)) for group in GROUPS]
+    routes = {'/' + name: 'rss/companyNews.xml' for name in names}
+    delays = {path: latency for path in routes}
+    intervals = {name: GROUPS[name.split('_')[0]] for name in names}
+
+    with FixtureServer(routes, delays, conditional=True) as server:
+        poller = FeedPoller({name: server.url('/' + name) for name in names}, max_in_flight=max_in_flight)
+        scheduler = FeedScheduler(intervals, poller)
+        polls = {name: 0 for name in names}
+        lateness = []
+
+        # count polls by wrapping poll, and see how far behind the due time each round starts
+        poll = poller.poll
+
+        def counting_poll(due_names):
+            now = time.time()
+            for name in due_names:
+                polls[name] += 1
+            lateness.append(now - due_at[0])
+            return poll(due_names)
+
+        due_at = [time.time()]
+        poller.poll = counting_poll
+        start = time.time()
+        while time.time() - start < seconds:
+            due_at[0] = scheduler.heap[0][0]
+            scheduler.run(lambda feed_entries: None, max_polls=1)
+        elapsed = time.time() - start
+        poller.close()
+
+    print('{} feeds for {:.0f}s, {} scheduler rounds'.format(len(names), elapsed, len(lateness)))
+    for group, interval in GROUPS.items():
+        group_polls = [n for name, n in polls.items() if name.startswith(group + '_')]
+        expected = elapsed / interval + 1
+        print('{:>6} (every {}s): {:.1f} polls per feed, {:.1f} expected'.format(
+                group, interval, sum(group_polls) / len(group_polls), expected))
+    lateness.sort()
+    print('round start lag: median {:.3f}s, max {:.3f}s'.format(lateness[len(lateness) // 2], lateness[-1]))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,68 @@
+"""
+import-time guard for scrape_reuters_rss
+
+runs `python -X importtime -c "import scrape_reuters_rss"` in a fresh interpreter,
+prints the slowest imports, and exits non-zero if the import takes longer than
+--max-seconds or pulls in a module that should only load on first use (spaCy,
+VADER)
+
+run from the repo root:
+python -m benchmarks.bench_import_time
+"""
+
+import sys
+import argparse
+import subprocess
+
+# these should only be imported lazily, by story_nlp.get_nlp / sentiment.get_analyzer
+LAZY_MODULES = ['spacy', 'vaderSentiment']
+
+
+def parse_importtime(stderr):
+    """
+    returns list of (cumulative microseconds, module name) from -X importtime output
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # nested imports keep their indent (2 spaces per level) after the first space
+        rows.append((int(cumulative_us), name[1:].rstrip()))
+    return rows
+
+
+def run(module='scrape_reuters_rss', max_seconds=3.0, top=15):
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         capture_output=True, text=True)
+    if res.returncode != 0:
+        print(res.stderr[-2000:])
+        sys.exit('importing {} failed'.format(module))
+
+    rows = parse_importtime(res.stderr)
+    total = dict((name.strip(), us) for us, name in rows).get(module, 0) / 1e6
+    print('import {}: {:.2f}s'.format(module, total))
+    print('slowest imports (cumulative):')
+    # only top-level packages, nested ones are already counted in their parents
+    top_level = [(us, name) for us, name in rows if not name.startswith(' ')]
+    for us, name in sorted(top_level, reverse=True)[:top]:
+        print('{:>8.3f}s  {}'.format(us / 1e6, name))
+
+    eager = sorted(set(name.strip().split('.')[0] for _, name in rows) & set(LAZY_MODULES))
+    failed = False
+    if eager:
+        print('imported at module level but should be lazy:', ', '.join(eager))
+        failed = True
+    if total > max_seconds:
+        print('import took longer than the {:.2f}s budget'.format(max_seconds))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='scrape_reuters_rss')
+    parser.add_argument('--max-seconds', type=float, default=3.0)
+    args = parser.parse_args()
+    run(args.module, args.max_seconds)
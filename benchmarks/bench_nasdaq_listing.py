@@ -0,0 +1,97 @@
+"""
+benchmark: nasdaq listing builder against a saved companies-by-name page
+
+- building the ticker DataFrame row by row (the old df.append loop, done with
+  pd.concat since DataFrame.append is gone from current pandas) vs parse_listing_rows
+- market cap parsing with a per-row .apply vs the vectorized clean_abbreviations
+- fetching paginated listings one page at a time vs get_stocks_paged's thread pool
+
+run from the repo root:
+python -m benchmarks.bench_nasdaq_listing
+"""
+
+import time
+import string
+
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup as bs
+
+from scrape_nasdaq_list_of_companies import parse_listing_rows, clean_abbreviations, get_stocks_paged
+from benchmarks.fixture_server import FixtureServer, FIXTURE_DIR
+
+FIXTURE = 'html/nasdaq_companies_by_name.html'
+
+
+def append_rows(soup):
+    # the old add_stocks/get_all_stocks loop
+    df = pd.DataFrame()
+    table = soup.find('table', {'id': 'CompanylistResults'})
+    for stk in table.findAll('tr')[1:]:
+        deets = stk.findAll('td')
+        if len(deets) != 7:
+            continue
+        row = pd.DataFrame([{'company_name': deets[0].text.strip(),
+                             'market_cap': deets[2].text.strip(),
+                             'country': deets[4].text.strip(),
+                             'ipo_year': deets[5].text.strip(),
+                             'subsector': deets[6].text.strip()}],
+                           index=[deets[1].text.strip()])
+        df = pd.concat([df, row])
+    return df
+
+
+def clean_abbreviation_scalar(x):
+    # the old row-by-row clean_abbreviations
+    if pd.isnull(x) or x == 'n/a':
+        return np.nan
+    elif 'K' in x:
+        return float(x[:-1]) * 1e3
+    elif 'M' in x:
+        return float(x[:-1]) * 1e6
+    elif 'B' in x:
+        return float(x[:-1]) * 1e9
+    else:
+        return float(x)
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = fn(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def run(letters=string.ascii_uppercase[:10], pages_per_letter=5, latency=0.2):
+    with open(FIXTURE_DIR + '/' + FIXTURE, 'rb') as f:
+        soup = bs(f.read(), 'lxml')
+
+    old_df, old_t = timed(append_rows, soup)
+    new_df, new_t = timed(parse_listing_rows, soup)
+    print('build frame ({} rows): row append {:.3f}s, build once {:.3f}s, {:.1f}x'.format(
+            new_df.shape[0], old_t, new_t, old_t / new_t))
+
+    # repeat the column so the timing isn't just overhead
+    caps = pd.concat([new_df['market_cap']] * 50, ignore_index=True)
+    _, old_t = timed(lambda c: c.apply(lambda x: x.replace('$', '')).apply(clean_abbreviation_scalar), caps)
+    _, new_t = timed(clean_abbreviations, caps)
+    print('market cap ({} values): apply {:.3f}s, vectorized {:.3f}s, {:.1f}x'.format(
+            caps.shape[0], old_t, new_t, old_t / new_t))
+
+    # the fixture's last-page link says there are 5 pages
+    routes = {'/companies?letter={}&page={}'.format(l, p): FIXTURE
+              for l in letters for p in range(1, pages_per_letter + 1)}
+    delays = {path: latency for path in routes}
+    with FixtureServer(routes, delays, content_type='text/html') as server:
+        base_link = server.url('/companies?{}&page={}')
+        _, seq_t = timed(get_stocks_paged, letters, 1, base_link, repeat=1)
+        df, conc_t = timed(get_stocks_paged, letters, 16, base_link, repeat=1)
+    print('paged fetch ({} pages): one at a time {:.2f}s, thread pool {:.2f}s, {:.1f}x'.format(
+            len(routes), seq_t, conc_t, seq_t / conc_t))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,92 @@
+"""
+benchmark: n independent NLP processes (each loading its own model, like running
+several scrapers) vs an NLPPool of n forked workers sharing one model
+
+runs over the bodies in story_df.ft and prints docs/sec and the total memory of
+all the processes involved, as PSS (proportional set size: shared pages are split
+between the processes sharing them, so the sum is the real footprint). linux only,
+since it reads /proc/<pid>/smaps_rollup
+
+run from the repo root:
+python -m benchmarks.bench_nlp_pool --limit 1000 --n-workers 4
+python -m benchmarks.bench_nlp_pool --model en_core_web_sm
+"""
+
+import os
+import time
+import argparse
+import multiprocessing as mp
+
+import pandas as pd
+
+from story_nlp import NLP_MODEL, load_nlp
+from nlp_pool import NLPPool, doc_record
+
+
+def pss_mb(pid='self'):
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def run_independent(bodies, model, batch_size, out_q, done):
+    nlp = load_nlp(model)
+    for doc in nlp.pipe(bodies, batch_size=batch_size):
+        doc_record(doc)
+    out_q.put(os.getpid())
+    # stay alive so the parent can measure every process at once
+    done.wait()
+
+
+def independent(bodies, model, n_workers, batch_size):
+    ctx = mp.get_context('spawn')
+    out_q = ctx.Queue()
+    done = ctx.Event()
+    shares = [bodies[i::n_workers] for i in range(n_workers)]
+    start = time.time()
+    procs = [ctx.Process(target=run_independent, args=(share, model, batch_size, out_q, done)) for share in shares]
+    for p in procs:
+        p.start()
+    pids = [out_q.get() for _ in procs]
+    elapsed = time.time() - start
+    total_pss = sum(pss_mb(pid) for pid in pids)
+    done.set()
+    for p in procs:
+        p.join()
+    return elapsed, total_pss
+
+
+def pooled(bodies, model, n_workers, batch_size):
+    start = time.time()
+    pool = NLPPool(n_workers, model=model, batch_size=batch_size).start()
+    for _ in pool.pipe(bodies):
+        pass
+    elapsed = time.time() - start
+    total_pss = pss_mb() + sum(pss_mb(p.pid) for p in pool.workers)
+    pool.close()
+    return elapsed, total_pss
+
+
+def run(filename='story_df.ft', limit=1000, model=NLP_MODEL, n_workers=4, batch_size=16):
+    bodies = pd.read_feather(filename, columns=['body'])['body'].dropna().tolist()[:limit]
+    print('{} docs, model {}, {} workers'.format(len(bodies), model, n_workers))
+
+    elapsed, total_pss = independent(bodies, model, n_workers, batch_size)
+    print('{:>12}: {:.1f} docs/sec (including model loads), total PSS {:.0f} MB'.format(
+            'independent', len(bodies) / elapsed, total_pss))
+    elapsed, total_pss = pooled(bodies, model, n_workers, batch_size)
+    print('{:>12}: {:.1f} docs/sec (including model load), total PSS {:.0f} MB'.format(
+            'NLPPool', len(bodies) / elapsed, total_pss))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filename', default='story_df.ft')
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--model', default=NLP_MODEL)
+    parser.add_argument('--n-workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+    run(args.filename, args.limit, args.model, args.n_workers, args.batch_size)
@@ -0,0 +1,78 @@
+"""
+benchmark: BeautifulSoup story parsing vs the lxml XPath extractor
+
+parses every saved reuters article fixture (fixtures/html/reuters_*.html) many
+times with the old bs4 parse_story and with parse_story as it is now, prints the
+per-page parse time for each, and the tail of each body so the boilerplate trimming
+can be checked by eye
+
+run from the repo root:
+python -m benchmarks.bench_parse_story
+"""
+
+import os
+import glob
+import time
+
+import pandas as pd
+from bs4 import BeautifulSoup as bs
+
+from scrape_reuters_rss import parse_story
+from benchmarks.fixture_server import FIXTURE_DIR
+
+
+def parse_story_bs(content):
+    # the old parse_story, boilerplate branches and all
+    soup = bs(content, 'lxml')
+    datetime_str = soup.find('div', {'class': 'ArticleHeader_date'}).text.split('/')
+    article_datetime = pd.to_datetime(datetime_str[0].strip() + ' ' + datetime_str[1].strip()).tz_localize('UTC')
+    body = soup.find('div', {'class': 'StandardArticleBody_body'}).text
+    loc_reporting_idx = body.find(' - ') + 3
+    body = body[loc_reporting_idx:]
+    if 'Additional reporting by' in body:
+        ar_idx = body.find('Additional reporting')
+        body = body[:ar_idx].strip()
+    elif 'Writing by ' in body:
+        wb_idx = body.find('Additional reporting')
+        body = body[:wb_idx].strip()
+    elif 'Editing by ' in body:
+        eb_idx = body.find('Additional reporting')
+        body = body[:eb_idx].strip()
+    elif 'Our Standards: ' in body:
+        os_idx = body.find('Additional reporting')
+        body = body[:os_idx].strip()
+
+    return article_datetime, body
+
+
+def time_parser(parse_fn, pages, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        for content in pages:
+            parse_fn(content)
+    return (time.time() - start) / (repeat * len(pages))
+
+
+def run(repeat=200):
+    paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, 'html', 'reuters_*.html')))
+    pages = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+
+    for path, content in zip(paths, pages):
+        old_dt, old_body = parse_story_bs(content)
+        new_dt, new_body = parse_story(content)
+        print(os.path.basename(path))
+        print('  datetime match:', old_dt == new_dt)
+        print('  bs4 body ends:  ...' + old_body[-70:])
+        print('  lxml body ends: ...' + new_body[-70:])
+
+    old_t = time_parser(parse_story_bs, pages, repeat)
+    new_t = time_parser(parse_story, pages, repeat)
+    print('{} pages x {}: bs4 {:.2f}ms/page, lxml {:.2f}ms/page, {:.1f}x'.format(
+            len(pages), repeat, old_t * 1000, new_t * 1000, old_t / new_t))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,77 @@
+"""
+benchmark: per-story nlp(body) on the full pipeline vs trimmed nlp.pipe batches
+
+runs over the bodies in story_df.ft; each mode runs in a fresh process so the peak
+RSS numbers don't include the other mode's model
+
+run from the repo root:
+python -m benchmarks.bench_story_nlp --limit 500 --batch-size 32 --n-process 1
+python -m benchmarks.bench_story_nlp --model en_core_web_sm
+"""
+
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+import pandas as pd
+import spacy
+
+from story_nlp import NLP_MODEL, load_nlp, pipe_docs
+
+
+def touch(doc):
+    """
+    uses the same attributes as analyze_story, so lazy work isn't skipped
+    """
+    n = 0
+    for ent in doc.ents:
+        n += len(list(ent.rights)) + len(ent.sent.text)
+    return n
+
+
+def run_mode(mode, bodies, model, batch_size, n_process, out_q):
+    start = time.time()
+    if mode == 'per_story':
+        nlp = spacy.load(model)
+        load_time = time.time() - start
+        start = time.time()
+        for body in bodies:
+            touch(nlp(body))
+    else:
+        nlp = load_nlp(model)
+        load_time = time.time() - start
+        start = time.time()
+        for doc in pipe_docs(nlp, bodies, batch_size=batch_size, n_process=n_process):
+            touch(doc)
+
+    elapsed = time.time() - start
+    # ru_maxrss is in KB on linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    out_q.put((mode, load_time, elapsed, peak_rss_mb))
+
+
+def run(filename='story_df.ft', limit=500, model=NLP_MODEL, batch_size=32, n_process=1):
+    bodies = pd.read_feather(filename, columns=['body'])['body'].dropna().tolist()[:limit]
+    print('{} docs, model {}'.format(len(bodies), model))
+
+    ctx = mp.get_context('spawn')
+    out_q = ctx.Queue()
+    for mode in ['per_story', 'pipe']:
+        p = ctx.Process(target=run_mode, args=(mode, bodies, model, batch_size, n_process, out_q))
+        p.start()
+        mode, load_time, elapsed, peak_rss_mb = out_q.get()
+        p.join()
+        print('{:>10}: load {:.1f}s, {:.1f} docs/sec, peak RSS {:.0f} MB'.format(
+                mode, load_time, len(bodies) / elapsed, peak_rss_mb))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filename', default='story_df.ft')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--model', default=NLP_MODEL)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--n-process', type=int, default=1)
+    args = parser.parse_args()
+    run(args.filename, args.limit, args.model, args.batch_size, args.n_process)
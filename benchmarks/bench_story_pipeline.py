@@ -0,0 +1,68 @@
+"""
+benchmark: one-story-at-a-time scraping vs the staged StoryPipeline
+
+serves a saved Reuters article from a local stand-in with some latency per page,
+then runs fetch + parse + NLP for every story, writing to a list instead of the DB
+
+run from the repo root (needs the spaCy model from scrape_reuters_rss):
+python -m benchmarks.bench_story_pipeline
+"""
+
+import time
+
+import pandas as pd
+
+from story_pipeline import StoryPipeline
+from feed_poller import make_session
+from benchmarks.fixture_server import FixtureServer
+import scrape_reuters_rss as srr
+
+
+def make_rss_df(server, n_stories):
+    rows = []
+    for i in range(n_stories):
+        rows.append({'feedburner_origlink': server.url('/article/{}'.format(i)),
+                     'title': 'Match Group shares fall after Tinder founders sue parent company'})
+    return pd.DataFrame(rows)
+
+
+def run(n_stories=200, latency=0.2, n_fetchers=16, n_processors=2):
+    routes = {'/article/{}'.format(i): 'html/reuters_article.html' for i in range(n_stories)}
+    delays = {path: latency for path in routes}
+    with FixtureServer(routes, delays, content_type='text/html') as server:
+        rss_df = make_rss_df(server, n_stories)
+
+        # same work as scrape_story, minus the DB
+        written = []
+        start = time.time()
+        for i, r in rss_df.iterrows():
+            content = srr.fetch_story(r['feedburner_origlink'])
+            article_datetime, body = srr.parse_story(content)
+            written.append(srr.analyze_story(r, body, article_datetime))
+        seq = time.time() - start
+        print('sequential: {} stories in {:.2f}s, {:.1f} stories/sec'.format(len(written), seq, len(written) / seq))
+
+        session = make_session(n_fetchers)
+
+        def process(r_content):
+            r, content = r_content
+            article_datetime, body = srr.parse_story(content)
+            return srr.analyze_story(r, body, article_datetime)
+
+        written = []
+        pipeline = StoryPipeline(lambda r: (r, srr.fetch_story(r['feedburner_origlink'], session=session)),
+                                 process,
+                                 written.extend,
+                                 n_fetchers=n_fetchers,
+                                 n_processors=n_processors,
+                                 # everything is on one host here, so don't let the limit dominate
+                                 host_rate=1000,
+                                 url_fn=lambda r: r['feedburner_origlink'])
+        stats = pipeline.run(r for i, r in rss_df.iterrows())
+        session.close()
+        print('pipeline: {} stories in {:.2f}s, {:.1f} stories/sec'.format(
+                stats['written'], stats['seconds'], stats['stories_per_sec']))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,95 @@
+"""
+tiny local http stand-in for benchmarks
+
+serves files from a fixture directory, optionally sleeping per path to mimic slow
+feeds/sites, so benchmarks don't hit the real network
+"""
+
+import os
+import time
+import hashlib
+import threading
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class FixtureServer:
+    """
+    args:
+    routes -- dict of url path -> filename (relative to fixture_dir)
+    delays -- dict of url path -> seconds to sleep before responding
+    content_type -- sent with every 200 response
+    conditional -- send ETag/Last-Modified and answer matching requests with a 304
+    """
+    def __init__(self, routes, delays=None, fixture_dir=FIXTURE_DIR,
+                 content_type='application/rss+xml', conditional=False):
+        self.routes = routes
+        self.conditional = conditional
+        self.not_modified = 0
+        self.delays = delays or {}
+        self.fixture_dir = fixture_dir
+        self.content_type = content_type
+        self.hits = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path
+                with server._lock:
+                    server.hits += 1
+                time.sleep(server.delays.get(path, 0))
+                if path not in server.routes:
+                    self.send_error(404)
+                    return
+                filename = server.routes[path]
+                body = server.read_fixture(filename)
+                if server.conditional:
+                    etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                    if self.headers.get('If-None-Match') == etag:
+                        with server._lock:
+                            server.not_modified += 1
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.end_headers()
+                        return
+
+                self.send_response(200)
+                self.send_header('Content-Type', server.content_type)
+                if server.conditional:
+                    mtime = os.path.getmtime(os.path.join(server.fixture_dir, filename))
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', formatdate(mtime, usegmt=True))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server._lock:
+                    server.bytes_sent += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def read_fixture(self, filename):
+        with open(os.path.join(self.fixture_dir, filename), 'rb') as f:
+            return f.read()
+
+    def url(self, path):
+        host, port = self.httpd.server_address
+        return 'http://{}:{}{}'.format(host, port, path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
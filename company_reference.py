@@ -0,0 +1,164 @@
+"""
+company reference data from the dated nasdaq listing snapshots
+
+snapshots are nasdaq_stock_listing_YYYY-MM-DD files; the first time a csv
+snapshot is loaded it is converted to a feather file next to it, which is what
+gets read from then on. the latest snapshot is picked automatically and kept in
+memory, with plain dict indexes for ticker -> company and name -> ticker lookups
+"""
+
+import os
+import re
+import glob
+import threading
+from collections import namedtuple
+
+import pandas as pd
+
+LISTING_DIR = os.path.dirname(os.path.abspath(__file__))
+LISTING_PREFIX = 'nasdaq_stock_listing_'
+SNAPSHOT_DATE_RE = re.compile(LISTING_PREFIX + r'(\d{4}-\d{2}-\d{2})\.(csv|ft)$')
+
+# corporate suffixes dropped to get the short alias of a company name
+SUFFIX_RE = re.compile(r'(,?\s+(inc|incorporated|corp|corporation|co|company|ltd|limited|plc|llc|l\.?p|n\.?v|s\.?a|ag))+\.?$')
+WHITESPACE_RE = re.compile(r'\s+')
+# aliases shorter than this are too ambiguous to match on
+MIN_ALIAS_LEN = 4
+# country at the end of a name, dropped for a shorter alias ("T-Mobile US" -> "t-mobile")
+COUNTRY_SUFFIX_RE = re.compile(r'\s+(us|usa|u\.s\.|uk|u\.k\.)$')
+# companies at least this big (market cap, $) are indexed under their short name
+# even if it's a common word: news calls them "Target" and "Sprint", and
+# entity_linker makes one-word names confirm the match anyway
+LARGE_CAP = 10e9
+# one-word aliases that are ordinary words, so for smaller companies a match says
+# nothing (Fox News isn't News Corp, "the best" isn't BSTI)
+COMMON_WORD_ALIASES = frozenset([
+    'ability', 'access', 'act', 'advance', 'agree', 'alpha', 'american', 'apex', 'applied', 'arch', 'ark',
+    'atlas', 'avid', 'axis', 'best', 'beyond', 'blue', 'bridge', 'bright', 'capital', 'care', 'central',
+    'century', 'change', 'china', 'citizens', 'city', 'clean', 'clear', 'community', 'core', 'crown',
+    'data', 'daily', 'digital', 'discovery', 'dynamic', 'eagle', 'energy', 'equity', 'first', 'focus',
+    'forward', 'frontier', 'future', 'general', 'global', 'gold', 'green', 'growth', 'harmony', 'health',
+    'heritage', 'home', 'horizon', 'impact', 'independence', 'insight', 'international', 'liberty',
+    'life', 'live', 'main', 'matrix', 'media', 'mobile', 'national', 'network', 'new', 'news', 'next',
+    'north', 'ocean', 'one', 'open', 'pacific', 'partners', 'peak', 'people', 'pioneer', 'power',
+    'premier', 'prime', 'progress', 'quest', 'rapid', 'reliance', 'republic', 'resources', 'river',
+    'royal', 'security', 'select', 'simply', 'smart', 'solar', 'south', 'sprint', 'square', 'standard',
+    'star', 'state', 'sterling', 'summit', 'sun', 'target', 'total', 'trust', 'union', 'united',
+    'universal', 'value', 'vision', 'west', 'world'])
+
+Company = namedtuple('Company', ['ticker', 'company_name', 'country', 'ipo_year', 'market_cap', 'subsector'])
+
+# date -> CompanyReference
+_references = {}
+_references_lock = threading.Lock()
+
+
+def normalize_name(name):
+    return WHITESPACE_RE.sub(' ', name.lower()).strip()
+
+
+def name_aliases(name, keep_common=False):
+    """
+    normalized full company name, the name without corporate suffixes and that
+    without a trailing country, leaving out ones in COMMON_WORD_ALIASES unless
+    keep_common
+    """
+    full = normalize_name(name)
+    short = SUFFIX_RE.sub('', full).strip(' ,.')
+    aliases = {full.rstrip('.'), short, COUNTRY_SUFFIX_RE.sub('', short)}
+    return [a for a in aliases if len(a) >= MIN_ALIAS_LEN and (keep_common or a not in COMMON_WORD_ALIASES)]
+
+
+def snapshot_dates(listing_dir=LISTING_DIR):
+    """
+    sorted list of dates ('YYYY-MM-DD') with a listing snapshot
+    """
+    dates = set()
+    for path in glob.glob(os.path.join(listing_dir, LISTING_PREFIX + '*')):
+        match = SNAPSHOT_DATE_RE.search(os.path.basename(path))
+        if match is not None:
+            dates.add(match.group(1))
+    return sorted(dates)
+
+
+def save_snapshot(df, date, listing_dir=LISTING_DIR):
+    """
+    saves a listing indexed by ticker as the binary snapshot for date
+    """
+    path = os.path.join(listing_dir, LISTING_PREFIX + date + '.ft')
+    df.reset_index().to_feather(path)
+    return path
+
+
+def load_snapshot(date=None, listing_dir=LISTING_DIR):
+    """
+    loads the listing snapshot for date (the latest if None), indexed by ticker
+    """
+    if date is None:
+        dates = snapshot_dates(listing_dir)
+        if len(dates) == 0:
+            raise FileNotFoundError('no nasdaq listing snapshots in ' + listing_dir)
+        date = dates[-1]
+
+    ft_path = os.path.join(listing_dir, LISTING_PREFIX + date + '.ft')
+    if os.path.exists(ft_path):
+        return pd.read_feather(ft_path).set_index('ticker')
+
+    df = pd.read_csv(os.path.join(listing_dir, LISTING_PREFIX + date + '.csv'), index_col='ticker')
+    save_snapshot(df, date, listing_dir)
+    return df
+
+
+class CompanyReference:
+    """
+    in-memory company lookups for one listing snapshot
+
+    args:
+    listing -- DataFrame indexed by ticker with the nasdaq listing columns
+    date -- snapshot date
+    """
+    def __init__(self, listing, date=None):
+        self.listing = listing
+        self.date = date
+        self.companies = {}
+        for ticker, row in zip(listing.index, listing.itertuples(index=False)):
+            self.companies[ticker] = Company(ticker, row.company_name, row.country,
+                                             row.ipo_year, row.market_cap, row.subsector)
+
+        # when several tickers share a name (e.g. preferred shares), the biggest
+        # company and then the shortest ticker wins
+        named = [c for c in self.companies.values() if isinstance(c.company_name, str)]
+        named.sort(key=lambda c: (-(c.market_cap if c.market_cap == c.market_cap else -1), len(c.ticker)))
+        self.name_index = {}
+        for c in named:
+            for alias in name_aliases(c.company_name, keep_common=c.market_cap >= LARGE_CAP):
+                self.name_index.setdefault(alias, c.ticker)
+
+    def lookup(self, ticker):
+        """
+        Company for ticker, or None
+        """
+        return self.companies.get(ticker)
+
+    def ticker_for_name(self, name):
+        """
+        ticker for a company name or alias, e.g. 'Match Group Inc' -> 'MTCH'
+        """
+        for alias in name_aliases(name, keep_common=True):
+            if alias in self.name_index:
+                return self.name_index[alias]
+        return None
+
+
+def get_reference(date=None):
+    """
+    process-wide CompanyReference for date (the latest snapshot if None)
+    """
+    if date is None:
+        dates = snapshot_dates()
+        date = dates[-1] if dates else None
+
+    with _references_lock:
+        if date not in _references:
+            _references[date] = CompanyReference(load_snapshot(date), date)
+        return _references[date]
@@ -0,0 +1,158 @@
+"""
+links stories to stocks
+
+built once from the company reference data:
+- precompiled regexes for RICs like (MTCH.O)
+- an Aho-Corasick automaton over the reference's name index, i.e. normalized company
+  names and their short aliases
+  ("Match Group, Inc." -> "match group, inc.", "match group"), so companies
+  mentioned without a ticker are found in one pass over the story
+- rapidfuzz cdist scoring of spaCy entities against the handful of company names
+  found in a story, instead of fuzz.ratio for every entity/stock pair
+
+one-word names ("Square", "Target") are easily ordinary words, so those only
+count when something else backs them up: the company's RIC in the story, a
+corporate suffix right after the name, or a spaCy entity that is exactly the name
+"""
+
+import re
+import threading
+
+import numpy as np
+import ahocorasick
+from rapidfuzz import process, fuzz
+
+from company_reference import SUFFIX_RE, get_reference, normalize_name
+
+# RIC in parentheses, e.g. (MTCH.O); group 1 is the ticker
+RIC_RE = re.compile(r'\(([A-Z]+)\.[A-Z]+\)')
+# for stripping RICs out of entity text, e.g. Xcel Energy Inc (XEL.O
+RIC_CLEAN_RE = re.compile(r'\([A-Z]+\.[A-Z]+\)*')
+# corporate suffix right after a name, e.g. Square Inc
+FOLLOWING_SUFFIX_RE = re.compile(r',?\s+(Inc|Incorporated|Corp|Corporation|Co|Company|Ltd|Limited|PLC|Plc|LLC|LP|L\.P|NV|N\.V|SA|S\.A|AG)\b')
+POSSESSIVE_RE = re.compile(r"['’]s$")
+
+_linker = None
+_linker_lock = threading.Lock()
+
+
+class EntityLinker:
+    """
+    args:
+    reference -- company_reference.CompanyReference
+    """
+    def __init__(self, reference):
+        self.reference = reference
+        self.alias_to_ticker = reference.name_index
+        self.automaton = ahocorasick.Automaton()
+        for alias, ticker in self.alias_to_ticker.items():
+            self.automaton.add_word(alias, (alias, ticker))
+        self.automaton.make_automaton()
+
+    def find_tickers(self, text):
+        """
+        tickers from the RICs in text, in order (with repeats)
+        """
+        return RIC_RE.findall(text)
+
+    def find_companies(self, text, ent_texts=()):
+        """
+        companies mentioned by name in text, with or without a ticker
+
+        args:
+        ent_texts -- spaCy entity texts of the story, to confirm one-word names
+
+        returns dict of ticker -> list of (start, end) character spans; matches have
+        to be whole words and start with a capital letter or digit, and only the
+        longest of overlapping matches is kept. one-word names also have to be
+        confirmed (see the module docstring)
+        """
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # a few unicode characters change length when lowercased; keep offsets aligned
+            lowered = ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+        matches = []
+        for end, (alias, ticker) in self.automaton.iter(lowered):
+            start = end - len(alias) + 1
+            end += 1
+            if start > 0 and lowered[start - 1].isalnum():
+                continue
+            if end < len(lowered) and lowered[end].isalnum():
+                continue
+            if not (text[start].isupper() or text[start].isdigit()):
+                continue
+            matches.append((start, end, ticker))
+
+        found = {}
+        last_end = -1
+        for start, end, ticker in sorted(matches, key=lambda m: (m[0], m[0] - m[1])):
+            if start < last_end:
+                continue
+            found.setdefault(ticker, []).append((start, end))
+            last_end = end
+
+        # a longer match already took care of overlapping one-word ones above
+        single = [t for t, spans in found.items() if all(' ' not in text[s:e] for s, e in spans)]
+        if len(single) > 0:
+            rics = set(self.find_tickers(text))
+            ents = {normalize_entity(e) for e in ent_texts}
+            for ticker in single:
+                confirmed = ticker in rics or any(FOLLOWING_SUFFIX_RE.match(text, e) or text[s:e].lower() in ents
+                                                  for s, e in found[ticker])
+                if not confirmed:
+                    del found[ticker]
+
+        return found
+
+    def link_entities(self, ent_texts, full_stock_names, cutoff=50):
+        """
+        matches entity texts to stocks
+
+        an entity refers to a stock if it is contained in the stock's full name or
+        their fuzz.ratio is above cutoff; all pairs are scored in one cdist call.
+        one-word names only match entities that are exactly the name (give or take
+        case, a possessive and a corporate suffix), so "Fox News" doesn't link to a stock named "News"
+
+        args:
+        ent_texts -- list of entity strings, e.g. [ent.text for ent in doc.ents]
+        full_stock_names -- dict of ticker -> company name as written in the story
+
+        returns dict of ticker -> list of indices into ent_texts, in order
+        """
+        if len(ent_texts) == 0 or len(full_stock_names) == 0:
+            return {}
+
+        tickers = list(full_stock_names)
+        names = [full_stock_names[t] for t in tickers]
+        scores = process.cdist(ent_texts, names, scorer=fuzz.ratio)
+        contained = np.array([[e in n for n in names] for e in ent_texts])
+        hits = contained | (scores > cutoff)
+        for j, name in enumerate(names):
+            if ' ' not in name.strip():
+                hits[:, j] = [normalize_entity(e) == normalize_entity(name) for e in ent_texts]
+        linked = {}
+        for i, j in zip(*np.nonzero(hits)):
+            linked.setdefault(tickers[j], []).append(int(i))
+
+        return linked
+
+
+def normalize_entity(text):
+    """
+    entity text without a RIC, possessive or corporate suffix, normalized like the
+    reference's names, for exact matching ("Square Inc's" -> "square")
+    """
+    name = normalize_name(POSSESSIVE_RE.sub('', RIC_CLEAN_RE.sub('', text).strip()))
+    return SUFFIX_RE.sub('', name).strip(' ,.')
+
+
+def get_entity_linker():
+    """
+    process-wide EntityLinker built from the latest company reference on first use
+    """
+    global _linker
+    with _linker_lock:
+        if _linker is None:
+            _linker = EntityLinker(get_reference())
+        return _linker
@@ -0,0 +1,179 @@
+"""
+concurrent rss feed poller
+
+fetches every feed at the same time over one pooled requests session, so a poll
+cycle takes about as long as the slowest feed instead of the sum of all of them
+
+sends back each feed's ETag / Last-Modified so unchanged feeds come back as a
+cheap 304, and keeps those validators in a json file so they survive restarts
+"""
+
+import os
+import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests as req
+from requests.adapters import HTTPAdapter
+import feedparser
+
+
+def make_session(pool_size=10):
+    """
+    creates a requests session with a connection pool big enough for pool_size
+    concurrent requests, so connections get reused between poll cycles
+    """
+    session = req.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_rss(content):
+    """
+    default feed parser: feedparser entries from the raw rss/atom bytes
+    """
+    return feedparser.parse(content)['entries']
+
+
+def backoff_delay(attempt, base=1, cap=60):
+    """
+    exponential backoff with full jitter -- a random delay between 0 and
+    min(cap, base * 2 ** attempt) seconds, so failing feeds don't retry in lockstep
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class FeedPoller:
+    """
+    polls a dict of {category: url} concurrently
+
+    args:
+    feeds -- dict of feed name to rss url, e.g. from feed_registry.feed_urls
+    max_in_flight -- cap on requests running at the same time
+    timeout -- per-feed request timeout in seconds
+    max_retries -- retries for a feed before giving up on it for this cycle
+    backoff_base, backoff_cap -- seconds, for the jittered exponential backoff
+    state_file -- json file for ETag/Last-Modified validators; None keeps them in memory only
+    parsers -- dict of feed name to a function from the response bytes to a list of
+        entries, for feeds that need something other than parse_rss
+    """
+    def __init__(self, feeds, max_in_flight=10, timeout=10, max_retries=4,
+                 backoff_base=1, backoff_cap=60, session=None, state_file=None, parsers=None):
+        self.feeds = feeds
+        self.parsers = parsers or {}
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.session = session or make_session(max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.state_file = state_file
+        # feed name -> {'etag', 'last_modified', 'content_length'}
+        self.validators = self.load_state()
+        # validators from the last poll, only kept once commit_state() is called
+        self.pending_validators = {}
+        self.last_cycle_stats = {}
+
+    def load_state(self):
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def commit_state(self):
+        """
+        keeps the validators from the last poll and writes them to state_file
+
+        call this after the new entries have been saved, otherwise a crash in between
+        would mean the next request gets a 304 and those entries are never stored
+        """
+        self.validators.update(self.pending_validators)
+        self.pending_validators = {}
+        if self.state_file is None:
+            return
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.validators, f)
+        os.replace(tmp_file, self.state_file)
+
+    def conditional_headers(self, name):
+        headers = {}
+        validators = self.validators.get(name, {})
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def fetch_feed(self, name, url):
+        """
+        downloads and parses one feed, retrying with backoff on errors and bad statuses
+
+        returns (status, entries, response) -- status is 200 or 304, or None with
+        no entries/response if every attempt failed; a 304 is not parsed
+        """
+        headers = self.conditional_headers(name)
+        for attempt in range(self.max_retries + 1):
+            try:
+                res = self.session.get(url, timeout=self.timeout, headers=headers)
+                if res.status_code == 304:
+                    return 304, None, res
+                if res.status_code == 200:
+                    return 200, self.parsers.get(name, parse_rss)(res.content), res
+                print(name, 'status is not good:', str(res.status_code))
+            except req.RequestException as e:
+                print(name, 'request failed:', e)
+
+            if attempt < self.max_retries:
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+
+        print(name, 'giving up for this cycle')
+        return None, None, None
+
+    def poll(self, names=None):
+        """
+        fetches all feeds (or just the ones in names) concurrently
+
+        returns dict of feed name -> list of entries; feeds that failed or were not
+        modified (304) are left out
+
+        counts for the cycle are kept in last_cycle_stats
+        """
+        if names is None:
+            names = list(self.feeds)
+        futures = {self.executor.submit(self.fetch_feed, name, self.feeds[name]): name
+                   for name in names}
+        results = {}
+        stats = {'fetched': 0, 'not_modified': 0, 'failed': 0,
+                 'bytes_downloaded': 0, 'bytes_saved': 0}
+        for fut in as_completed(futures):
+            name = futures[fut]
+            status, entries, res = fut.result()
+            if status is None:
+                stats['failed'] += 1
+                continue
+
+            if status == 304:
+                stats['not_modified'] += 1
+                # estimate of what we would have downloaded: the last full response
+                stats['bytes_saved'] += self.validators.get(name, {}).get('content_length', 0)
+                continue
+
+            print(name)
+            stats['fetched'] += 1
+            stats['bytes_downloaded'] += len(res.content)
+            self.pending_validators[name] = {'etag': res.headers.get('ETag'),
+                                             'last_modified': res.headers.get('Last-Modified'),
+                                             'content_length': len(res.content)}
+            results[name] = entries
+
+        self.last_cycle_stats = stats
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
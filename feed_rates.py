@@ -0,0 +1,123 @@
+"""
+adaptive poll intervals from how often each feed actually gets new entries
+
+each feed keeps an EWMA of the gap between its entries' publish times. polling a
+feed with arrival rate r every T seconds leaves its entries waiting T/2 on average,
+so the arrival-weighted mean detection latency over all feeds is
+
+    L = sum(r_i * T_i) / (2 * sum(r_i))
+
+for a fixed number of requests/sec, L is smallest with T_i proportional to
+1/sqrt(r_i) -- busy feeds are polled more often, quiet ones less. the constant is
+picked so L comes out at latency_budget, unless that would take more than
+max_requests_per_sec, in which case the request budget wins
+
+also keeps publish-to-ingest times for new entries, for the median/p99 report
+"""
+
+import time
+import calendar
+from collections import deque
+
+import numpy as np
+
+
+def entry_publish_time(entry):
+    """
+    publish time of a feedparser entry in epoch seconds, or None
+    """
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+    if parsed is None:
+        return None
+    # feedparser normalizes these to UTC
+    return calendar.timegm(parsed)
+
+
+class FeedRates:
+    """
+    args:
+    intervals -- dict of feed name -> configured interval in seconds, used as the
+        starting guess for the gap between entries
+    latency_budget -- target mean seconds from publish to poll
+    max_requests_per_sec -- cap on polls per second over all feeds
+    min_interval, max_interval -- bounds for any one feed's interval, in seconds
+    alpha -- EWMA weight of each new gap
+    max_samples -- publish-to-ingest times kept per feed
+    """
+    def __init__(self, intervals, latency_budget=60, max_requests_per_sec=1,
+                 min_interval=15, max_interval=1800, alpha=0.2, max_samples=1000):
+        self.latency_budget = latency_budget
+        self.max_requests_per_sec = max_requests_per_sec
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.gaps = dict(intervals)
+        self.last_publish = {}
+        self.last_arrival = {name: time.time() for name in intervals}
+        self.ingest_latency = {name: deque(maxlen=max_samples) for name in intervals}
+
+    def observe(self, name, entries, ingested_at=None):
+        """
+        updates the feed's gap estimate and latency samples from a poll's entries
+
+        entries published after the newest one seen before are new; on the first
+        poll of a feed nothing is new, since it's whatever backlog the feed has
+        """
+        ingested_at = time.time() if ingested_at is None else ingested_at
+        times = sorted(t for t in map(entry_publish_time, entries) if t is not None)
+        if len(times) == 0:
+            return
+
+        last = self.last_publish.get(name)
+        if last is not None:
+            for t in times:
+                if t <= last:
+                    continue
+                self.gaps[name] = self.alpha * (t - last) + (1 - self.alpha) * self.gaps[name]
+                self.ingest_latency[name].append(ingested_at - t)
+                last = t
+                self.last_arrival[name] = ingested_at
+
+        self.last_publish[name] = max(times[-1], last or times[-1])
+
+    def rate(self, name, now):
+        # a feed that has gone quiet for longer than its usual gap is treated as slower
+        gap = max(self.gaps[name], now - self.last_arrival[name])
+        return 1 / max(gap, 1e-6)
+
+    def intervals(self, now=None):
+        """
+        dict of feed name -> poll interval in seconds for the current rate estimates
+        """
+        now = time.time() if now is None else now
+        names = list(self.gaps)
+        rates = np.array([self.rate(name, now) for name in names])
+        sqrt_rates = np.sqrt(rates)
+        # T_i = c / sqrt(r_i); c for L == latency_budget, then for the request budget
+        c = 2 * self.latency_budget * rates.sum() / sqrt_rates.sum()
+        c = max(c, sqrt_rates.sum() / self.max_requests_per_sec)
+        intervals = np.clip(c / sqrt_rates, self.min_interval, self.max_interval)
+        return dict(zip(names, intervals.tolist()))
+
+    def latency_report(self):
+        """
+        dict of feed name -> {'n', 'median', 'p99'} publish-to-ingest seconds, for
+        feeds with any new entries seen
+        """
+        report = {}
+        for name, samples in self.ingest_latency.items():
+            if len(samples) == 0:
+                continue
+            median, p99 = np.percentile(np.array(samples), [50, 99])
+            report[name] = {'n': len(samples), 'median': median, 'p99': p99}
+        return report
+
+    def print_report(self):
+        intervals = self.intervals()
+        report = self.latency_report()
+        print('feed, interval (s), entry gap (s), new entries, publish-to-ingest median / p99 (s)')
+        for name in sorted(intervals, key=intervals.get):
+            line = '{}: {:.0f}, {:.0f}'.format(name, intervals[name], self.gaps[name])
+            if name in report:
+                line += ', {n}, {median:.0f} / {p99:.0f}'.format(**report[name])
+            print(line)
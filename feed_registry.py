@@ -0,0 +1,80 @@
+"""
+feeds to poll, loaded from a json config (feeds.json):
+
+{
+ "defaults": {"interval": 300, "parser": "rss", "enabled": true},
+ "feeds": [
+  {"name": "company", "source": "reuters", "url": "http://feeds.reuters.com/reuters/companyNews", "interval": 60},
+  ...
+ ]
+}
+
+each feed has its own poll interval (seconds) and a parser plugin that turns the
+response bytes into a list of entries; parsers are registered by name with
+register_parser. story pages from a feed are parsed by the article extractor
+registered for their domain (see article_extractors)
+
+the feed name is what ends up in the category column of the raw rss table
+"""
+
+import json
+from collections import namedtuple
+
+from feed_poller import parse_rss
+
+FEED_CONFIG_FILE = 'feeds.json'
+
+Feed = namedtuple('Feed', ['name', 'source', 'url', 'interval', 'parser', 'enabled'])
+
+# parser name -> function from response bytes to a list of entries
+_parsers = {'rss': parse_rss}
+
+
+def register_parser(name, parser):
+    _parsers[name] = parser
+
+
+def get_parser(name):
+    if name not in _parsers:
+        raise KeyError('no feed parser registered as ' + name)
+    return _parsers[name]
+
+
+def load_feeds(path=FEED_CONFIG_FILE, include_disabled=False):
+    """
+    returns dict of feed name -> Feed from the config at path
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    defaults = {'source': None, 'interval': 300, 'parser': 'rss', 'enabled': True}
+    defaults.update(config.get('defaults', {}))
+    feeds = {}
+    for entry in config['feeds']:
+        settings = dict(defaults, **entry)
+        feed = Feed(settings['name'], settings['source'], settings['url'],
+                    float(settings['interval']), settings['parser'], settings['enabled'])
+        if feed.name in feeds:
+            raise ValueError('feed name used twice in {}: {}'.format(path, feed.name))
+        if feed.interval <= 0:
+            raise ValueError('poll interval for {} has to be positive'.format(feed.name))
+        # fail on a typo'd parser now rather than on the first poll
+        get_parser(feed.parser)
+        if feed.enabled or include_disabled:
+            feeds[feed.name] = feed
+
+    return feeds
+
+
+def feed_urls(feeds):
+    """
+    name -> url, for FeedPoller
+    """
+    return {name: feed.url for name, feed in feeds.items()}
+
+
+def feed_parsers(feeds):
+    """
+    name -> parser function, for FeedPoller
+    """
+    return {name: get_parser(feed.parser) for name, feed in feeds.items()}
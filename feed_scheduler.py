@@ -0,0 +1,83 @@
+"""
+polls each feed on its own interval
+
+feeds sit in a min-heap keyed on when they're next due; the scheduler sleeps until
+the earliest one, polls everything that's due in one concurrent FeedPoller call,
+hands the entries over, and pushes each feed back with its next due time. a slow
+feed (every 15 minutes) costs nothing while a busy one (every 30s) is polled often,
+and hundreds of feeds only add heap entries, not sleep time
+
+with a feed_rates.FeedRates, intervals follow how often each feed actually gets
+new entries instead of staying at the configured ones
+"""
+
+import time
+import heapq
+
+
+class FeedScheduler:
+    """
+    args:
+    intervals -- dict of feed name -> poll interval in seconds
+    poller -- FeedPoller with a url for every feed in intervals
+    rates -- FeedRates to adapt the intervals with, or None to keep them fixed
+    """
+    def __init__(self, intervals, poller, rates=None):
+        self.intervals = dict(intervals)
+        self.poller = poller
+        self.rates = rates
+        now = time.time()
+        # (next due time, feed name); everything is due on the first pass
+        self.heap = [(now, name) for name in intervals]
+        heapq.heapify(self.heap)
+
+    def pop_due(self, now):
+        """
+        removes and returns the feeds due at now, as (due time, name) pairs
+        """
+        due = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap))
+        return due
+
+    def reschedule(self, due, now):
+        for due_time, name in due:
+            # keep to the feed's own cadence, but don't try to catch up on missed polls
+            next_time = due_time + self.intervals[name]
+            if next_time <= now:
+                next_time = now + self.intervals[name]
+            heapq.heappush(self.heap, (next_time, name))
+
+    def seconds_until_due(self, now):
+        if len(self.heap) == 0:
+            return None
+        return max(0, self.heap[0][0] - now)
+
+    def run(self, handle_entries, max_polls=None):
+        """
+        polls feeds as they come due until max_polls rounds have run (forever if None)
+
+        handle_entries gets the FeedPoller.poll() result for each round (only feeds
+        with new content are in it), then the poller's validators are committed
+        """
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            wait = self.seconds_until_due(time.time())
+            if wait is None:
+                return
+            if wait > 0:
+                time.sleep(wait)
+
+            now = time.time()
+            due = self.pop_due(now)
+            feed_entries = self.poller.poll([name for _, name in due])
+            handle_entries(feed_entries)
+            self.poller.commit_state()
+            now = time.time()
+            if self.rates is not None:
+                # entries count as ingested once handle_entries has saved them
+                for name, entries in feed_entries.items():
+                    self.rates.observe(name, entries, now)
+                self.intervals.update(self.rates.intervals(now))
+            self.reschedule(due, now)
+            polls += 1
@@ -0,0 +1,197 @@
+"""
+local cache of fetched story html, so stories can be re-parsed and re-analyzed
+without hitting the network
+
+pages are zstd-compressed and stored by the blake2b hash of their content:
+
+html_cache/
+    index.db
+    objects/3f/3f9a...e1.zst
+
+index.db (sqlite) maps canonical urls (rss_dedup.canonical_url) to content hashes
+and tracks each object's size and last access; once the objects take up more than
+max_bytes, the least recently used ones are deleted
+
+several processes can share a cache (e.g. run_story_workers): the index is in WAL
+mode with a busy timeout, last access times are written in batches rather than on
+every hit, and the total size is read from the index rather than counted per process
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+import zstandard as zstd
+
+from rss_dedup import canonical_url
+
+HTML_CACHE_DIR = 'html_cache'
+HTML_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class HTMLCache:
+    """
+    args:
+    cache_dir -- where the index and objects go
+    max_bytes -- compressed size of all objects before old ones are evicted
+    level -- zstd compression level
+    access_batch, access_seconds -- last access times are written once this many
+        are waiting, or the oldest is this old
+    timeout -- seconds to wait for another process's write to the index
+    """
+    def __init__(self, cache_dir=HTML_CACHE_DIR, max_bytes=HTML_CACHE_MAX_BYTES, level=3,
+                 access_batch=100, access_seconds=30, timeout=60):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.level = level
+        self.access_batch = access_batch
+        self.access_seconds = access_seconds
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        # fetch threads share the connection, so every use goes through the lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.db'), timeout=timeout, check_same_thread=False)
+        # readers don't block the writer (or each other) across processes
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS objects (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS objects_last_access_idx ON objects (last_access)')
+        self.conn.commit()
+        self.total_bytes = self.stored_bytes()
+        # hash -> last access time not written to the index yet
+        self.accessed = {}
+        self.first_accessed = None
+        # zstd (de)compressors aren't safe to share between threads
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def object_path(self, content_hash):
+        return os.path.join(self.cache_dir, 'objects', content_hash[:2], content_hash + '.zst')
+
+    def stored_bytes(self):
+        # every process's objects, not just the ones this one added
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+
+    def codecs(self):
+        if not hasattr(self.local, 'compressor'):
+            self.local.compressor = zstd.ZstdCompressor(level=self.level)
+            self.local.decompressor = zstd.ZstdDecompressor()
+        return self.local.compressor, self.local.decompressor
+
+    def __contains__(self, url):
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM urls WHERE url = ?', (canonical_url(url),)).fetchone()
+        return row is not None
+
+    def get(self, url):
+        """
+        cached html for url, or None
+        """
+        key = canonical_url(url)
+        with self.lock:
+            row = self.conn.execute('SELECT hash FROM urls WHERE url = ?', (key,)).fetchone()
+            if row is not None:
+                self.accessed[row[0]] = time.time()
+                if self.first_accessed is None:
+                    self.first_accessed = time.time()
+                if len(self.accessed) >= self.access_batch or time.time() - self.first_accessed >= self.access_seconds:
+                    self.write_accessed()
+                    self.conn.commit()
+
+        try:
+            if row is None:
+                raise FileNotFoundError
+            with open(self.object_path(row[0]), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            # not cached, or evicted since the lookup
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self.codecs()[1].decompress(data)
+
+    def put(self, url, content):
+        """
+        caches the html for url; identical pages are only stored once
+        """
+        content_hash = hashlib.blake2b(content, digest_size=16).hexdigest()
+        data = self.codecs()[0].compress(content)
+        with self.lock:
+            row = self.conn.execute('SELECT size FROM objects WHERE hash = ?', (content_hash,)).fetchone()
+            if row is None:
+                path = self.object_path(content_hash)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # write then rename, so a crash never leaves a truncated object
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(path + '.tmp', path)
+                # another process may have stored the same page meanwhile
+                self.conn.execute('INSERT OR IGNORE INTO objects VALUES (?, ?, ?)', (content_hash, len(data), time.time()))
+            else:
+                self.accessed[content_hash] = time.time()
+            self.conn.execute('INSERT OR REPLACE INTO urls VALUES (?, ?)', (canonical_url(url), content_hash))
+            self.write_accessed()
+            self.conn.commit()
+            self.total_bytes = self.stored_bytes()
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def write_accessed(self):
+        """
+        writes the waiting last access times (without committing); has to be called
+        with self.lock held
+        """
+        if len(self.accessed) > 0:
+            self.conn.executemany('UPDATE objects SET last_access = ? WHERE hash = ?',
+                                  [(t, h) for h, t in self.accessed.items()])
+        self.accessed = {}
+        self.first_accessed = None
+
+    def evict(self, target=0.9):
+        """
+        deletes least recently used objects until they take up target * max_bytes
+
+        has to be called with self.lock held
+        """
+        self.write_accessed()
+        self.total_bytes = self.stored_bytes()
+        rows = self.conn.execute('SELECT hash, size FROM objects ORDER BY last_access').fetchall()
+        evicted = []
+        for content_hash, size in rows:
+            if self.total_bytes <= self.max_bytes * target:
+                break
+            evicted.append((content_hash,))
+            self.total_bytes -= size
+
+        self.conn.executemany('DELETE FROM urls WHERE hash = ?', evicted)
+        self.conn.executemany('DELETE FROM objects WHERE hash = ?', evicted)
+        self.conn.commit()
+        for (content_hash,) in evicted:
+            try:
+                os.remove(self.object_path(content_hash))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        with self.lock:
+            self.write_accessed()
+            self.conn.commit()
+            self.conn.close()
+
+
+def get_html_cache():
+    """
+    process-wide HTMLCache in HTML_CACHE_DIR, made on first use
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HTMLCache()
+        return _cache
@@ -0,0 +1,257 @@
+"""
+pool of NLP worker processes sharing one copy of the spaCy model
+
+the model (and the VADER lexicon) is loaded once in the parent, then the workers
+are forked, so they all read the same physical pages copy-on-write instead of
+each loading their own 1GB+ en_core_web_lg. gc.freeze() before forking keeps the
+garbage collector from writing to (and so copying) the model's objects in the
+children. throughput scales with workers while memory stays close to one model
+
+batches of story bodies go to the workers over local multiprocessing queues and
+come back as plain data -- entity and sentence offsets plus VADER scores -- which
+PooledDoc turns back into what analyze_story reads off a spaCy doc (doc.ents,
+ent.rights, ent.sent):
+
+pool = NLPPool(n_workers=4)
+for doc in pool.pipe(bodies):
+    ...
+pool.close()
+
+forking needs a fork start method (linux, or macos with care)
+"""
+
+import gc
+import os
+import queue
+import threading
+import itertools
+import multiprocessing as mp
+from collections import namedtuple
+from concurrent.futures import Future
+
+import numpy as np
+
+from story_nlp import NLP_MODEL, get_nlp
+from sentiment import SCORE_COLS, get_analyzer, score_texts
+
+Sentence = namedtuple('Sentence', ['start', 'start_char', 'end_char', 'text'])
+Token = namedtuple('Token', ['text'])
+Entity = namedtuple('Entity', ['text', 'label_', 'start_char', 'end_char', 'sent', 'rights'])
+
+
+def doc_record(doc, score=True):
+    """
+    what analyze_story needs from a spaCy doc, as picklable offsets
+
+    returns dict with sents (start token, start char, end char), ents (start char,
+    end char, label, sentence index, [(start char, end char) of each right]) and,
+    with score, VADER scores of the body and of every sentence with an entity
+    """
+    sents = [(s.start, s.start_char, s.end_char) for s in doc.sents]
+    sent_index = {start: i for i, (start, _, _) in enumerate(sents)}
+    ents = [(e.start_char, e.end_char, e.label_, sent_index[e.sent.start],
+             [(r.idx, r.idx + len(r.text)) for r in e.rights])
+            for e in doc.ents]
+    record = {'sents': sents, 'ents': ents}
+    if score:
+        ent_sents = sorted({e[3] for e in ents})
+        texts = [doc.text] + [doc.text[sents[i][1]:sents[i][2]] for i in ent_sents]
+        scores = score_texts(texts)
+        record['body_scores'] = tuple(scores[0])
+        record['sent_scores'] = {i: tuple(row) for i, row in zip(ent_sents, scores[1:])}
+    return record
+
+
+class PooledDoc:
+    """
+    a worker's result for one body, with the parts of the spaCy doc API
+    analyze_story uses; texts are sliced from the body in this process, so only
+    offsets cross the queue
+    """
+    def __init__(self, text, record):
+        self.text = text
+        self.record = record
+        self.sents = [Sentence(start, start_char, end_char, text[start_char:end_char])
+                      for start, start_char, end_char in record['sents']]
+        self.ents = [Entity(text[start:end], label, start, end, self.sents[sent_i],
+                            [Token(text[r_start:r_end]) for r_start, r_end in rights])
+                     for start, end, label, sent_i, rights in record['ents']]
+        # text -> scores row, for score_texts()
+        self.scores = {}
+        if 'body_scores' in record:
+            self.scores[text] = record['body_scores']
+            for i, row in record['sent_scores'].items():
+                self.scores[self.sents[i].text] = row
+
+    def score_texts(self, texts):
+        """
+        same as sentiment.score_texts, using the worker's scores where it has them
+        """
+        missing = [t for t in texts if t not in self.scores]
+        if len(missing) > 0:
+            self.scores.update(zip(missing, map(tuple, score_texts(missing))))
+        return np.array([self.scores[t] for t in texts], dtype=float).reshape(-1, len(SCORE_COLS))
+
+
+def _worker(model, batch_size, score, task_q, result_q):
+    # get_nlp() returns the model the parent loaded before forking
+    nlp = get_nlp(model)
+    while True:
+        task = task_q.get()
+        if task is None:
+            return
+        batch_id, texts = task
+        try:
+            records = [doc_record(doc, score) for doc in nlp.pipe(texts, batch_size=batch_size)]
+            result_q.put((batch_id, records, None))
+        except Exception as e:
+            result_q.put((batch_id, None, repr(e)))
+
+
+class NLPPool:
+    """
+    args:
+    n_workers -- worker processes, one per core by default
+    model -- spaCy model name
+    batch_size -- nlp.pipe batch size in the workers
+    score -- also get VADER scores for the bodies and entity sentences
+    poll_interval -- seconds between checks that the workers are still alive
+
+    each worker has its own task queue, so the pool knows which batches a worker
+    holds; if one dies (e.g. killed for running out of memory) its batches fail
+    with a RuntimeError instead of hanging, and it's replaced with a new worker
+    """
+    def __init__(self, n_workers=None, model=NLP_MODEL, batch_size=16, score=True, poll_interval=1):
+        self.n_workers = n_workers or os.cpu_count()
+        self.model = model
+        self.batch_size = batch_size
+        self.score = score
+        self.poll_interval = poll_interval
+        self.ctx = mp.get_context('fork')
+        self.result_q = self.ctx.Queue()
+        # batch_id -> (future, texts, worker index)
+        self.futures = {}
+        self.batch_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.workers = []
+        self.task_qs = []
+        # batch_ids each worker holds
+        self.assigned = []
+        self.closing = False
+        self.collector = None
+
+    def start(self):
+        """
+        loads the model here, then forks the workers; call before starting other
+        threads where possible
+        """
+        get_nlp(self.model)
+        if self.score:
+            get_analyzer()
+        # objects from before the fork are never collected, so the GC doesn't touch
+        # (and copy) their pages in the workers
+        gc.collect()
+        gc.freeze()
+        for i in range(self.n_workers):
+            self.workers.append(None)
+            self.task_qs.append(None)
+            self.assigned.append(set())
+            self._start_worker(i)
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+        return self
+
+    def _start_worker(self, i):
+        # replacements are forked from the collector thread while others run; the
+        # worker only uses what start() loaded, which get_nlp/get_analyzer return
+        # without taking a lock another thread could be holding
+        task_q = self.ctx.Queue()
+        p = self.ctx.Process(target=_worker, args=(self.model, self.batch_size, self.score, task_q, self.result_q),
+                             daemon=True)
+        p.start()
+        self.workers[i] = p
+        self.task_qs[i] = task_q
+
+    def _collect(self):
+        # hands results from the workers to the futures waiting on them
+        while True:
+            try:
+                batch_id, records, error = self.result_q.get(timeout=self.poll_interval)
+            except queue.Empty:
+                batch_id = -1
+            if batch_id is None:
+                return
+            if batch_id >= 0:
+                with self.lock:
+                    future, texts, i = self.futures.pop(batch_id, (None, None, None))
+                    if future is not None:
+                        self.assigned[i].discard(batch_id)
+                # future is None when its worker was already given up on
+                if future is not None and error is not None:
+                    future.set_exception(RuntimeError('nlp worker failed: ' + error))
+                elif future is not None:
+                    future.set_result([PooledDoc(text, record) for text, record in zip(texts, records)])
+            self._check_workers()
+
+    def _check_workers(self):
+        # fails the batches of workers that died, and replaces them
+        failed = []
+        with self.lock:
+            if self.closing:
+                return
+            for i, p in enumerate(self.workers):
+                if p.is_alive():
+                    continue
+                print('nlp worker', p.pid, 'exited with code', p.exitcode, 'holding', len(self.assigned[i]), 'batches')
+                for batch_id in self.assigned[i]:
+                    failed.append((self.futures.pop(batch_id)[0], p.exitcode))
+                self.assigned[i] = set()
+                self._start_worker(i)
+        for future, exitcode in failed:
+            future.set_exception(RuntimeError('nlp worker exited with code {}'.format(exitcode)))
+
+    def submit(self, texts):
+        """
+        queues a batch of texts with the least busy worker; returns a Future of a
+        list of PooledDocs
+        """
+        if self.collector is None:
+            self.start()
+        future = Future()
+        texts = list(texts)
+        with self.lock:
+            batch_id = next(self.batch_ids)
+            i = min(range(len(self.workers)), key=lambda i: len(self.assigned[i]))
+            self.futures[batch_id] = (future, texts, i)
+            self.assigned[i].add(batch_id)
+            self.task_qs[i].put((batch_id, texts))
+        return future
+
+    def pipe(self, texts, batch_size=None):
+        """
+        like nlp.pipe: yields a PooledDoc per text, in order, with batches spread
+        over the workers; safe to call from several threads at once
+        """
+        texts = list(texts)
+        batch_size = batch_size or self.batch_size
+        futures = [self.submit(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        for future in futures:
+            yield from future.result()
+
+    def close(self):
+        with self.lock:
+            self.closing = True
+        for task_q in self.task_qs:
+            task_q.put(None)
+        for p in self.workers:
+            p.join()
+        if self.collector is not None:
+            self.result_q.put((None, None, None))
+            self.collector.join()
+        gc.unfreeze()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,304 @@
+"""
+resumable backfill of the reuters archive listings
+
+the archive sections (e.g. https://www.reuters.com/news/archive/hotStocksNews)
+are paginated newest first, ?view=page&page=N&pageSize=10. a backfill splits each
+section's pages into fixed ranges (partitions) up front; partitions are walked
+concurrently, the pages inside one in order, with every request going through a
+per-host rate limiter. the plan lives in a json checkpoint file that's rewritten
+after every page, so a multi-day backfill can be stopped and started again where
+it left off:
+
+plan = ArchivePlan.load_or_create('archive_backfill.json', ARCHIVE_SECTIONS, max_pages=3000)
+walk_archive(plan, save_stories)
+
+a section is finished at its first page without stories (or, with since, the first
+page where every story is older than that), which also drops its later partitions
+
+pages shift towards the end as new stories come out, and a partition can reach
+its last page hours after the next one read its first, so stories that moved over
+the boundary in the meantime would be seen by neither. so a partition keeps going
+past its end until it reaches a story the next partition saw on its first page
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from lxml import etree, html
+
+from feed_poller import make_session, backoff_delay
+from rss_dedup import canonical_url
+from story_pipeline import HostRateLimiter
+
+ARCHIVE_URL = 'https://www.reuters.com/news/archive/{section}?view=page&page={page}&pageSize={page_size}'
+# section name -> path under /news/archive/ ('' is the main archive)
+ARCHIVE_SECTIONS = {'archive': '',
+                    'hotStocksNews': 'hotStocksNews',
+                    'rates': 'rates-rss'}
+CHECKPOINT_FILE = 'archive_backfill.json'
+
+
+def _class_test(cls):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(cls)
+
+
+STORY_XPATH = etree.XPath('//article[{}]'.format(_class_test('story')))
+LINK_XPATH = etree.XPath('.//div[{}]/a/@href'.format(_class_test('story-content')))
+TITLE_XPATH = etree.XPath('.//h3[{}]'.format(_class_test('story-title')))
+TIME_XPATH = etree.XPath('.//span[{}]'.format(_class_test('timestamp')))
+
+
+def archive_url(path, page, page_size=10, url_template=ARCHIVE_URL):
+    return url_template.format(section=path, page=page, page_size=page_size)
+
+
+def parse_archive_page(content, page_url):
+    """
+    stories listed on one archive page
+
+    returns DataFrame with feedburner_origlink (absolute), title and
+    published_parsed (NaT where the listed time can't be parsed)
+    """
+    tree = html.fromstring(content)
+    rows = []
+    for story in STORY_XPATH(tree):
+        links = LINK_XPATH(story)
+        titles = TITLE_XPATH(story)
+        if len(links) == 0 or len(titles) == 0:
+            continue
+        times = TIME_XPATH(story)
+        # older stories show a date (Oct 18 2019), today's only a time (1:35pm EDT)
+        published = pd.to_datetime(times[0].text_content().strip(), errors='coerce') if len(times) > 0 else pd.NaT
+        rows.append({'feedburner_origlink': urljoin(page_url, links[0]),
+                     'title': ' '.join(titles[0].text_content().split()),
+                     'published_parsed': published})
+
+    return pd.DataFrame(rows, columns=['feedburner_origlink', 'title', 'published_parsed'])
+
+
+class ArchivePlan:
+    """
+    the backfill's partitions and how far each has got, saved to path as json
+
+    each partition is a dict with section, path, start, end (pages [start, end)),
+    next_page and done; once it has started, also started and first_links (the
+    canonical links on its first page, which the partition before it walks to)
+    """
+    def __init__(self, path, partitions):
+        self.path = path
+        self.partitions = partitions
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path, sections=ARCHIVE_SECTIONS, max_pages=3000, pages_per_partition=100):
+        """
+        args:
+        sections -- dict of section name -> archive path
+        max_pages -- pages planned per section; sections usually run out before this
+        pages_per_partition -- pages in each unit of work
+        """
+        partitions = []
+        for name, path_ in sections.items():
+            for start in range(1, max_pages + 1, pages_per_partition):
+                partitions.append({'section': name, 'path': path_, 'start': start,
+                                   'end': min(start + pages_per_partition, max_pages + 1),
+                                   'next_page': start, 'done': False})
+        plan = cls(path, partitions)
+        plan.save()
+        return plan
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(path, json.load(f)['partitions'])
+
+    @classmethod
+    def load_or_create(cls, path=CHECKPOINT_FILE, sections=ARCHIVE_SECTIONS, max_pages=3000, pages_per_partition=100):
+        """
+        resumes the plan in path if there is one, otherwise starts a new one
+        """
+        if os.path.exists(path):
+            plan = cls.load(path)
+            print('resuming archive backfill:', plan.progress())
+            return plan
+        return cls.create(path, sections, max_pages, pages_per_partition)
+
+    def save(self):
+        # write-then-rename so a crash mid-write can't leave a broken checkpoint
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'saved_at': datetime.utcnow().isoformat(), 'partitions': self.partitions}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def pending(self):
+        with self.lock:
+            return [i for i, p in enumerate(self.partitions) if not p['done']]
+
+    def is_done(self, i):
+        with self.lock:
+            return self.partitions[i]['done']
+
+    def next_page(self, i):
+        with self.lock:
+            return self.partitions[i]['next_page']
+
+    def start_page(self, i, page):
+        """
+        called before a page is fetched, so the partition before this one knows
+        the first page's links are on their way
+        """
+        with self.lock:
+            part = self.partitions[i]
+            if page == part['start']:
+                part['started'] = True
+
+    def page_done(self, i, page, links, max_overrun=50):
+        """
+        checkpoints a walked page with the canonical links on it
+
+        a partition is done once it's past its end and has caught up with the next
+        partition, or after max_overrun pages past its end
+        """
+        with self.lock:
+            part = self.partitions[i]
+            part['next_page'] = page + 1
+            if page == part['start']:
+                part['first_links'] = sorted(links)
+            if part['next_page'] >= part['end']:
+                overrun = part['next_page'] - part['end']
+                part['done'] = self._caught_up(i, links)
+                if not part['done'] and overrun >= max_overrun:
+                    if max_overrun > 0:
+                        print('archive partition', part['section'], part['start'], 'gave up catching up with the next one after',
+                              overrun, 'extra pages')
+                    part['done'] = True
+            self.save()
+
+    def _caught_up(self, i, links):
+        # called with self.lock held
+        part = self.partitions[i]
+        if i + 1 == len(self.partitions) or self.partitions[i + 1]['section'] != part['section']:
+            return True
+        following = self.partitions[i + 1]
+        if not following.get('started'):
+            # it will read its first page from here on, after this one's last
+            return True
+        if following.get('first_links') is None:
+            # its first page is being fetched right now, unless the section ended there
+            return following['done']
+        return not set(following['first_links']).isdisjoint(links)
+
+    def section_done(self, i):
+        """
+        the partition's section ran out of pages: marks it and every later
+        partition of the section done
+        """
+        with self.lock:
+            part = self.partitions[i]
+            for p in self.partitions:
+                if p['section'] == part['section'] and p['start'] >= part['start']:
+                    p['done'] = True
+            self.save()
+
+    def progress(self):
+        with self.lock:
+            done = sum(p['done'] for p in self.partitions)
+            pages = sum(p['next_page'] - p['start'] for p in self.partitions)
+        return '{}/{} partitions done, {} pages walked'.format(done, len(self.partitions), pages)
+
+
+def fetch_page(session, url, limiter, timeout=30, max_retries=3):
+    """
+    gets one page politely: rate limited per host, backing off on errors and
+    waiting out Retry-After on 429/503
+
+    returns the page content, or None for a 404
+    """
+    for attempt in range(max_retries + 1):
+        limiter.wait(url)
+        try:
+            res = session.get(url, timeout=timeout)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            print('archive page', url, 'failed:', repr(e))
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        if res.status_code == 404:
+            return None
+        if res.status_code in (429, 503) and attempt < max_retries:
+            retry_after = res.headers.get('Retry-After', '')
+            time.sleep(float(retry_after) if retry_after.isdigit() else backoff_delay(attempt, base=5))
+            continue
+        res.raise_for_status()
+        return res.content
+
+
+def walk_archive(plan, save_stories, n_fetchers=4, host_rate=1, since=None, page_size=10,
+                 url_template=ARCHIVE_URL, session=None, stop=None, max_overrun=50):
+    """
+    walks the pending partitions of plan
+
+    args:
+    plan -- ArchivePlan
+    save_stories -- called with (section name, DataFrame from parse_archive_page())
+        for each page; a page is only checkpointed once this returns, so it should
+        store the stories durably (it's called from several threads)
+    n_fetchers -- partitions walked at once
+    host_rate -- max requests/sec to the archive host
+    since -- a section stops at the first page where every story is older than this
+    url_template -- ARCHIVE_URL, or a stand-in server's
+    stop -- threading.Event; when set, workers stop after their current page
+    max_overrun -- most pages a partition walks past its end to catch up with the next
+
+    returns dict of pages and stories walked this run
+    """
+    session = session or make_session(n_fetchers)
+    limiter = HostRateLimiter(host_rate)
+    stop = stop or threading.Event()
+    since = pd.Timestamp(since) if since is not None else None
+    stats = {'pages': 0, 'stories': 0}
+    stats_lock = threading.Lock()
+
+    def walk(i):
+        part = plan.partitions[i]
+        while not stop.is_set() and not plan.is_done(i):
+            page = plan.next_page(i)
+            url = archive_url(part['path'], page, page_size, url_template)
+            plan.start_page(i, page)
+            content = fetch_page(session, url, limiter)
+            stories = parse_archive_page(content, url) if content is not None else None
+            if stories is None or stories.shape[0] == 0:
+                print('archive section', part['section'], 'ends before page', page)
+                plan.section_done(i)
+                return
+
+            save_stories(part['section'], stories)
+            with stats_lock:
+                stats['pages'] += 1
+                stats['stories'] += stories.shape[0]
+            plan.page_done(i, page, set(stories['feedburner_origlink'].map(canonical_url)), max_overrun)
+            if since is not None and (stories['published_parsed'] < since).all():
+                print('archive section', part['section'], 'is back to', since, 'at page', page)
+                plan.section_done(i)
+                return
+
+    with ThreadPoolExecutor(max_workers=n_fetchers) as executor:
+        futures = [executor.submit(walk, i) for i in plan.pending()]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # e.g. ctrl-c: workers finish (and checkpoint) the page they're on, then quit
+            stop.set()
+            raise
+
+    print('archive backfill:', plan.progress())
+    return stats
@@ -0,0 +1,200 @@
+"""
+set-based dedup of raw rss entries
+
+keeps an in-memory set of (feedburner_origlink, id) keys, loaded once at startup
+from the unique index on reuters_raw_rss and updated as rows are inserted, so
+checking a poll cycle for new entries only costs as much as the entries fetched
+
+keys are stored as 64-bit hashes to keep the set compact
+
+also has the pieces for deduping stories across feeds: canonical links (the same
+story comes in from several feeds with ?feedType=RSS&feedName=... on the end) and
+64-bit SimHash fingerprints with a banded index for finding near-duplicates
+"""
+
+import re
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import numpy as np
+from sqlalchemy.dialects.postgresql import insert
+
+KEY_COLS = ['feedburner_origlink', 'id']
+# query parameters that don't change the page, e.g. ?feedType=RSS&feedName=companyNews
+IGNORED_PARAMS = {'feedtype', 'feedname'}
+TOKEN_RE = re.compile(r'\w+')
+
+
+def key_hash(link, entry_id):
+    """
+    8-byte blake2b hash of a (feedburner_origlink, id) key, as an int
+    """
+    h = hashlib.blake2b((link + '\x00' + entry_id).encode('utf-8'), digest_size=8)
+    return int.from_bytes(h.digest(), 'little')
+
+
+def canonical_url(url):
+    """
+    lowercases scheme and host, drops the fragment, feed and utm_* parameters and
+    trailing slash, and sorts the remaining query parameters
+    """
+    parts = urlsplit(url.strip())
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k.lower() not in IGNORED_PARAMS and not k.lower().startswith('utm_')]
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(sorted(query)), ''))
+
+
+def canonical_url_sql(column):
+    """
+    postgres expression that strips the feed parameters from a link column; gives
+    the same result as canonical_url for reuters links, which have no other parameters
+    """
+    return "regexp_replace(regexp_replace({}, '(feedType|feedName)=[^&#]*&?', '', 'g'), '[?&]$', '')".format(column)
+
+
+def simhash(text, shingle=2):
+    """
+    64-bit SimHash of the word shingles in text; near-duplicate texts get
+    fingerprints a few bits apart
+    """
+    tokens = TOKEN_RE.findall(text.lower())
+    if len(tokens) >= shingle:
+        tokens = [' '.join(tokens[i:i + shingle]) for i in range(len(tokens) - shingle + 1)]
+    if len(tokens) == 0:
+        return 0
+
+    hashes = np.array([int.from_bytes(hashlib.blake2b(t.encode('utf-8'), digest_size=8).digest(), 'little')
+                       for t in tokens], dtype=np.uint64)
+    # one row of 64 bits per shingle, lowest bit first
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    majority = bits.sum(axis=0) * 2 > len(tokens)
+    return int.from_bytes(np.packbits(majority, bitorder='little').tobytes(), 'little')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def to_signed64(h):
+    # for storing fingerprints in a postgres bigint
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+class NearDupIndex:
+    """
+    finds fingerprints within max_distance bits of one already added
+
+    fingerprints are split into n_bands bands; if two differ in at most
+    max_distance < n_bands bits, at least one band is identical, so only keys
+    sharing a band value get compared
+
+    args:
+    max_distance -- most bits apart two fingerprints can be and still match
+    n_bands -- has to be more than max_distance and divide 64
+    """
+    def __init__(self, max_distance=3, n_bands=4):
+        if max_distance >= n_bands or 64 % n_bands != 0:
+            raise ValueError('need max_distance < n_bands and n_bands dividing 64')
+        self.max_distance = max_distance
+        self.band_bits = 64 // n_bands
+        self.bands = [{} for _ in range(n_bands)]
+        self.n_keys = 0
+
+    def band_values(self, h):
+        mask = (1 << self.band_bits) - 1
+        return [(h >> (i * self.band_bits)) & mask for i in range(len(self.bands))]
+
+    def add(self, key, h):
+        for band, value in zip(self.bands, self.band_values(h)):
+            band.setdefault(value, []).append((key, h))
+        self.n_keys += 1
+
+    def find(self, h):
+        """
+        key of a near-duplicate fingerprint, or None
+        """
+        for band, value in zip(self.bands, self.band_values(h)):
+            for key, other in band.get(value, ()):
+                if hamming(h, other) <= self.max_distance:
+                    return key
+        return None
+
+    def __len__(self):
+        return self.n_keys
+
+
+def ensure_unique_key_index(engine, tablename='reuters_raw_rss'):
+    """
+    creates the unique index on (feedburner_origlink, id) if it's not there yet
+
+    older tables have some duplicate rows, which are deleted first (keeping one
+    copy) since the unique index can't be built otherwise
+    """
+    index_name = tablename + '_key_idx'
+    res = engine.execute("SELECT to_regclass('" + index_name + "');")
+    if res.fetchone()[0] is not None:
+        return
+
+    print('removing duplicate rows and creating unique index on', tablename)
+    engine.execute('DELETE FROM {0} a USING {0} b '
+                   'WHERE a.ctid < b.ctid '
+                   'AND a.feedburner_origlink = b.feedburner_origlink '
+                   'AND a.id = b.id;'.format(tablename))
+    engine.execute('CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} (feedburner_origlink, id);'.format(index_name, tablename))
+
+
+def insert_on_conflict_do_nothing(table, conn, keys, data_iter):
+    """
+    method for DataFrame.to_sql -- INSERT ... ON CONFLICT DO NOTHING, so rows that
+    are already in the table (per the unique index) are skipped by postgres
+    """
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    stmt = insert(table.table).values(rows).on_conflict_do_nothing()
+    result = conn.execute(stmt)
+    return result.rowcount
+
+
+class SeenKeys:
+    """
+    set of hashed (feedburner_origlink, id) keys already stored in the DB
+    """
+    def __init__(self, hashes=None):
+        self.hashes = set(hashes or [])
+
+    @classmethod
+    def from_db(cls, engine, tablename='reuters_raw_rss'):
+        """
+        loads all keys once; this reads just the two key columns covered by the index
+        """
+        res = engine.execution_options(stream_results=True).execute(
+                'SELECT feedburner_origlink, id FROM ' + tablename + ';')
+        seen = cls(key_hash(link, entry_id) for link, entry_id in res)
+        print('loaded', len(seen), 'seen rss keys')
+        return seen
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, key):
+        return key_hash(*key) in self.hashes
+
+    def filter_new(self, df):
+        """
+        returns the rows of df whose keys haven't been seen, also dropping dupes
+        within df itself
+        """
+        hashes = [key_hash(link, entry_id) for link, entry_id in zip(df['feedburner_origlink'], df['id'])]
+        keep = []
+        batch = set()
+        for h in hashes:
+            keep.append(h not in self.hashes and h not in batch)
+            batch.add(h)
+
+        return df[keep]
+
+    def update(self, df):
+        """
+        marks the keys in df as seen, call after they are inserted
+        """
+        self.hashes.update(key_hash(link, entry_id) for link, entry_id in zip(df['feedburner_origlink'], df['id']))
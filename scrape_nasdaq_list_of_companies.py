@@ -1,125 +1,131 @@
+import os
 import string
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 import requests as req
 from bs4 import BeautifulSoup as bs
 from tqdm import tqdm
 
+from company_reference import LISTING_DIR, LISTING_PREFIX, save_snapshot, get_reference
+
 BASE_LINK = 'https://www.nasdaq.com/screening/companies-by-name.aspx?{}&pagesize=200&page={}'
 
 # can get all stocks at once setting pagesize equal to a huge number
 full_link = 'https://www.nasdaq.com/screening/companies-by-name.aspx?pagesize=20000'
 
+LISTING_COLS = ['company_name', 'market_cap', 'country', 'ipo_year', 'subsector']
+
+# multipliers for market cap abbreviations, e.g. $44.57M
+ABBREVIATIONS = {'': 1, 'K': 1e3, 'M': 1e6, 'B': 1e9}
 
-def add_stocks(letter, page, get_last_page=False):
+
+def parse_listing_rows(soup):
     """
-    goes through each row in table and adds to df if it is a stock
+    pulls the stock rows out of the CompanylistResults table
 
-    returns the appended df
+    rows are collected as lists and the DataFrame is built once at the end, indexed
+    by ticker
     """
-    df = pd.DataFrame()
-    res = req.get(BASE_LINK.format(letter, page))
-    soup = bs(res.content, 'lxml')
     table = soup.find('table', {'id': 'CompanylistResults'})
     stks = table.findAll('tr')
-    stocks_on_page = (len(stks) - 1) / 2
-
+    rows = []
+    tickers = []
     for stk in stks[1:]:
         deets = stk.findAll('td')
         if len(deets) != 7:
             continue
-        company_name = deets[0].text.strip()
-        ticker = deets[1].text.strip()
-        market_cap = deets[2].text.strip()
+        tickers.append(deets[1].text.strip())
         # 4th entry is blank
-        country = deets[4].text.strip()
-        ipo_year = deets[5].text.strip()
-        subsector = deets[6].text.strip()
-        df = df.append(pd.Series({'company_name': company_name,
-                                'market_cap': market_cap,
-                                'country': country,
-                                'ipo_year': ipo_year,
-                                'subsector': subsector},
-                                name=ticker))
+        rows.append([deets[0].text.strip(),
+                     deets[2].text.strip(),
+                     deets[4].text.strip(),
+                     deets[5].text.strip(),
+                     deets[6].text.strip()])
+
+    return pd.DataFrame(rows, columns=LISTING_COLS, index=pd.Index(tickers, name='ticker'))
+
+
+def add_stocks(letter, page, get_last_page=False, base_link=BASE_LINK):
+    """
+    gets the stocks on one page of the listing for letter, e.g. 'letter=A'
+
+    returns df, stocks_on_page and also last_page_num if get_last_page
+    """
+    res = req.get(base_link.format(letter, page))
+    soup = bs(res.content, 'lxml')
+    df = parse_listing_rows(soup)
+    stocks_on_page = df.shape[0]
 
     if get_last_page:
         # get number of pages
         lastpage_link = soup.find('a', {'id': 'two_column_main_content_lb_LastPage'})
         last_page_num = int(lastpage_link['href'].split('=')[-1])
-        return df, total_num_stocks, last_page_num
+        return df, stocks_on_page, last_page_num
 
     return df, stocks_on_page
 
 
-def get_all_stocks():
+def get_stocks_paged(letters=string.ascii_uppercase, max_workers=8, base_link=BASE_LINK):
     """
-    goes through each row in table and adds to df if it is a stock
+    gets the listing page by page, fetching pages concurrently
 
-    returns the appended df
+    the first page of each letter says how many pages it has, then all the
+    remaining pages go to the thread pool at once
     """
-    df = pd.DataFrame()
-    res = req.get(full_link)
-    soup = bs(res.content, 'lxml')
-    table = soup.find('table', {'id': 'CompanylistResults'})
-    stks = table.findAll('tr')
+    letters = ['letter=' + l for l in letters]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        first_pages = list(executor.map(lambda l: add_stocks(l, 1, get_last_page=True, base_link=base_link), letters))
+        dfs = [df for df, _, _ in first_pages]
+        futures = [executor.submit(add_stocks, l, p, base_link=base_link)
+                   for l, (_, _, last_page_num) in zip(letters, first_pages)
+                   for p in range(2, last_page_num + 1)]
+        for fut in tqdm(futures):
+            dfs.append(fut.result()[0])
 
-    for stk in stks[1:]:
-        deets = stk.findAll('td')
-        if len(deets) != 7:
-            continue
-        company_name = deets[0].text.strip()
-        ticker = deets[1].text.strip()
-        market_cap = deets[2].text.strip()
-        # 4th entry is blank
-        country = deets[4].text.strip()
-        ipo_year = deets[5].text.strip()
-        subsector = deets[6].text.strip()
-        df = df.append(pd.Series({'company_name': company_name,
-                                'market_cap': market_cap,
-                                'country': country,
-                                'ipo_year': ipo_year,
-                                'subsector': subsector},
-                                name=ticker))
+    return pd.concat(dfs)
+
+
+def get_all_stocks(link=full_link):
+    """
+    gets every stock from the listing in one request
 
-    return df
+    returns df indexed by ticker
+    """
+    res = req.get(link)
+    soup = bs(res.content, 'lxml')
+    return parse_listing_rows(soup)
 
 
 def clean_abbreviations(x):
     """
-    replaces K with 000, M with 000000, B with 000000000
+    replaces K with 000, M with 000000, B with 000000000 for a whole Series, e.g.
+    '$44.57M' -> 44570000.0; 'n/a' and missing values become nan
     """
     # a few entries in Revenue were nan
-    if pd.isnull(x) or x == 'n/a':
-        return np.nan
-    elif 'K' in x:
-        return float(x[:-1]) * 1e3
-    elif 'M' in x:
-        return float(x[:-1]) * 1e6
-    elif 'B' in x:
-        return float(x[:-1]) * 1e9
-    else:
-        return float(x)
-
+    parts = x.astype(str).str.replace('$', '', regex=False).str.extract(r'^([\d.]+)([KMB]?)$')
+    return pd.to_numeric(parts[0], errors='coerce') * parts[1].map(ABBREVIATIONS)
 
 
-def get_all_stocks():
+def save_all_stocks():
     # can just do it all at once
     full_df = get_all_stocks()
 
     # clean and save
     full_df_na_sub = full_df.copy()
-    # remove $ sign
-    full_df_na_sub['market_cap'] = full_df_na_sub['market_cap'].apply(lambda x: x.replace('$', ''))
-    full_df_na_sub['market_cap'] = full_df_na_sub['market_cap'].apply(clean_abbreviations)
+    # remove $ sign and expand K/M/B
+    full_df_na_sub['market_cap'] = clean_abbreviations(full_df_na_sub['market_cap'])
     full_df_na_sub = full_df_na_sub.replace('n/a', np.nan)
     full_df_na_sub['market_cap'] = full_df_na_sub['market_cap'].astype('float')
     full_df_na_sub['ipo_year'] = full_df_na_sub['ipo_year'].astype('float')
     full_df_na_sub.index.name = 'ticker'
     todays_date = datetime.today().strftime('%Y-%m-%d')
-    filename = 'nasdaq_stock_listing_' + todays_date + '.csv'
+    filename = os.path.join(LISTING_DIR, LISTING_PREFIX + todays_date + '.csv')
     full_df_na_sub.to_csv(filename)
+    # binary snapshot that get_reference picks up as the latest listing
+    save_snapshot(full_df_na_sub, todays_date)
 
 
     # test loading
@@ -132,9 +138,11 @@ def get_all_stocks():
     print(np.mean(np.isclose(test_df[float_cols], full_df_na_sub[float_cols], equal_nan=True)))
 
 
-def load_nasdaq_stocklist():
-    # TODO: save in folder, get latest file
-    date = '2018-08-15'
-    filename = 'nasdaq_stock_listing_' + date + '.csv'
-    df = pd.read_csv(filename, index_col='ticker')
-    return df
+def load_nasdaq_stocklist(date=None):
+    """
+    listing snapshot for date (the latest if None), indexed by ticker
+
+    the snapshot is loaded once per process; this returns a copy so callers can
+    modify it
+    """
+    return get_reference(date).listing.copy()
@@ -11,47 +11,49 @@ quit: \q
 
 """
 
-# TODO: deal with companies without tickers in the story, e.g.
-# https://www.reuters.com/article/us-sprint-m-a-t-mobile/trump-advisor-touts-sprint-t-mobile-deal-while-denying-lobbying-idUSKBN1L01R4
-# Trump advisor touts Sprint, T-Mobile deal while denying lobbying
-
-import re
 import os
 import time
 from datetime import datetime
 
 import pytz
 import glob
-import spacy
-from fuzzywuzzy import fuzz
+import threading
+import multiprocessing as mp
 import requests as req
-from bs4 import BeautifulSoup as bs
-import feedparser
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine as ce
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from sqlalchemy import create_engine as ce, text
+
+from feed_poller import FeedPoller, make_session
+from feed_registry import FEED_CONFIG_FILE, load_feeds, feed_urls, feed_parsers
+from feed_scheduler import FeedScheduler
+from feed_rates import FeedRates
+from rss_dedup import KEY_COLS, SeenKeys, ensure_unique_key_index, insert_on_conflict_do_nothing, canonical_url, simhash, hamming, NearDupIndex
+from story_registry import StoryRegistry, ensure_story_table, near_dup_candidates, fold_near_duplicate
+from story_queue import StoryQueue
+from reuters_archive import ARCHIVE_SECTIONS, CHECKPOINT_FILE, ArchivePlan, walk_archive
+from story_pipeline import StoryPipeline
+from story_nlp import get_nlp, pipe_docs
+from nlp_pool import NLPPool, PooledDoc
+from story_db import ENTITY_SENT_TABLE, processed_links, mark_analyzed, load_story_bodies, copy_rows, StoryWriter, iter_rss, iter_stories, iter_story_df, concat_chunks, remove_duplicate_rows
+from entity_linker import RIC_CLEAN_RE, get_entity_linker
+from article_extractors import REUTERS_EXTRACTOR, get_extractor
+from html_cache import get_html_cache
+from sentiment import SCORE_COLS, score_texts, entity_sentence_scores
+from sentiment_series import SentimentSeries
 
 # directory for storing backups of database
 # DATA_DIR = '/home/nate/Dropbox/data/postgresql/rss_feeds/'
 DATA_DIR = '/media/nate/bigdata1/onedrive/data/postgresql/rss_feeds/'
 
-# nlp = spacy.load('en')
-nlp = spacy.load('en_core_web_lg')
+# ETag/Last-Modified for each feed, so a restarted scraper doesn't refetch everything
+FEED_STATE_FILE = 'rss_feed_state.json'
+
+# the spaCy model (story_nlp.get_nlp), VADER analyzer (sentiment.get_analyzer) and
+# DB engine (get_engine) are made on first use, so importing this file is cheap
 
-# ignored feeds that seemed to have no companies/stocks in them
-reuters_feed_list = {
-                    'biz': 'http://feeds.reuters.com/reuters/businessNews',
-                    'company': 'http://feeds.reuters.com/reuters/companyNews',
-                    'health': 'http://feeds.reuters.com/reuters/healthNews',
-                    'wealth': 'http://feeds.reuters.com/news/wealth',
-                    'mostRead': 'http://feeds.reuters.com/reuters/MostRead',
-                    'politics': 'http://feeds.reuters.com/Reuters/PoliticsNews',
-                    'tech': 'http://feeds.reuters.com/reuters/technologyNews',
-                    'top': 'http://feeds.reuters.com/reuters/topNews',
-                    'US': 'http://feeds.reuters.com/Reuters/domesticNews',
-                    'world': 'http://feeds.reuters.com/Reuters/worldNews'
-                    }
+# the feeds to poll and how often are in feeds.json (see feed_registry); reuters
+# feeds that seemed to have no companies/stocks in them are left out
 
 
 def create_engine(db_name='rss_feeds'):
@@ -63,11 +65,53 @@ def create_engine(db_name='rss_feeds'):
     return engine
 
 
-# create SQL engine for connecting to DB
-engine = create_engine()
+# process-wide SQL engines for connecting to DB, by db name
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db_name='rss_feeds'):
+    """
+    shared engine (and connection pool) for db_name, created on first use
+    """
+    with _engines_lock:
+        if db_name not in _engines:
+            _engines[db_name] = create_engine(db_name=db_name)
+        return _engines[db_name]
+
+
+def feeds_to_df(feed_entries):
+    """
+    takes dict of category -> feedparser entries from FeedPoller.poll() and
+    flattens them into one dataframe
+    """
+    all_feeds = []
+    for l, entries in feed_entries.items():
+        for feed in entries:
+            feed['category'] = l
+            # at least for reuters, it seems like 'tags' is just the same as category
+            feed.pop('tags', None)
+            # links seems to be the same as feedburner_origlink, at least for reuters
+            feed.pop('links', None)
 
+        all_feeds = all_feeds + [f for f in entries]
 
-def continually_scrape_rss():
+    feeds_df = pd.io.json.json_normalize(all_feeds).dropna(axis=1)
+    # convert time to seconds since epoch
+    feeds_df['published_parsed'] = feeds_df['published_parsed'].apply(lambda x: datetime.fromtimestamp((time.mktime(x))))
+    feeds_df['time_added'] = datetime.utcnow()
+    return feeds_df
+
+
+def continually_scrape_rss(feed_config=FEED_CONFIG_FILE, adaptive=True, latency_budget=60, max_requests_per_sec=1, report_every=600):
+    """
+    polls the feeds in feed_config and saves new entries to reuters_raw_rss
+
+    with adaptive=True, poll intervals follow each feed's rate of new entries
+    (see feed_rates), aiming for latency_budget seconds from publish to ingest on
+    average with at most max_requests_per_sec polls; the intervals and
+    publish-to-ingest times are printed every report_every seconds
+    """
     # tried with sqlite first, but having trouble
     # 'sqlite://'
     # db_filename = '/home/nate/rss_feeds.db'
@@ -78,90 +122,100 @@ def continually_scrape_rss():
     # https://stackoverflow.com/a/8237512/4549682
     # run psql: https://www.digitalocean.com/community/tutorials/how-to-install-and-use-postgresql-on-ubuntu-16-04
     # create tables, users, etc: https://medium.com/coding-blocks/creating-user-database-and-adding-access-on-postgresql-8bfcd2f4a91e
-    engine = create_engine()
+    engine = get_engine()
     # create test table for sanity check
     # engine.execute("CREATE TABLE IF NOT EXISTS test();")
-    while True:
-        all_feeds = []
-        for l, f in reuters_feed_list.items():
-            print(l)
-            complete = False
-            while not complete:
-                try:
-                    feeds = feedparser.parse(f)
-                    if feeds['status'] != 200:
-                        print('status is not good:', str(feeds['status']))
-                    else:
-                        complete = True
-                except KeyError:
-                    print('keyerror, probably a bad html request or something')
-                    time.sleep(3)
-
-            for feed in feeds['entries']:
-                feed['category'] = l
-                # at least for reuters, it seems like 'tags' is just the same as category
-                del feed['tags']
-                # links seems to be the same as feedburner_origlink, at least for reuters
-                del feed['links']
-
-            all_feeds = all_feeds + [f for f in feeds['entries']]
-
-        feeds_df = pd.io.json.json_normalize(all_feeds).dropna(axis=1)
-        # convert time to seconds since epoch
-        feeds_df['published_parsed'] = feeds_df['published_parsed'].apply(lambda x: datetime.fromtimestamp((time.mktime(x))))
-        feeds_df['time_added'] = datetime.utcnow()
-
-        tablename = 'reuters_raw_rss'
-        # check if table exists
-        # sqlite way
-        # stmt = "select count(*) from sqlite_master where type='table' and name='{}'".format(tablename)
-        # stmt = 'select exists(select * from information_schema.tables where table_name={})'.format(tablename)
-        stmt = "select exists(select relname from pg_class where relname='" + tablename + "');"
-        res = engine.execute(stmt)
-        table_exists = res.fetchone()[0]
-        if table_exists:
-            # need to grab quite a few stories just to make sure we aren't getting any dupes, since some categories may update more frequently than others
-            # ideally would grab the 20 most recent for each category
-            cur_df = pd.read_sql('SELECT * FROM {} ORDER BY time_added DESC LIMIT '.format(tablename) + '3000', con=engine)
-            # check for new stuff
-            cols = feeds_df.columns
-            no_time_added_cols = [c for c in cols if c != 'time_added']
-            # ignore time added column
-            feeds_df_no_time_added = feeds_df[no_time_added_cols]
-            cur_df_no_time_added = cur_df[no_time_added_cols]
-            df_all = feeds_df_no_time_added.merge(cur_df_no_time_added.drop_duplicates(), on=list(['feedburner_origlink', 'id']), how='left', indicator=True)
-            new_entries_idx = df_all['_merge'] == 'left_only'
-            new_entries = new_entries_idx.sum()
-            print('\n')
-            if new_entries != 0:
-                df_all_new = df_all.loc[new_entries_idx]
-                new_links = df_all_new['feedburner_origlink']
-                new_stories = feeds_df[feeds_df['feedburner_origlink'].isin(new_links)]
-                new_stories.to_sql(tablename, con=engine, if_exists='append', index=False)
-                print(str(new_entries), 'updates')
-            else:
-                print('no updates')
-
-            print('\n')
+    feeds = load_feeds(feed_config)
+    poller = FeedPoller(feed_urls(feeds), state_file=FEED_STATE_FILE, parsers=feed_parsers(feeds))
+    intervals = {name: feed.interval for name, feed in feeds.items()}
+    rates = None
+    if adaptive:
+        rates = FeedRates(intervals, latency_budget=latency_budget, max_requests_per_sec=max_requests_per_sec)
+    scheduler = FeedScheduler(intervals, poller, rates=rates)
+    last_report = time.time()
+    tablename = 'reuters_raw_rss'
+    # (feedburner_origlink, id) keys already in the DB and the story registry,
+    # loaded on the first poll
+    seen = None
+    registry = None
+
+    def save_entries(feed_entries):
+        nonlocal seen, registry, last_report
+        if rates is not None and time.time() - last_report > report_every:
+            rates.print_report()
+            last_report = time.time()
+
+        stats = poller.last_cycle_stats
+        print('polled {} feeds: {} fetched, {} skipped (not modified), {} failed'.format(
+                sum(stats[k] for k in ['fetched', 'not_modified', 'failed']),
+                stats['fetched'], stats['not_modified'], stats['failed']))
+        print('{} bytes downloaded, ~{} bytes saved by conditional GET'.format(
+                stats['bytes_downloaded'], stats['bytes_saved']))
+        if len(feed_entries) == 0:
+            # nothing changed, so no need to parse or check the DB for dupes
+            return
+
+        feeds_df = feeds_to_df(feed_entries)
+
+        if seen is None:
+            # check if table exists
+            # sqlite way
+            # stmt = "select count(*) from sqlite_master where type='table' and name='{}'".format(tablename)
+            # stmt = 'select exists(select * from information_schema.tables where table_name={})'.format(tablename)
+            stmt = "select exists(select relname from pg_class where relname='" + tablename + "');"
+            res = engine.execute(stmt)
+            table_exists = res.fetchone()[0]
+            if not table_exists:
+                print('writing new table')
+                # to delete table:
+                # engine.execute('DROP TABLE reuters_raw_rss;')
+                feeds_df = feeds_df.drop_duplicates(subset=KEY_COLS)
+                feeds_df.to_sql(tablename, con=engine, index=False)
+
+            ensure_unique_key_index(engine, tablename)
+            # load the keys once; after this dedup only depends on what was fetched
+            seen = SeenKeys.from_db(engine, tablename)
+            registry = StoryRegistry.from_db(engine)
+            if not table_exists:
+                registry.add(feeds_df)
+
+        new_stories = seen.filter_new(feeds_df)
+        new_entries = new_stories.shape[0]
+        if new_entries != 0:
+            # the unique index still guards against dupes from e.g. another scraper process
+            new_stories.to_sql(tablename, con=engine, if_exists='append', index=False, method=insert_on_conflict_do_nothing)
+            seen.update(new_stories)
+            # one record per story, however many feeds it came in from
+            n_stories = registry.add(new_stories)
+            print(str(new_entries), 'updates,', n_stories, 'new stories')
         else:
-            print('writing new table')
-            # to delete table:
-            # engine.execute('DROP TABLE reuters_raw_rss;')
-            feeds_df.to_sql(tablename, con=engine, index=False)
+            print('no updates')
 
-        print('finished, waiting one minute...\n\n')
-        time.sleep(60)
+        print('\n')
 
+    # the scheduler sleeps until the next feed is due, and only remembers the ETags
+    # (poller.commit_state) once save_entries has stored the entries
+    scheduler.run(save_entries)
 
-def load_rss():
+
+def load_rss(columns=None, start=None, end=None, categories=None, chunksize=None):
     """
-    loads full sql database full of feedparser-parsed rss feeds
+    loads sql database full of feedparser-parsed rss feeds, without duplicate
+    (feedburner_origlink, id) rows
+
+    args:
+    columns -- list of columns to load, None for all
+    start, end -- only rows with time_added in [start, end)
+    categories -- only these feed categories, e.g. ['company', 'biz']
+    chunksize -- if set, returns a generator of DataFrames with up to chunksize
+        rows instead of loading everything at once
     """
-    engine = create_engine(db_name='rss_feeds')
-    tablename = 'reuters_raw_rss'
-    df = pd.read_sql(tablename, con=engine)
-    print(df.shape)
-    df.drop_duplicates(subset=['feedburner_origlink', 'id'], inplace=True)
+    engine = get_engine(db_name='rss_feeds')
+    chunks = iter_rss(engine, columns, start, end, categories, chunksize=chunksize or 10000)
+    if chunksize is not None:
+        return chunks
+
+    df = concat_chunks(chunks, columns)
     print(df.shape)
     # set timezone and convert to Mountain time
     # published_parsed is wrong
@@ -173,264 +227,695 @@ def load_rss():
     return df
 
 
-def get_sentiments_vader(x, analyzer):
-    vs = analyzer.polarity_scores(x)
-    return pd.DataFrame([vs['compound'], vs['pos'], vs['neg'], vs['neu']], index=['compound', 'pos', 'neg', 'neu']).T
+def check_story_in_db(link):
+    """
+    checks if the story body, the sentence-level sentiments and the per-stock
+    sentiments for link are already in the DB, and if the story was analyzed
+
+    returns in_body_db, in_sent_db, in_entity_db, analyzed, sent_table_exists as bools
+    """
+    body_links, sent_links, entity_links, analyzed, sent_table_exists = processed_links(get_engine(), [link])
+    return link in body_links, link in sent_links, link in entity_links, link in analyzed, sent_table_exists
 
 
-def scrape_story(story_df):
+def fetch_story(link, session=req, cache=None, offline=False):
     """
-    pass in one slice of the raw rss dataframe
+    downloads the story page; returns the html, or None if the page is unavailable
 
-    this grabs the stocks in the story, the overall sentiment, and cleans the body
-    then stores it in a sql database
+    args:
+    cache -- HTMLCache to read the page from and save it to, or None
+    offline -- only use the cache; pages that aren't cached come back as None
     """
-    link = story_df['feedburner_origlink']
+    if cache is not None:
+        content = cache.get(link)
+        if content is not None or offline:
+            return content
 
-    # first check if story and sentiments in db, if so, skip that one
-    tablename = 'reuters_story_bodies'
-    # check if already in DBs
-    tableexists = engine.execute("SELECT to_regclass('" + tablename + "');")
-    body_table_exists = tableexists.fetchone()[0]
-    in_body_db = None
-    # if table exists, check if entry is in DB
-    if body_table_exists is not None:
-        indb = engine.execute('select 1 from ' + tablename + ' where feedburner_origlink = \'' + link + '\';')
-        in_body_db = indb.fetchone()
-        if in_body_db is not None:
-            in_body_db = in_body_db[0]
-
-    # DB for sentence-level sentiment if stock in title
-    tablename = 'reuters_story_sentiments'
-    # check if already in DB
-    tableexists = engine.execute("SELECT to_regclass('" + tablename + "');")
-    sent_table_exists = tableexists.fetchone()[0]
-    in_sent_db = None
-    # if table exists, check if entry is in DB
-    if sent_table_exists is not None:
-        indb = engine.execute('select body from ' + tablename + ' where feedburner_origlink = \'' + link + '\';')
-        in_sent_db = indb.fetchone()
-        if in_sent_db is not None:
-            in_sent_db = int_sent_db[0]
-
-
-    if in_body_db is not None and in_sent_db is not None:
-        print('already in both DBs')
-        return
+    res = session.get(link)
+    if res.status_code == 500:
+        print('status code 500; page unavailable')
+        return None
+
+    if cache is not None and res.status_code == 200:
+        cache.put(link, res.content)
+    return res.content
+
+
+def parse_story(content, link=None):
+    """
+    pulls the published time and the cleaned-up body out of a story page, using the
+    extractor registered for link's site (reuters if link isn't given)
+
+    returns article_datetime, body
+    """
+    extractor = REUTERS_EXTRACTOR if link is None else get_extractor(link)
+    if extractor is None:
+        raise ValueError('no article extractor registered for ' + link)
+
+    return extractor.extract(content)
 
-    # scrape story details
-    tablename = 'reuters_story_bodies'
-    if in_body_db is None:
-        res = req.get(link)
-        if res.status_code == 500:
-            print('status code 500; page unavailable')
-            return
-        soup = bs(res.content, 'lxml')
-        # get published time, which seems to be more accurate than the rss feed's time
-        header = soup.find('div', {'class': 'ArticleHeader_content-container'})
-        datetime_str = soup.find('div', {'class': 'ArticleHeader_date'}).text.split('/')
-        # with base requests, this should be in UTC/GMT
-        article_datetime = pd.to_datetime(datetime_str[0].strip() + ' ' + datetime_str[1].strip()).tz_localize('UTC')
-
-        # get story body
-        body = soup.find('div', {'class': 'StandardArticleBody_body'}).text
-        # clean up location and reporting agency
-        loc_reporting_idx = body.find(' - ') + 3
-        body = body[loc_reporting_idx:]
-        # clean up boilerplate at the end
-        if 'Additional reporting by' in body:
-            ar_idx = body.find('Additional reporting')
-            body = body[:ar_idx].strip()
-        elif 'Writing by ' in body:
-            wb_idx = body.find('Additional reporting')
-            body = body[:wb_idx].strip()
-        elif 'Editing by ' in body:
-            eb_idx = body.find('Additional reporting')
-            body = body[:eb_idx].strip()
-        elif 'Our Standards: ' in body:
-            os_idx = body.find('Additional reporting')
-            body = body[:os_idx].strip()
-    else:
-        body_query = engine.execute('select body from ' + tablename + ' where feedburner_origlink = \'' + link + '\';')
-        body = body_query.fetchone()[0]
 
+def load_story_body(link):
+    return load_story_bodies(get_engine(), [link])[link]
 
 
+def analyze_story(story_df, body, article_datetime=None, in_body_db=False, in_sent_db=False, sent_table_exists=False, proc_doc=None,
+                  in_entity_db=False):
+    """
+    finds the stocks in the story and gets the overall and per-stock sentiment
+
+    proc_doc is the spaCy doc for body if it was already made, e.g. with nlp.pipe,
+    or a PooledDoc from an NLPPool
+
+    returns story_record, sent_record, entity_records -- dicts of rows for
+    reuters_story_bodies and reuters_story_sentiments, or None for ones that
+    shouldn't be saved, and a list of reuters_entity_sentiments rows (one per
+    stock mentioned), empty if the story already has them (in_entity_db)
+    """
+    link = story_df['feedburner_origlink']
+
     # search for tickers in story
     # TODO: find CEOs, other important entities in story and get sentiment towards them too
 
-    stocks_in_story = []
-    stocks = re.findall('\([A-Z]+\.[A-Z]+\)', body)
-    if stocks is not None and len(stocks) > 0:
+    linker = get_entity_linker()
+    stocks_in_story = linker.find_tickers(body)
+    if len(stocks_in_story) > 0:
         print('found stocks:')
-        for s in stocks:
+        for s in stocks_in_story:
             print(s)
-            # remove RIC and paranthesis
-            per_idx = s.find('.')
-            stocks_in_story.append(s[1:per_idx])
-
-    # find all mentions of stocks in story and get full stock name
-
 
     # get list of entity names (stocks_ents) used for stocks in story, so can get sentences with stocks mentioned in them
     # also get full stock names in full_stock_names
 
-    proc_doc = nlp(body)
-    # get all mentions of stocks
+    if proc_doc is None:
+        proc_doc = get_nlp()(body)
+    ents = list(proc_doc.ents)
+
+    # companies mentioned by name, including ones without a ticker in the story;
+    # the entities confirm one-word names
+    named_companies = linker.find_companies(body, [ent.text for ent in ents])
+    # get full names of the stocks with tickers
     stocks_to_match = set(stocks_in_story)
-    stocks_ents = {}
     full_stock_names = {}
-    for ent in proc_doc.ents:
-        if len(stocks_to_match) != 0:
+    for ent in ents:
+        if len(stocks_to_match) == 0:
+            break
+
+        for s in stocks_to_match:
+            if s in ent.text:
+                # sometimes the entity also has ticker, e.g.  Xcel Energy Inc (XEL.O
+                # clean stock from entity
+                cleaned_stock_name = RIC_CLEAN_RE.sub('', ent.text).strip()
+                full_stock_names[s] = cleaned_stock_name
+
+        for r in ent.rights:
+            remove = None
             for s in stocks_to_match:
-                if s in ent.text:
-                    # sometimes the entity also has ticker, e.g.  Xcel Energy Inc (XEL.O
-                    # clean stock from entity
-                    cleaned_stock_name = re.sub('\([A-Z]+\.[A-Z]+\)*', '', ent.text).strip()
-                    full_stock_names[s] = cleaned_stock_name
+                if s in r.text:
+                    full_stock_names[s] = ent.text
+                    remove = s
+                    break
+            if remove is not None:
+                stocks_to_match.remove(remove)
+
+    # companies only found by name use the name as written in the story
+    for s, spans in named_companies.items():
+        if s not in full_stock_names:
+            start, end = spans[0]
+            full_stock_names[s] = body[start:end]
+
+    # tickers whose name wasn't picked up from the entities fall back to the listed name
+    for s in stocks_to_match:
+        if s not in full_stock_names:
+            company = linker.reference.lookup(s)
+            if company is not None and isinstance(company.company_name, str):
+                full_stock_names[s] = company.company_name
+
+    # get all mentions of stocks; fuzzy matching is only against the few names above
+    linked_ents = linker.link_entities([ent.text for ent in ents], full_stock_names)
+    stocks_ents = {s: [ents[i] for i in idx] for s, idx in linked_ents.items()}
+
+
+    # docs from an NLPPool come with their scores already worked out
+    score = proc_doc.score_texts if isinstance(proc_doc, PooledDoc) else score_texts
 
-            for r in ent.rights:
-                remove = None
-                for s in stocks_to_match:
-                    if s in r.text:
-                        full_stock_names[s] = ent.text
-                        remove = s
-                        break
-                if remove is not None:
-                    stocks_to_match.remove(remove)
+    # get overall document sentiment -- doesn't work super well with vader for whole document
+    sentiments = dict(zip(SCORE_COLS, score([body])[0]))
+
+    # sentiment towards each stock from the sentences mentioning it; each sentence
+    # is scored once, even if it mentions several stocks
+    # (for finer entity sentiment see e.g. https://github.com/D2KLab/sentinel)
+    sentence_index = {}
+    sentences = []
+    stock_sentences = {}
+    for s, s_ents in stocks_ents.items():
+        for ent in s_ents:
+            if ent.sent.start not in sentence_index:
+                sentence_index[ent.sent.start] = len(sentences)
+                sentences.append(ent.sent.text)
+            stock_sentences.setdefault(s, []).append(sentence_index[ent.sent.start])
+    avg_stocks_ents_sents = entity_sentence_scores(sentences, stock_sentences, score)
 
-        for s, f in full_stock_names.items():
-            if f == ent.text or ent.text in f:
-                stocks_ents.setdefault(s, []).append(ent)
-            else:
-                ratio = fuzz.ratio(f, ent.text)
-                if ratio > 50:
-                    stocks_ents.setdefault(s, []).append(ent)
 
+    # look for stock entity in title to find focus of story
+    story_record = None
+    if not in_body_db:
+        story_record = {'feedburner_origlink': link,
+                        'datetime': article_datetime,
+                        'body': body,
+                        'stocks_in_story': ', '.join(stocks_in_story),
+                        # 'stocks_ents': stocks_ents,  # can't put dict in sql, and not sure want to save this anyway
+                        'overall_vader_compound': sentiments['compound'],
+                        'overall_vader_pos': sentiments['pos'],
+                        'overall_vader_neg': sentiments['neg'],
+                        'overall_vader_neu': sentiments['neu']}
 
-    # TODO: search for company names without ticker in story
 
+    # TODO: email summary
+    # sentiment and keyword (SEC, subpoena, sue...) alerts are raised on the stored
+    # record by alerts.AlertEngine, see alert_on_story
 
-    # TODO: get sentiment towards entities (stocks)
-    # possible tools for it:
-    # https://github.com/D2KLab/sentinel
-    # https://github.com/charlesashby/entity-sentiment-analysis
 
+    # find any stocks in title; set these as focus of the story
+    # (stocks the entity detection didn't pick up aren't in stocks_ents)
+    stocks_in_title = 0
+    title_stocks = set()
+    for s in stocks_ents.keys():
+        for ent in stocks_ents[s]:
+            if ent.text in story_df['title']:
+                stocks_in_title += 1
+                title_stocks.add(s)
+                main_stock = s
+                break  # only match once per stock
 
-    # get overall document sentiment -- doesn't work super well with vader for whole document
-    analyzer = SentimentIntensityAnalyzer()
+    sent_record = None
+    if stocks_in_title == 1 and sent_table_exists:
+        if not in_sent_db:
+            # save overall story sentiment if not already in db
+            sent_record = {'feedburner_origlink': link,
+                           'ticker': main_stock,
+                           'datetime': article_datetime,
+                           'overall_vader_compound': sentiments['compound'],
+                           'overall_vader_pos': sentiments['pos'],
+                           'overall_vader_neg': sentiments['neg'],
+                           'overall_vader_neu': sentiments['neu'],
+                           'sentence_vader_compound': avg_stocks_ents_sents[main_stock]['compound'],
+                           'sentence_vader_pos': avg_stocks_ents_sents[main_stock]['pos'],
+                           'sentence_vader_neg': avg_stocks_ents_sents[main_stock]['neg'],
+                           'sentence_vader_neu': avg_stocks_ents_sents[main_stock]['neu']}
+
+    # every stock in the story; also made for stories stored before this table was
+    entity_records = []
+    if not in_entity_db:
+        for s, scores in avg_stocks_ents_sents.items():
+            entity_records.append({'feedburner_origlink': link,
+                                   'ticker': s,
+                                   'datetime': article_datetime,
+                                   'mentions': len(stocks_ents[s]),
+                                   'n_sentences': scores['n_sentences'],
+                                   'in_title': s in title_stocks,
+                                   'sentence_vader_compound': scores['compound'],
+                                   'sentence_vader_pos': scores['pos'],
+                                   'sentence_vader_neg': scores['neg'],
+                                   'sentence_vader_neu': scores['neu'],
+                                   'sentence_vader_min_compound': scores['min_compound'],
+                                   'sentence_vader_max_compound': scores['max_compound']})
+
+    return story_record, sent_record, entity_records
+
+
+def alert_on_story(alert_engine, story_df, story_record, entity_records=()):
+    """
+    runs a newly scored story through the alert rules, with the tickers in the
+    story and the stocks linked to it by name (entity_records from analyze_story)
+    """
+    if alert_engine is None or story_record is None:
+        return
+    tickers = [t for t in story_record['stocks_in_story'].split(', ') if t] + [r['ticker'] for r in entity_records]
+    try:
+        alert_engine.evaluate(story_record['feedburner_origlink'], story_df['title'], story_record['body'],
+                              tickers, story_record['overall_vader_compound'], story_record['datetime'])
+    except Exception as e:
+        # a broken rule or sink shouldn't lose the story itself
+        print('alerting failed for', story_record['feedburner_origlink'], repr(e))
 
-    sentiments = get_sentiments_vader(body, analyzer)
 
-    stocks_ents_sentiments = {}
-    avg_stocks_ents_sents  = {}
-    for s in stocks_ents.keys():
-        sentiments_list = []
-        for ent in stocks_ents[s]:
-            temp_sentiments = get_sentiments_vader(ent.sent.text, analyzer)
-            sentiments_list.append(temp_sentiments)
+def save_story_records(story_records, sent_records, entity_records=(), writer=None):
+    """
+    saves lists of story_record/sent_record/entity_records dicts from
+    analyze_story() to sql
 
-        stocks_ents_sentiments[s] = pd.concat(sentiments_list).reset_index().drop('index', axis=1)
-        avg_stocks_ents_sents[s] = stocks_ents_sentiments[s].mean()
+    with a StoryWriter the rows are buffered and written in bulk later, otherwise
+    they are written right away with one COPY per table; either way the entity
+    sentiment rows are added to the per-ticker time series once they're in (the
+    writer should have been made with after_write={ENTITY_SENT_TABLE: SentimentSeries.add})
+    """
+    # save overall story details
+    tablename = 'reuters_story_bodies'
+    if writer is not None:
+        writer.add(tablename, story_records)
+    else:
+        copy_rows(get_engine(), tablename, story_records)
 
+    tablename = 'reuters_story_sentiments'
+    if writer is not None:
+        writer.add(tablename, sent_records)
+        writer.add(ENTITY_SENT_TABLE, list(entity_records))
+    else:
+        # makes sure the sentiment tables exist and have the datetime column
+        series = SentimentSeries(get_engine())
+        copy_rows(get_engine(), tablename, sent_records)
+        copy_rows(get_engine(), ENTITY_SENT_TABLE, list(entity_records))
+        series.add(entity_records)
 
-    # TODO:
-    # flog keywords: SEC, subpoena, sue, etc for negative
-    # look for stock entity in title to find focus of story
-    if in_body_db is None:
-        story_df_to_save = pd.Series({'feedburner_origlink': link,
-                                'datetime': article_datetime,
-                                'body': body,
-                                'stocks_in_story': ', '.join(stocks_in_story),
-                                # 'stocks_ents': stocks_ents,  # can't put dict in sql, and not sure want to save this anyway
-                                'overall_vader_compound': sentiments['compound'][0],
-                                'overall_vader_pos': sentiments['pos'][0],
-                                'overall_vader_neg': sentiments['neg'][0],
-                                'overall_vader_neu': sentiments['neu'][0]}).to_frame().T
 
-        # save to sql database
-        # save overall story details
-        story_df_to_save.to_sql(tablename, con=engine, if_exists='append', index=False)
+def scrape_story(story_df, offline=False, alert_engine=None):
+    """
+    pass in one slice of the raw rss dataframe
 
+    this grabs the stocks in the story, the overall sentiment, and cleans the body
+    then stores it in a sql database
 
-    # TODO: email summary/save avg_stocks_ents_sents to db
-    # TODO: text/email alert if sentiment is highly positive or negative (> 0.5 or < -0.5)
-    # or if keyword in story like sue, subpoena, etc
+    pages are read from and saved to the html cache; with offline=True the story
+    is skipped if its page isn't cached
 
+    alert_engine -- alerts.AlertEngine to check the scored story against, or None
+    """
+    link = canonical_url(story_df['feedburner_origlink'])
+    story_df = story_df.copy()
+    story_df['feedburner_origlink'] = link
+    in_body_db, in_sent_db, in_entity_db, analyzed, sent_table_exists = check_story_in_db(link)
+    if analyzed:
+        print('already analyzed')
+        return
 
-    # find any stocks in title; set these as focus of the story
-    stocks_in_title = 0
-    for s in stocks_in_story:
-        # sometimes entity detection doesn't detect the stock
-        if s not in stocks_ents.keys():
-            continue
+    # scrape story details
+    article_datetime = None
+    if not in_body_db:
+        content = fetch_story(link, cache=get_html_cache(), offline=offline)
+        if content is None:
+            return
+        article_datetime, body = parse_story(content, link)
+    else:
+        body = load_story_body(link)
 
-        for ent in stocks_ents[s]:
-            if ent.text in story_df['title']:
-                stocks_in_title += 1
-                main_stock = s
-                break  # only match once per stock
+    story_record, sent_record, entity_records = analyze_story(story_df, body, article_datetime, in_body_db, in_sent_db, sent_table_exists,
+                                                              in_entity_db=in_entity_db)
+    alert_on_story(alert_engine, story_df, story_record, entity_records)
+    save_story_records([r for r in [story_record] if r is not None],
+                       [r for r in [sent_record] if r is not None],
+                       entity_records)
+    mark_analyzed(get_engine(), [link])
 
-    if stocks_in_title == 1 and sent_table_exists is not None:
-        tablename = 'reuters_story_sentiments'
-        if in_sent_db is None:
-            # save overall story sentiment if not already in db
-            sent_df = pd.Series({'feedburner_origlink': link,
-                                'ticker': main_stock,
-                                'overall_vader_compound': sentiments['compound'][0],
-                                'overall_vader_pos': sentiments['pos'][0],
-                                'overall_vader_neg': sentiments['neg'][0],
-                                'overall_vader_neu': sentiments['neu'][0],
-                                'sentence_vader_compound': avg_stocks_ents_sents[s]['compound'],
-                                'sentence_vader_pos': avg_stocks_ents_sents[s]['pos'],
-                                'sentence_vader_neg': avg_stocks_ents_sents[s]['neg'],
-                                'sentence_vader_neu': avg_stocks_ents_sents[s]['neu']}).to_frame().T
-            sent_df.to_sql(tablename, con=engine, if_exists='append', index=False)
 
+def story_work_items(rss_df, chunksize=1000):
+    """
+    yields a work item dict for each rss_df row that still needs processing
 
-def scrape_all_stories(rss_df=None):
+    rss_df can be one DataFrame or an iterable of DataFrame chunks, e.g. from
+    iter_stories or load_rss(chunksize=...). DB status is looked up a chunk at a
+    time, so checking N stories takes a few queries per chunk instead of four per story
+
+    links are canonicalized, and each canonical link is only yielded once even if
+    rss_df has it under several feeds. stories marked analyzed in reuters_stories
+    are skipped
+    """
+    engine = get_engine()
+    if isinstance(rss_df, pd.DataFrame):
+        chunks = (rss_df.iloc[start:start + chunksize] for start in range(0, rss_df.shape[0], chunksize))
+    else:
+        chunks = rss_df
+
+    yielded = set()
+    for chunk in chunks:
+        chunk = chunk.assign(feedburner_origlink=chunk['feedburner_origlink'].map(canonical_url))
+        chunk = chunk.drop_duplicates(subset='feedburner_origlink')
+        chunk = chunk[~chunk['feedburner_origlink'].isin(yielded)]
+        yielded.update(chunk['feedburner_origlink'])
+        links = chunk['feedburner_origlink'].tolist()
+        body_links, sent_links, entity_links, analyzed, sent_table_exists = processed_links(engine, links)
+        # stories with a body that weren't analyzed yet don't need to be downloaded again
+        bodies = load_story_bodies(engine, body_links - analyzed)
+        for i, r in chunk.iterrows():
+            link = r['feedburner_origlink']
+            if link in analyzed:
+                continue
+            in_body_db = link in body_links
+            in_sent_db = link in sent_links
+            in_entity_db = link in entity_links
+
+            yield {'story_df': r, 'body': bodies.get(link), 'in_body_db': in_body_db,
+                   'in_sent_db': in_sent_db, 'in_entity_db': in_entity_db, 'sent_table_exists': sent_table_exists}
+
+
+def queued_work_items(story_queue, claim_size=100, worker_id=None):
+    """
+    claims jobs from story_queue a batch at a time and yields their work items;
+    jobs for stories that turn out to be processed already are marked done
     """
-    takes rss_df from load_rss() and scrapes the story text and gets sentiment for each
+    while True:
+        jobs = story_queue.claim(claim_size, worker_id)
+        if jobs.shape[0] == 0:
+            return
+
+        yielded = set()
+        for item in story_work_items(jobs):
+            yielded.add(item['story_df']['feedburner_origlink'])
+            yield item
+        story_queue.complete(set(jobs['feedburner_origlink']) - yielded)
 
-    scrape_story() only scrapes the story if it's not already in the DB
+
+def scrape_all_stories(rss_df=None, n_fetchers=8, n_processors=1, write_batch_size=500, host_rate=5, nlp_batch_size=16, offline=False, story_queue=None, alert_engine=None, nlp_workers=0):
     """
-    if rss_df is None:
-        rss_df = load_rss()
+    takes rss_df from load_rss() (a DataFrame or a generator of chunks) and scrapes
+    the story text and gets sentiment for each
+
+    runs as a pipeline: n_fetchers threads download pages (at most host_rate
+    requests/sec per host), n_processors threads parse and run NLP on up to
+    nlp_batch_size stories at a time with nlp.pipe, and a writer saves the
+    results with COPY once write_batch_size rows are buffered (or every 30s)
 
-    for i, r in rss_df.iterrows():
-        scrape_story(r)
+    only scrapes stories not marked analyzed in reuters_stories yet; pages already in the
+    html cache are read from disk without being rate limited, and with offline=True
+    stories whose pages aren't cached are skipped
 
+    with a story_queue.StoryQueue (and no rss_df), stories are claimed from the
+    queue instead; each job is marked done once its rows are written, and failed
+    (to be retried, or dead-lettered) if its page can't be fetched or processed
 
-def load_story_df(remove_dupes=False):
-    engine = create_engine()
+    with an alerts.AlertEngine, each story is checked against the alert rules as
+    soon as it's scored, before it waits for the DB write; the engine is closed
+    once the run is over
+
+    with nlp_workers > 0, spaCy and VADER run in an NLPPool of that many forked
+    processes sharing one copy of the model; use about as many n_processors so
+    there are enough batches in flight to keep them busy
+    """
+    # forked before any of the pipeline's threads are started
+    nlp_pool = NLPPool(nlp_workers, batch_size=nlp_batch_size).start() if nlp_workers > 0 else None
+
+    if story_queue is not None:
+        rss_df = queued_work_items(story_queue)
+    elif rss_df is None:
+        # one row per story rather than one per feed it showed up in; only the
+        # columns scraping needs are streamed
+        ensure_story_table(get_engine())
+        rss_df = iter_stories(get_engine(), columns=['feedburner_origlink', 'title'], chunksize=1000)
+
+    def written(links):
+        # these stories' rows are in: don't analyze them again, and finish their jobs
+        mark_analyzed(get_engine(), links)
+        if story_queue is not None:
+            story_queue.complete(links)
+
+    session = make_session(n_fetchers)
+    series = SentimentSeries(get_engine())
+    writer = StoryWriter(get_engine(), flush_rows=write_batch_size, on_flush=written,
+                         after_write={ENTITY_SENT_TABLE: series.add})
+    cache = get_html_cache()
+    # bodies seen this run, to catch the same story under different links
+    body_index = NearDupIndex()
+    body_index_lock = threading.Lock()
+
+    def job_failed(item, error):
+        link = item['story_df']['feedburner_origlink']
+        print('could not process', link, repr(error))
+        if story_queue is not None:
+            story_queue.fail(link, repr(error))
+
+    def fetch(item):
+        item['content'] = None
+        if not item['in_body_db']:
+            try:
+                item['content'] = fetch_story(item['story_df']['feedburner_origlink'], session=session,
+                                              cache=cache, offline=offline)
+            except Exception as e:
+                job_failed(item, e)
+                return None
+            if item['content'] is None:
+                if not offline:
+                    job_failed(item, 'page unavailable')
+                return None
+
+        return item
+
+    def process(items):
+        # stories whose title looked like a recent story's are dropped if their body does too
+        candidates = near_dup_candidates(get_engine(), [item['story_df']['feedburner_origlink']
+                                                        for item in items if item['content'] is not None])
+        candidate_bodies = load_story_bodies(get_engine(), set(candidates.values()))
+        # (item, article_datetime, body) for the stories that parsed
+        parsed = []
+        for item in items:
+            article_datetime = None
+            body = item['body']
+            try:
+                if item['content'] is not None:
+                    article_datetime, body = parse_story(item['content'], item['story_df']['feedburner_origlink'])
+            except Exception as e:
+                # one bad page shouldn't sink the rest of the batch
+                job_failed(item, e)
+                continue
+
+            if item['content'] is not None:
+                link = item['story_df']['feedburner_origlink']
+                h = simhash(body)
+                with body_index_lock:
+                    dup = body_index.find(h)
+                    if dup is None:
+                        body_index.add(link, h)
+                if dup is None and candidates.get(link) in candidate_bodies:
+                    if hamming(h, simhash(candidate_bodies[candidates[link]])) <= body_index.max_distance:
+                        dup = candidates[link]
+                        fold_near_duplicate(get_engine(), link, dup)
+                if dup is not None:
+                    print('skipping', link, '-- same story as', dup)
+                    writer.track([link])
+                    continue
+            parsed.append((item, article_datetime, body))
+
+        results = []
+        bodies = [body for _, _, body in parsed]
+        if nlp_pool is not None:
+            docs = nlp_pool.pipe(bodies)
+        else:
+            docs = pipe_docs(get_nlp(), bodies, batch_size=nlp_batch_size)
+        try:
+            docs = list(docs)
+        except Exception as e:
+            # e.g. the NLP worker with the batch died; fail the jobs so they're retried
+            for item, _, _ in parsed:
+                job_failed(item, e)
+            return results
+        for (item, article_datetime, body), doc in zip(parsed, docs):
+            try:
+                story_record, sent_record, entity_records = analyze_story(item['story_df'], body, article_datetime,
+                                                                          item['in_body_db'], item['in_sent_db'],
+                                                                          item['sent_table_exists'], proc_doc=doc,
+                                                                          in_entity_db=item['in_entity_db'])
+            except Exception as e:
+                job_failed(item, e)
+                continue
+            alert_on_story(alert_engine, item['story_df'], story_record, entity_records)
+            results.append((story_record, sent_record, entity_records, item['story_df']['feedburner_origlink']))
+        return results
+
+    def write(batch):
+        save_story_records([s for s, _, _, _ in batch if s is not None],
+                           [s for _, s, _, _ in batch if s is not None],
+                           [r for _, _, records, _ in batch for r in records],
+                           writer=writer)
+        # stories are marked analyzed (and queued jobs done) once these rows are flushed
+        writer.track([link for _, _, _, link in batch])
+        writer.flush_if_due()
+
+    def url(item):
+        link = item['story_df']['feedburner_origlink']
+        # no request is made for these, so they don't count against the rate limit
+        if item['in_body_db'] or offline or link in cache:
+            return None
+        return link
+
+    pipeline = StoryPipeline(fetch, None, write,
+                             n_fetchers=n_fetchers,
+                             n_processors=n_processors,
+                             process_batch_fn=process,
+                             process_batch_size=nlp_batch_size,
+                             write_batch_size=nlp_batch_size,
+                             host_rate=host_rate,
+                             url_fn=url)
+    try:
+        stats = pipeline.run(rss_df if story_queue is not None else story_work_items(rss_df))
+    finally:
+        # whatever is still buffered gets written even if the run is interrupted
+        writer.close()
+        session.close()
+        if nlp_pool is not None:
+            nlp_pool.close()
+    if alert_engine is not None:
+        # alerts still being sent aren't in the stats or latencies until they're done
+        alert_engine.close()
+        print('alerts:', alert_engine.stats)
+        print('publish-to-alert seconds:', alert_engine.latency_report())
+    if story_queue is not None:
+        print('story queue:', story_queue.counts())
+    return stats
+
+
+def process_story_queue(enqueue=True, **kwargs):
+    """
+    drains the story queue; run this in as many processes as you like, they each
+    claim their own jobs and a stopped worker's jobs are picked up after their lease
+
+    enqueue -- first add jobs for any stories in reuters_stories without one
+    kwargs -- passed on to scrape_all_stories
+    """
+    story_queue = StoryQueue(get_engine())
+    if enqueue:
+        ensure_story_table(get_engine())
+        story_queue.enqueue_stories()
+    return scrape_all_stories(story_queue=story_queue, **kwargs)
+
+
+def run_story_workers(n_workers=4, **kwargs):
+    """
+    queues new stories, then drains the queue with n_workers processes
+    """
+    story_queue = StoryQueue(get_engine())
+    ensure_story_table(get_engine())
+    story_queue.enqueue_stories()
+    # spawn so each worker makes its own DB connections and loads its own model
+    ctx = mp.get_context('spawn')
+    workers = [ctx.Process(target=process_story_queue, kwargs=dict(kwargs, enqueue=False)) for _ in range(n_workers)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    print('story queue:', story_queue.counts())
+
+
+def backfill_archive(checkpoint_file=CHECKPOINT_FILE, sections=ARCHIVE_SECTIONS, max_pages=3000, pages_per_partition=100,
+                     since=None, n_fetchers=4, host_rate=1, scrape=True, **kwargs):
+    """
+    walks the reuters archive listings (see reuters_archive) and scrapes the
+    stories that aren't in the DB yet
+
+    listed stories are added to reuters_stories, deduplicated against the stories
+    already there by canonical link (near-duplicate titles are checked against the
+    body once scraped), and the new ones are
+    queued in story_jobs before their page is checkpointed. the queue is then
+    drained with scrape_all_stories, so story pages are fetched, analyzed and
+    bulk-written like any others (run_story_workers can drain it alongside, too)
+
+    stop it whenever; running it again carries on from checkpoint_file, and stories
+    listed but not scraped yet are still in the queue. adding a story and queueing
+    it are separate writes, so a resumed run first queues any stories in
+    reuters_stories that were added but never got a job
+
+    args:
+    sections, max_pages, pages_per_partition -- the plan, only used when starting a new one
+    since -- stop going back through a section once its stories are older than this
+    n_fetchers, host_rate -- archive pages fetched at once, and max requests/sec
+    scrape -- scrape the queued stories once the listings are walked
+    kwargs -- passed on to scrape_all_stories
+    """
+    engine = get_engine()
+    registry = StoryRegistry.from_db(engine)
+    story_queue = StoryQueue(engine)
+    registry_lock = threading.Lock()
+
+    def save_stories(section, stories):
+        stories = stories.assign(category=section, time_added=datetime.utcnow())
+        with registry_lock:
+            new_links = set(registry.add_new(stories))
+        if len(new_links) == 0:
+            return
+        stories = stories.assign(feedburner_origlink=stories['feedburner_origlink'].map(canonical_url))
+        story_queue.enqueue(stories[stories['feedburner_origlink'].isin(new_links)].drop_duplicates('feedburner_origlink'))
+
+    if os.path.exists(checkpoint_file):
+        # the last run may have stopped between registry.add_new and enqueue
+        story_queue.enqueue_stories()
+    plan = ArchivePlan.load_or_create(checkpoint_file, sections, max_pages, pages_per_partition)
+    stats = walk_archive(plan, save_stories, n_fetchers=n_fetchers, host_rate=host_rate, since=since)
+    print('walked {pages} archive pages listing {stories} stories'.format(**stats),
+          '({} with near-duplicate titles, to check against their bodies)'.format(registry.near_duplicates))
+
+    if scrape:
+        process_story_queue(enqueue=False, **kwargs)
+        print('story queue:', story_queue.counts())
+
+
+def load_story_df(remove_dupes=False, columns=None, start=None, end=None, categories=None, chunksize=None):
+    """
+    loads the scraped story bodies and overall sentiments
+
+    args:
+    remove_dupes -- first deletes duplicate rows from the table (done in SQL)
+    columns -- list of columns to load, None for all
+    start, end -- only stories with datetime in [start, end)
+    categories -- only stories from these rss categories
+    chunksize -- if set, returns a generator of DataFrames instead of one DataFrame
+    """
+    engine = get_engine()
     tablename = 'reuters_story_bodies'
-    story_df = pd.read_sql(tablename, con=engine)
     if remove_dupes:
-        story_df.drop_duplicates(inplace=True)
-        engine.execute('DROP TABLE IF EXISTS ' + tablename + ';')
-        story_df.to_sql(tablename, con=engine, index=False)
+        remove_duplicate_rows(engine, tablename)
+    if categories is not None:
+        # categories are looked up in reuters_stories
+        ensure_story_table(engine)
 
-    return story_df
+    chunks = iter_story_df(engine, columns, start, end, categories, chunksize=chunksize or 10000)
+    if chunksize is not None:
+        return chunks
 
+    return concat_chunks(chunks, columns)
 
-def export_story_df(filename='story_df.ft'):
+
+def export_story_df(out_dir=None):
     """
-    export story_df to a feather file for fast and easy loading
+    exports stories added since the last export to date-partitioned feather files
+    for fast and easy loading; load them with story_export.load_exported_stories()
+
+    out_dir -- story_export.EXPORT_DIR if None
     """
-    df = load_story_df()
-    df.to_feather(filename)
+    # imported here so pyarrow is only loaded when exporting
+    from story_export import EXPORT_DIR, export_stories
+    return export_stories(get_engine(), out_dir or EXPORT_DIR)
 
 
 def load_sent_df(remove_dupes=False):
-    engine = create_engine()
+    """
+    loads the per-story ticker sentiments; for a ticker's sentiment over time use
+    sentiment_series.SentimentSeries(get_engine()).window(), which reads the
+    pre-aggregated buckets instead
+
+    args:
+    remove_dupes -- first deletes duplicate rows from the table (done in SQL)
+    """
+    engine = get_engine()
     tablename = 'reuters_story_sentiments'
-    sent_df = pd.read_sql(tablename, con=engine)
     if remove_dupes:
-        sent_df.drop_duplicates(inplace=True)
-        engine.execute('DROP TABLE IF EXISTS ' + tablename + ';')
-        sent_df.to_sql(tablename, con=engine, index=False)
+        remove_duplicate_rows(engine, tablename)
+    sent_df = pd.read_sql(tablename, con=engine)
 
-    return story_df
+    return sent_df
+
+
+def load_entity_sent_df(tickers=None):
+    """
+    loads the per-story sentiment towards every stock mentioned in it
+
+    args:
+    tickers -- only rows for these tickers, None for all
+    """
+    engine = get_engine()
+    sql = 'SELECT * FROM ' + ENTITY_SENT_TABLE
+    params = {}
+    if tickers is not None:
+        sql += ' WHERE ticker = ANY(:tickers)'
+        params['tickers'] = list(tickers)
+    return pd.read_sql(text(sql), con=engine, params=params)
 
 
 def backup_db():
@@ -539,8 +1024,3 @@ local_timezone = tzlocal.get_localzone() # get pytz tzinfo
 local_time = dt.replace(tzinfo=pytz.utc).astimezone(local_timezone)
 """
 
-
-# TODO: scrape hot stocks, archive, maybe Rates archive
-# https://www.reuters.com/news/archive/hotStocksNews
-# https://www.reuters.com/news/archive
-# https://www.reuters.com/news/archive/rates-rss?view=page&page=6&pageSize=10
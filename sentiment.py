@@ -0,0 +1,80 @@
+"""
+VADER sentiment helpers
+
+the analyzer loads its lexicon when created, so one is shared by the whole
+process and only made on first use; scores come back as numpy arrays
+"""
+
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+SCORE_COLS = ['compound', 'pos', 'neg', 'neu']
+# texts longer than this (i.e. bodies rather than sentences) aren't cached
+MAX_CACHED_LEN = 500
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def get_analyzer():
+    """
+    process-wide SentimentIntensityAnalyzer, created on first use
+    """
+    global _analyzer
+    # no lock once it's made, for processes forked from a threaded one (see story_nlp.get_nlp)
+    if _analyzer is not None:
+        return _analyzer
+    with _analyzer_lock:
+        if _analyzer is None:
+            from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+            _analyzer = SentimentIntensityAnalyzer()
+        return _analyzer
+
+
+def _polarity_scores(text):
+    vs = get_analyzer().polarity_scores(text)
+    return tuple(vs[c] for c in SCORE_COLS)
+
+
+# sentences repeat (boilerplate, the same sentence for two stocks); bodies don't
+_cached_polarity_scores = lru_cache(maxsize=10000)(_polarity_scores)
+
+
+def score_texts(texts):
+    """
+    VADER scores for a list of texts or sentences
+
+    returns a (len(texts), 4) float array with columns in SCORE_COLS order;
+    repeated sentences (e.g. one mentioning two stocks) are only scored once
+    """
+    rows = [_cached_polarity_scores(t) if len(t) <= MAX_CACHED_LEN else _polarity_scores(t) for t in texts]
+    return np.array(rows, dtype=float).reshape(-1, len(SCORE_COLS))
+
+
+def entity_sentence_scores(sentences, entity_sentences, score_fn=score_texts):
+    """
+    aggregated sentence scores per entity, with every sentence scored once however
+    many entities it mentions
+
+    args:
+    sentences -- list of distinct sentence texts
+    entity_sentences -- dict of entity (e.g. ticker) -> indexes into sentences of the
+        sentences mentioning it; repeats (two mentions in one sentence) count once
+    score_fn -- score_texts, or another function with its signature
+
+    returns dict of entity -> {'n_sentences', 'compound', 'pos', 'neg', 'neu',
+    'min_compound', 'max_compound'}
+    """
+    scores = score_fn(sentences)
+    compound = SCORE_COLS.index('compound')
+    entity_scores = {}
+    for entity, idx in entity_sentences.items():
+        rows = scores[sorted(set(idx))]
+        agg = dict(zip(SCORE_COLS, rows.mean(axis=0)))
+        agg['n_sentences'] = rows.shape[0]
+        agg['min_compound'] = rows[:, compound].min()
+        agg['max_compound'] = rows[:, compound].max()
+        entity_scores[entity] = agg
+    return entity_scores
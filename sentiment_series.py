@@ -0,0 +1,189 @@
+"""
+per-ticker sentiment time series, pre-aggregated into 1m/1h/1d buckets
+
+ticker_sentiment_windows has one row per (ticker, resolution, bucket start) with
+the story count and the sum, min and max compound score, so a window's mean and
+extremes come from a handful of indexed rows instead of a scan over
+reuters_entity_sentiments (every stock mentioned in every story). buckets are
+updated with an upsert as entity sentiment rows are written (StoryWriter's
+after_write hook), and rebuild() recomputes them from scratch if they ever drift
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from story_db import BODY_TABLE, SENT_TABLE, ENTITY_SENT_TABLE, table_exists, ensure_entity_sent_table, link_column
+
+SERIES_TABLE = 'ticker_sentiment_windows'
+# resolution -> (pandas frequency, postgres date_trunc unit, seconds)
+RESOLUTIONS = {'1m': ('min', 'minute', 60),
+               '1h': ('h', 'hour', 3600),
+               '1d': ('D', 'day', 86400)}
+# most buckets window() reads before moving to a coarser resolution
+MAX_BUCKETS = 1500
+
+_ensured_engines = set()
+_ensured_lock = threading.Lock()
+
+
+def ensure_series_tables(engine):
+    """
+    creates ticker_sentiment_windows and reuters_entity_sentiments, and adds the
+    datetime column that sentiment rows now carry to an older
+    reuters_story_sentiments, filling it in (and any missing entity row times)
+    from the story bodies
+    """
+    with _ensured_lock:
+        if engine in _ensured_engines:
+            return
+
+        ensure_entity_sent_table(engine)
+        with engine.begin() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS {} ('
+                         'ticker text NOT NULL, '
+                         'resolution text NOT NULL, '
+                         'bucket timestamptz NOT NULL, '
+                         'n integer NOT NULL, '
+                         'sum_compound double precision NOT NULL, '
+                         'min_compound double precision NOT NULL, '
+                         'max_compound double precision NOT NULL, '
+                         'PRIMARY KEY (ticker, resolution, bucket));'.format(SERIES_TABLE))
+            if table_exists(engine, SENT_TABLE):
+                conn.execute('ALTER TABLE {} ADD COLUMN IF NOT EXISTS datetime timestamptz;'.format(SENT_TABLE))
+            # entity rows made from already stored bodies don't come with their time either
+            for tablename in [SENT_TABLE, ENTITY_SENT_TABLE]:
+                if table_exists(engine, tablename):
+                    conn.execute('UPDATE {0} s SET datetime = b.datetime FROM {1} b '
+                                 'WHERE s.datetime IS NULL AND b.datetime IS NOT NULL '
+                                 'AND {2} = {3};'.format(tablename, BODY_TABLE, link_column(tablename, 's'), link_column(BODY_TABLE, 'b')))
+        # only once it all went through, so a failed run is retried next time
+        _ensured_engines.add(engine)
+
+
+class SentimentSeries:
+    """
+    args:
+    engine -- SQL engine (postgres)
+    source_table -- table of sentiment rows with ticker and datetime columns
+    compound_col -- which compound score of the sentiment rows to aggregate
+    """
+    def __init__(self, engine, source_table=ENTITY_SENT_TABLE, compound_col='sentence_vader_compound'):
+        self.engine = engine
+        self.source_table = source_table
+        self.compound_col = compound_col
+        ensure_series_tables(engine)
+
+    def bucket_rows(self, sent_df):
+        """
+        per-bucket aggregates of sentiment rows, for every resolution
+        """
+        frames = []
+        for resolution, (freq, _, _) in RESOLUTIONS.items():
+            buckets = sent_df['datetime'].dt.floor(freq)
+            agg = sent_df.groupby(['ticker', buckets])[self.compound_col].agg(['count', 'sum', 'min', 'max'])
+            agg = agg.reset_index().rename(columns={'datetime': 'bucket', 'count': 'n', 'sum': 'sum_compound',
+                                                    'min': 'min_compound', 'max': 'max_compound'})
+            agg['resolution'] = resolution
+            frames.append(agg)
+        return pd.concat(frames, ignore_index=True)
+
+    def add(self, sent_records):
+        """
+        adds newly written sentiment rows (dicts like analyze_story's entity_records)
+        to the buckets
+        """
+        if len(sent_records) == 0:
+            return
+        sent_df = pd.DataFrame(sent_records)
+        missing = sent_df['datetime'].isnull()
+        if missing.any():
+            # stories whose body was already stored don't come with their time
+            datetimes = self.story_datetimes(sent_df.loc[missing, 'feedburner_origlink'])
+            sent_df.loc[missing, 'datetime'] = sent_df.loc[missing, 'feedburner_origlink'].map(datetimes)
+        sent_df['datetime'] = pd.to_datetime(sent_df['datetime'], utc=True)
+        sent_df = sent_df.dropna(subset=['datetime', 'ticker', self.compound_col])
+        if sent_df.shape[0] == 0:
+            return
+
+        rows = [{'ticker': r.ticker, 'resolution': r.resolution, 'bucket': r.bucket.to_pydatetime(), 'n': int(r.n),
+                 'sum_compound': float(r.sum_compound), 'min_compound': float(r.min_compound),
+                 'max_compound': float(r.max_compound)}
+                for r in self.bucket_rows(sent_df).itertuples()]
+        with self.engine.begin() as conn:
+            conn.execute(text('INSERT INTO {0} (ticker, resolution, bucket, n, sum_compound, min_compound, max_compound) '
+                              'VALUES (:ticker, :resolution, :bucket, :n, :sum_compound, :min_compound, :max_compound) '
+                              'ON CONFLICT (ticker, resolution, bucket) DO UPDATE SET '
+                              'n = {0}.n + EXCLUDED.n, '
+                              'sum_compound = {0}.sum_compound + EXCLUDED.sum_compound, '
+                              'min_compound = LEAST({0}.min_compound, EXCLUDED.min_compound), '
+                              'max_compound = GREATEST({0}.max_compound, EXCLUDED.max_compound);'.format(SERIES_TABLE)),
+                         rows)
+
+    def story_datetimes(self, links):
+        stmt = text('SELECT {0}, datetime FROM {1} WHERE {0} = ANY(:links);'.format(link_column(BODY_TABLE), BODY_TABLE))
+        res = self.engine.execute(stmt, links=list(set(links)))
+        return dict(res.fetchall())
+
+    def rebuild(self):
+        """
+        recomputes every bucket from the source table
+        """
+        with self.engine.begin() as conn:
+            conn.execute('DELETE FROM {};'.format(SERIES_TABLE))
+            for resolution, (_, unit, _) in RESOLUTIONS.items():
+                # buckets start on utc boundaries like bucket_rows' (date_trunc alone uses the session time zone)
+                conn.execute(text("INSERT INTO {0} SELECT ticker, :resolution, date_trunc('{1}', datetime AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', "
+                                  "count(*), sum({2}), min({2}), max({2}) FROM {3} "
+                                  "WHERE datetime IS NOT NULL AND ticker IS NOT NULL AND {2} IS NOT NULL "
+                                  "GROUP BY ticker, date_trunc('{1}', datetime AT TIME ZONE 'UTC');".format(
+                                      SERIES_TABLE, unit, self.compound_col, self.source_table)),
+                             resolution=resolution)
+
+    def window(self, ticker, start, end, resolution=None):
+        """
+        buckets for ticker in [start, end), indexed by bucket start, with n, mean,
+        min and max compound
+
+        resolution -- '1m', '1h' or '1d'; by default the finest one that needs at
+            most MAX_BUCKETS buckets
+        """
+        start = pd.Timestamp(start, tz='UTC') if pd.Timestamp(start).tzinfo is None else pd.Timestamp(start)
+        end = pd.Timestamp(end, tz='UTC') if pd.Timestamp(end).tzinfo is None else pd.Timestamp(end)
+        if resolution is None:
+            span = (end - start).total_seconds()
+            resolution = next((r for r, (_, _, seconds) in RESOLUTIONS.items() if span / seconds <= MAX_BUCKETS), '1d')
+
+        df = pd.read_sql(text('SELECT bucket, n, sum_compound, min_compound, max_compound FROM {} '
+                              'WHERE ticker = :ticker AND resolution = :resolution '
+                              'AND bucket >= :start AND bucket < :end ORDER BY bucket;'.format(SERIES_TABLE)),
+                         con=self.engine,
+                         params={'ticker': ticker, 'resolution': resolution,
+                                 'start': start.to_pydatetime(), 'end': end.to_pydatetime()},
+                         index_col='bucket')
+        df['mean_compound'] = df['sum_compound'] / df['n']
+        return df[['n', 'mean_compound', 'min_compound', 'max_compound']]
+
+    def summary(self, ticker, start, end, resolution=None):
+        """
+        one dict of n, mean, min and max compound over [start, end); bucket edges
+        are at the window's resolution, e.g. whole minutes for a few hours
+        """
+        df = self.window(ticker, start, end, resolution)
+        n = int(df['n'].sum())
+        if n == 0:
+            return {'n': 0, 'mean_compound': np.nan, 'min_compound': np.nan, 'max_compound': np.nan}
+        return {'n': n,
+                'mean_compound': (df['mean_compound'] * df['n']).sum() / n,
+                'min_compound': df['min_compound'].min(),
+                'max_compound': df['max_compound'].max()}
+
+    def rolling(self, ticker, window='1h', end=None):
+        """
+        summary over the window (a pandas offset like '1h', '15min', '7d') ending at
+        end (now by default), e.g. rolling('MTCH', '1h')
+        """
+        end = pd.Timestamp.now(tz='UTC') if end is None else pd.Timestamp(end)
+        return self.summary(ticker, end - pd.Timedelta(window), end)
@@ -0,0 +1,496 @@
+"""
+batched DB lookups for story processing
+
+instead of two table-existence queries and two per-link selects for every story,
+links are checked in chunks with parameterized `= ANY(:links)` queries against an
+index on feedburner_origlink
+
+new rows are buffered by StoryWriter and written in bulk with COPY instead of one
+INSERT transaction per story
+
+iter_rss/iter_stories/iter_story_df stream tables in chunks with a server-side
+cursor, pushing column selection, filters and DISTINCT ON dedup down into SQL
+"""
+
+import io
+import time
+import atexit
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+from rss_dedup import canonical_url_sql
+
+RAW_RSS_TABLE = 'reuters_raw_rss'
+# one row per story (canonical link), with the set of feeds it came in from
+STORY_TABLE = 'reuters_stories'
+BODY_TABLE = 'reuters_story_bodies'
+SENT_TABLE = 'reuters_story_sentiments'
+# one row per (story, ticker) for every stock mentioned in a story
+ENTITY_SENT_TABLE = 'reuters_entity_sentiments'
+# tables with rows stored under feed links (?feedType=...) from before links were
+# canonicalized; they're looked up by the canonical form of their links, so that
+# works whether or not story_registry.canonicalize_stored_links() was run
+LEGACY_LINK_TABLES = {BODY_TABLE, SENT_TABLE}
+
+# max links per ANY(:links) query
+LOOKUP_CHUNKSIZE = 5000
+
+# tables known to exist; only positives are cached since a missing table can be
+# created later by the writer
+_existing_tables = set()
+_indexed_tables = set()
+# tables whose analyzed_at column is known to be there
+_analyzed_tables = set()
+_existing_tables_lock = threading.Lock()
+
+
+def table_exists(engine, tablename):
+    """
+    checks if tablename exists, hitting the DB at most once per process once it does
+    """
+    with _existing_tables_lock:
+        if tablename in _existing_tables:
+            return True
+
+    with engine.connect() as conn:
+        exists = engine.dialect.has_table(conn, tablename)
+    if exists:
+        with _existing_tables_lock:
+            _existing_tables.add(tablename)
+
+    return exists
+
+
+def link_column(tablename, alias=None):
+    """
+    SQL for the (canonical) link of a row of tablename, to match canonical links
+    against; alias is the table's alias in the query, if it has one
+    """
+    column = 'feedburner_origlink' if alias is None else alias + '.feedburner_origlink'
+    if tablename in LEGACY_LINK_TABLES:
+        return canonical_url_sql(column)
+    return column
+
+
+def ensure_link_index(engine, tablename):
+    """
+    index on feedburner_origlink (on its canonical form, for LEGACY_LINK_TABLES) so
+    the ANY(:links) lookups don't scan the table; only issued once per table per process
+    """
+    with _existing_tables_lock:
+        if tablename in _indexed_tables:
+            return
+        _indexed_tables.add(tablename)
+
+    engine.execute('CREATE INDEX IF NOT EXISTS {0}_link_idx ON {0} (feedburner_origlink);'.format(tablename))
+    if tablename in LEGACY_LINK_TABLES:
+        engine.execute('CREATE INDEX IF NOT EXISTS {0}_canonical_link_idx ON {0} (({1}));'.format(tablename, link_column(tablename)))
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def links_in_table(engine, links, tablename):
+    """
+    returns the set of (canonical) links that already have a row in tablename
+    """
+    links = list(links)
+    if len(links) == 0 or not table_exists(engine, tablename):
+        return set()
+    ensure_link_index(engine, tablename)
+
+    stmt = text('SELECT DISTINCT {0} FROM {1} WHERE {0} = ANY(:links);'.format(link_column(tablename), tablename))
+    found = set()
+    for chunk in _chunks(links, LOOKUP_CHUNKSIZE):
+        res = engine.execute(stmt, links=chunk)
+        found.update(row[0] for row in res)
+
+    return found
+
+
+def processed_links(engine, links):
+    """
+    which of these links are already processed
+
+    returns body_links, sent_links, entity_links, analyzed_links, sent_table_exists --
+    the links already in reuters_story_bodies, reuters_story_sentiments and
+    reuters_entity_sentiments, and those marked analyzed in reuters_stories
+    """
+    body_links = links_in_table(engine, links, BODY_TABLE)
+    sent_table_exists = table_exists(engine, SENT_TABLE)
+    sent_links = links_in_table(engine, links, SENT_TABLE)
+    entity_links = links_in_table(engine, links, ENTITY_SENT_TABLE)
+    return body_links, sent_links, entity_links, analyzed_links(engine, links), sent_table_exists
+
+
+def ensure_analyzed_column(engine):
+    """
+    adds analyzed_at to reuters_stories: when the story was analyzed and its rows
+    written. most stories have no sentiment row (that needs exactly one stock in
+    the title) and many no stock at all, so this is what marks them done
+    """
+    with _existing_tables_lock:
+        if STORY_TABLE in _analyzed_tables:
+            return
+    if not table_exists(engine, STORY_TABLE):
+        return
+
+    engine.execute('ALTER TABLE {} ADD COLUMN IF NOT EXISTS analyzed_at timestamp;'.format(STORY_TABLE))
+    with _existing_tables_lock:
+        _analyzed_tables.add(STORY_TABLE)
+
+
+def analyzed_links(engine, links):
+    """
+    returns the set of links whose stories are marked analyzed
+    """
+    links = list(links)
+    if len(links) == 0 or not table_exists(engine, STORY_TABLE):
+        return set()
+    ensure_analyzed_column(engine)
+
+    stmt = text('SELECT feedburner_origlink FROM {} '
+                'WHERE analyzed_at IS NOT NULL AND feedburner_origlink = ANY(:links);'.format(STORY_TABLE))
+    found = set()
+    for chunk in _chunks(links, LOOKUP_CHUNKSIZE):
+        res = engine.execute(stmt, links=chunk)
+        found.update(row[0] for row in res)
+
+    return found
+
+
+def mark_analyzed(engine, links):
+    """
+    sets analyzed_at for these links' stories in reuters_stories
+    """
+    links = list(links)
+    if len(links) == 0 or not table_exists(engine, STORY_TABLE):
+        return
+    ensure_analyzed_column(engine)
+
+    stmt = text("UPDATE {} SET analyzed_at = now() AT TIME ZONE 'UTC' "
+                'WHERE feedburner_origlink = ANY(:links);'.format(STORY_TABLE))
+    with engine.begin() as conn:
+        for chunk in _chunks(links, LOOKUP_CHUNKSIZE):
+            conn.execute(stmt, links=chunk)
+
+
+def ensure_entity_sent_table(engine):
+    """
+    creates reuters_entity_sentiments if it's missing; made up front rather than by
+    the writer so datetime is a timestamp even if the first rows have none
+    """
+    if table_exists(engine, ENTITY_SENT_TABLE):
+        return
+
+    with engine.begin() as conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS {} ('
+                     'feedburner_origlink text NOT NULL, '
+                     'ticker text NOT NULL, '
+                     'datetime timestamptz, '
+                     'mentions integer, '
+                     'n_sentences integer, '
+                     'in_title boolean, '
+                     'sentence_vader_compound double precision, '
+                     'sentence_vader_pos double precision, '
+                     'sentence_vader_neg double precision, '
+                     'sentence_vader_neu double precision, '
+                     'sentence_vader_min_compound double precision, '
+                     'sentence_vader_max_compound double precision);'.format(ENTITY_SENT_TABLE))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_link_idx ON {0} (feedburner_origlink);'.format(ENTITY_SENT_TABLE))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_ticker_idx ON {0} (ticker, datetime);'.format(ENTITY_SENT_TABLE))
+
+
+def load_story_bodies(engine, links):
+    """
+    returns dict of (canonical) link -> stored body for links in reuters_story_bodies
+    """
+    links = list(links)
+    if len(links) == 0 or not table_exists(engine, BODY_TABLE):
+        return {}
+    ensure_link_index(engine, BODY_TABLE)
+
+    stmt = text('SELECT {0}, body FROM {1} WHERE {0} = ANY(:links);'.format(link_column(BODY_TABLE), BODY_TABLE))
+    bodies = {}
+    for chunk in _chunks(links, LOOKUP_CHUNKSIZE):
+        res = engine.execute(stmt, links=chunk)
+        bodies.update((link, body) for link, body in res)
+
+    return bodies
+
+
+def copy_rows(engine, tablename, records):
+    """
+    appends a list of row dicts to tablename in one transaction
+
+    on postgres this streams a csv through COPY FROM STDIN; other databases (e.g. a
+    sqlite stand-in) get one multi-row insert. the table is created from the first
+    records if it doesn't exist yet
+    """
+    if len(records) == 0:
+        return
+
+    df = pd.DataFrame(records)
+    if not table_exists(engine, tablename):
+        # let pandas pick the column types, then load the rows below
+        df.head(0).to_sql(tablename, con=engine, index=False)
+
+    if engine.dialect.name != 'postgresql':
+        df.to_sql(tablename, con=engine, if_exists='append', index=False, method='multi', chunksize=500)
+        return
+
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    columns = ', '.join('"{}"'.format(c) for c in df.columns)
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(tablename, columns), buf)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+class StoryWriter:
+    """
+    buffers rows per table and writes them with copy_rows() once flush_rows rows
+    are waiting or the oldest buffered row is flush_seconds old
+
+    always call close() (or use it as a context manager) so the last rows are
+    written; it is also registered with atexit as a last resort
+
+    on_flush, if given, is called after each flush with the keys passed to track()
+    since the last one, e.g. to mark queued jobs done only once their rows are in
+
+    after_write is a dict of tablename -> function called with each batch of rows
+    once they're written to that table, e.g. to update aggregates of them
+    """
+    def __init__(self, engine, flush_rows=1000, flush_seconds=30, on_flush=None, after_write=None):
+        self.engine = engine
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.on_flush = on_flush
+        self.after_write = after_write or {}
+        self.tracked_keys = []
+        self.buffers = {}
+        self.first_buffered = None
+        self.rows_written = 0
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def add(self, tablename, records):
+        """
+        buffers a list of row dicts for tablename, flushing if a threshold is hit
+        """
+        with self.lock:
+            if len(records) == 0:
+                return
+            self.buffers.setdefault(tablename, []).extend(records)
+            if self.first_buffered is None:
+                self.first_buffered = time.time()
+            if self._due():
+                self._flush()
+
+    def track(self, keys):
+        """
+        keys to hand to on_flush once the rows added so far are written
+        """
+        with self.lock:
+            if len(keys) == 0 or self.on_flush is None:
+                return
+            self.tracked_keys.extend(keys)
+            if self.first_buffered is None:
+                self.first_buffered = time.time()
+
+    def flush_if_due(self):
+        with self.lock:
+            if self._due():
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _due(self):
+        if self.first_buffered is None:
+            return False
+        n_rows = sum(len(rows) for rows in self.buffers.values())
+        return n_rows >= self.flush_rows or time.time() - self.first_buffered >= self.flush_seconds
+
+    def _flush(self):
+        for tablename in list(self.buffers):
+            rows = self.buffers[tablename]
+            copy_rows(self.engine, tablename, rows)
+            # drop each table's rows as soon as they're in, so a failure on the
+            # next table doesn't write these twice on retry
+            del self.buffers[tablename]
+            self.rows_written += len(rows)
+            if tablename in self.after_write:
+                self.after_write[tablename](rows)
+        self.first_buffered = None
+        if len(self.tracked_keys) > 0:
+            keys = self.tracked_keys
+            self.tracked_keys = []
+            self.on_flush(keys)
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_query(engine, sql, params, chunksize):
+    """
+    runs sql with a server-side cursor and yields DataFrames of up to chunksize rows
+    """
+    with engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(text(sql), con=conn, params=params, chunksize=chunksize):
+            yield chunk
+
+
+def concat_chunks(chunks, columns=None):
+    """
+    one DataFrame from an iterable of chunks, or an empty one if there were none
+    """
+    chunks = list(chunks)
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _quote_columns(columns):
+    # raw rss columns come from json_normalize and have dots in them, e.g. title_detail.type
+    return ', '.join('"{}"'.format(c) for c in columns) if columns else '*'
+
+
+def iter_rss(engine, columns=None, start=None, end=None, categories=None, chunksize=10000, distinct=True):
+    """
+    streams reuters_raw_rss in chunks, with filtering and dedup done by postgres
+
+    args:
+    columns -- list of columns to load, None for all
+    start, end -- only rows with time_added in [start, end)
+    categories -- only these feed categories, e.g. ['company', 'biz']
+    chunksize -- rows per DataFrame
+    distinct -- DISTINCT ON (feedburner_origlink, id), keeping the first row added
+    """
+    where = []
+    params = {}
+    if start is not None:
+        where.append('time_added >= :start')
+        params['start'] = start
+    if end is not None:
+        where.append('time_added < :end')
+        params['end'] = end
+    if categories is not None:
+        where.append('category = ANY(:categories)')
+        params['categories'] = list(categories)
+
+    sql = 'SELECT '
+    if distinct:
+        sql += 'DISTINCT ON (feedburner_origlink, id) '
+    sql += _quote_columns(columns) + ' FROM ' + RAW_RSS_TABLE
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if distinct:
+        sql += ' ORDER BY feedburner_origlink, id, time_added'
+
+    return iter_query(engine, sql, params, chunksize)
+
+
+def iter_stories(engine, columns=None, start=None, end=None, categories=None, chunksize=10000):
+    """
+    streams reuters_stories (one row per story) in chunks, oldest first
+
+    args:
+    columns -- list of columns to load, None for all
+    start, end -- only stories with time_added in [start, end)
+    categories -- only stories that came in from any of these feeds
+    chunksize -- rows per DataFrame
+    """
+    where = []
+    params = {}
+    if start is not None:
+        where.append('time_added >= :start')
+        params['start'] = start
+    if end is not None:
+        where.append('time_added < :end')
+        params['end'] = end
+    if categories is not None:
+        where.append('categories && CAST(:categories AS text[])')
+        params['categories'] = list(categories)
+
+    sql = 'SELECT ' + _quote_columns(columns) + ' FROM ' + STORY_TABLE
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY time_added'
+
+    return iter_query(engine, sql, params, chunksize)
+
+
+def iter_story_df(engine, columns=None, start=None, end=None, categories=None, chunksize=10000, distinct=False):
+    """
+    streams reuters_story_bodies in chunks, with filtering done by postgres
+
+    args:
+    columns -- list of columns to load, None for all
+    start, end -- only stories with datetime in [start, end)
+    categories -- only stories that came from these rss categories
+    chunksize -- rows per DataFrame
+    distinct -- DISTINCT ON (feedburner_origlink), one row per story
+    """
+    where = []
+    params = {}
+    if start is not None:
+        where.append('datetime >= :start')
+        params['start'] = start
+    if end is not None:
+        where.append('datetime < :end')
+        params['end'] = end
+    if categories is not None:
+        where.append('feedburner_origlink IN (SELECT feedburner_origlink FROM {} '
+                     'WHERE categories && CAST(:categories AS text[]))'.format(STORY_TABLE))
+        params['categories'] = list(categories)
+
+    sql = 'SELECT '
+    if distinct:
+        sql += 'DISTINCT ON (feedburner_origlink) '
+    sql += _quote_columns(columns) + ' FROM ' + BODY_TABLE
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if distinct:
+        sql += ' ORDER BY feedburner_origlink'
+
+    return iter_query(engine, sql, params, chunksize)
+
+
+def remove_duplicate_rows(engine, tablename, ignore_columns=('time_added',)):
+    """
+    deletes exact duplicate rows of tablename in place (keeping the first copy),
+    entirely inside postgres; the table's defaults and indexes are untouched
+
+    ignore_columns -- columns that differ between copies of the same row, e.g. when
+        it was inserted, and so aren't compared
+    """
+    res = engine.execute(text('SELECT column_name FROM information_schema.columns '
+                              'WHERE table_name = :tablename ORDER BY ordinal_position;'), tablename=tablename)
+    columns = [c for c, in res if c not in ignore_columns]
+    # joining on the (indexed, never NULL) link first keeps this a hash join
+    same = ' AND '.join(['a.feedburner_origlink = b.feedburner_origlink'] +
+                        ['a."{0}" IS NOT DISTINCT FROM b."{0}"'.format(c) for c in columns])
+    with engine.begin() as conn:
+        res = conn.execute('DELETE FROM {0} a USING {0} b WHERE a.ctid > b.ctid AND {1};'.format(tablename, same))
+    print(tablename + ':', res.rowcount, 'duplicate rows deleted')
\ No newline at end of file
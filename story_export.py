@@ -0,0 +1,138 @@
+"""
+incremental, date-partitioned export of reuters_story_bodies
+
+each run only exports rows added since the last run's watermark (the time_added
+column), writing one feather file per article date:
+
+story_export/
+    manifest.json
+    date=2018-08-15/part-20181016T120000-0.ft
+    date=2018-08-16/...
+
+the manifest lists every part file with its date and row count, plus the
+watermark. part files are written uncompressed so load_exported_stories can
+memory-map them and read only the dates and columns asked for
+"""
+
+import os
+import json
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from sqlalchemy import text
+
+from story_db import BODY_TABLE, iter_query
+
+EXPORT_DIR = 'story_export'
+MANIFEST_FILE = 'manifest.json'
+
+
+def ensure_time_added_column(engine):
+    """
+    adds time_added (defaulting to now()) to reuters_story_bodies if it's missing
+
+    the writers name their columns, so new rows get the default. rows that were
+    already there get their article datetime (or the epoch), so they're older than
+    any export's upper bound and the first export includes them. the default is
+    set again in case the table was rebuilt without it, and any rows that got a
+    NULL meanwhile are stamped now so the next export picks them up
+    """
+    with engine.begin() as conn:
+        res = conn.execute(text("SELECT 1 FROM information_schema.columns "
+                                "WHERE table_name = :table AND column_name = 'time_added';"), table=BODY_TABLE)
+        if res.fetchone() is None:
+            conn.execute('ALTER TABLE {} ADD COLUMN time_added timestamptz;'.format(BODY_TABLE))
+            conn.execute("UPDATE {} SET time_added = coalesce(datetime, 'epoch');".format(BODY_TABLE))
+        conn.execute('ALTER TABLE {} ALTER COLUMN time_added SET DEFAULT now();'.format(BODY_TABLE))
+        conn.execute('UPDATE {} SET time_added = now() WHERE time_added IS NULL;'.format(BODY_TABLE))
+    engine.execute('CREATE INDEX IF NOT EXISTS {0}_time_added_idx ON {0} (time_added);'.format(BODY_TABLE))
+
+
+def load_manifest(out_dir=EXPORT_DIR):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'watermark': None, 'parts': []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, out_dir=EXPORT_DIR):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def export_stories(engine, out_dir=EXPORT_DIR, chunksize=50000, lag_minutes=5):
+    """
+    exports stories added since the last export into date partitions
+
+    rows newer than lag_minutes are left for the next run, since a transaction that
+    started earlier could still commit rows with an older time_added
+
+    the manifest (and watermark) is only written once all parts are on disk, so a
+    crashed export just leaves unlisted files behind and is redone on the next run
+
+    returns number of rows exported
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    ensure_time_added_column(engine)
+    upper = engine.execute(text("SELECT now() - :lag * interval '1 minute';"), lag=lag_minutes).fetchone()[0]
+
+    sql = 'SELECT * FROM {} WHERE time_added <= :upper'.format(BODY_TABLE)
+    params = {'upper': upper}
+    if manifest['watermark'] is not None:
+        sql += ' AND time_added > :watermark'
+        params['watermark'] = manifest['watermark']
+
+    export_id = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    n_rows = 0
+    new_parts = []
+    for i, chunk in enumerate(iter_query(engine, sql, params, chunksize)):
+        dates = chunk['datetime'].dt.strftime('%Y-%m-%d').fillna('unknown')
+        for date, part in chunk.groupby(dates):
+            part_dir = os.path.join(out_dir, 'date=' + date)
+            os.makedirs(part_dir, exist_ok=True)
+            filename = 'part-{}-{}.ft'.format(export_id, i)
+            table = pa.Table.from_pandas(part.reset_index(drop=True), preserve_index=False)
+            feather.write_feather(table, os.path.join(part_dir, filename), compression='uncompressed')
+            new_parts.append({'path': os.path.join('date=' + date, filename),
+                              'date': date,
+                              'rows': part.shape[0]})
+            n_rows += part.shape[0]
+
+    manifest['parts'].extend(new_parts)
+    manifest['watermark'] = upper.isoformat()
+    save_manifest(manifest, out_dir)
+    print('exported {} stories into {} files'.format(n_rows, len(new_parts)))
+    return n_rows
+
+
+def load_exported_stories(out_dir=EXPORT_DIR, start_date=None, end_date=None, columns=None):
+    """
+    loads exported stories, reading only the partitions and columns asked for
+
+    args:
+    start_date, end_date -- 'YYYY-MM-DD' strings, both inclusive; None for no limit
+    columns -- list of columns to load, None for all
+    """
+    manifest = load_manifest(out_dir)
+    tables = []
+    for part in manifest['parts']:
+        date = part['date']
+        if start_date is not None and (date == 'unknown' or date < start_date):
+            continue
+        if end_date is not None and (date == 'unknown' or date > end_date):
+            continue
+        tables.append(feather.read_table(os.path.join(out_dir, part['path']), columns=columns, memory_map=True))
+
+    if len(tables) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # parts from different runs can have slightly different arrow types (e.g. an
+    # all-null column), so these are combined in pandas
+    return pd.concat([t.to_pandas() for t in tables], ignore_index=True)
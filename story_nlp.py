@@ -0,0 +1,68 @@
+"""
+spaCy helpers for story NLP
+
+only doc.ents, ent.rights and ent.sent are used on stories, which need the parser
+(dependency tree + sentence boundaries) and ner -- everything else in the pipeline
+(tagger, lemmatizer, textcat, ...) is removed to save time and memory
+
+the model can be swapped for a smaller one (e.g. en_core_web_sm) with the
+spacy_model environment variable or the model argument
+
+spaCy itself is only imported when a model is first loaded, so importing this
+module (or scrape_reuters_rss) stays cheap
+"""
+
+import os
+import threading
+
+NLP_MODEL = os.environ.get('spacy_model', 'en_core_web_lg')
+
+# components needed for ents, ent.rights and ent.sent; tok2vec only exists in spaCy 3
+NEEDED_PIPES = ('tok2vec', 'parser', 'ner')
+
+# process-wide models from get_nlp(), by model name
+_nlp_cache = {}
+_nlp_lock = threading.Lock()
+
+
+def load_nlp(model=NLP_MODEL, trim=True):
+    """
+    loads a spaCy model; with trim=True, removes the components stories don't need
+    """
+    import spacy
+
+    nlp = spacy.load(model)
+    if trim:
+        for name in list(nlp.pipe_names):
+            if name not in NEEDED_PIPES:
+                nlp.remove_pipe(name)
+
+    return nlp
+
+
+def get_nlp(model=NLP_MODEL):
+    """
+    trimmed model shared by the whole process, loaded on first use
+    """
+    # no lock once it's loaded: a process forked while another thread held the
+    # lock (e.g. an NLPPool replacing a worker) would wait on it forever
+    nlp = _nlp_cache.get(model)
+    if nlp is not None:
+        return nlp
+    with _nlp_lock:
+        if model not in _nlp_cache:
+            _nlp_cache[model] = load_nlp(model)
+        return _nlp_cache[model]
+
+
+def pipe_docs(nlp, texts, batch_size=32, n_process=1):
+    """
+    runs texts through nlp.pipe in batches; yields docs in the same order as texts
+
+    n_process > 1 forks worker processes (spaCy 2.2+), which is only worth it for
+    big corpora
+    """
+    if n_process > 1:
+        return nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+
+    return nlp.pipe(texts, batch_size=batch_size)
@@ -0,0 +1,211 @@
+"""
+staged, threaded pipeline for scraping stories
+
+fetch -> process -> write, with bounded queues between the stages so a slow stage
+applies backpressure instead of piling up pages in memory:
+
+- n_fetchers threads run fetch_fn (network bound), rate limited per host
+- n_processors threads run process_fn (parsing/NLP), or process_batch_fn on up to
+  process_batch_size items at once so NLP can use nlp.pipe batching
+- one writer thread collects results and calls write_fn with batches
+
+fetch_fn and process_fn can return None to drop an item; an exception in any stage
+is printed and the item is dropped, so one bad page doesn't kill a backfill
+"""
+
+import time
+import queue
+import threading
+from urllib.parse import urlparse
+
+# marks the end of the items for a stage
+_DONE = object()
+
+
+class HostRateLimiter:
+    """
+    spaces out requests to the same host so there are at most `rate` per second
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_time.get(host, now))
+            self.next_time[host] = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class StoryPipeline:
+    """
+    args:
+    fetch_fn -- item -> fetched item or None
+    process_fn -- fetched item -> result or None
+    process_batch_fn -- alternative to process_fn: list of fetched items -> list of
+        results (None entries are dropped); gets whatever is queued, up to process_batch_size
+    write_fn -- list of results -> None
+    n_fetchers, n_processors -- threads for the fetch and process stages
+    write_batch_size -- results per write_fn call
+    flush_interval -- seconds; a partial batch is written once it's this old
+    queue_size -- max items waiting between two stages
+    host_rate -- max fetches/sec per host, None for no limit
+    url_fn -- item -> url, needed for host_rate; None means the item makes no request
+    """
+    def __init__(self, fetch_fn, process_fn, write_fn, n_fetchers=8, n_processors=1,
+                 write_batch_size=50, flush_interval=10, queue_size=100,
+                 host_rate=None, url_fn=None, process_batch_fn=None, process_batch_size=1):
+        self.fetch_fn = fetch_fn
+        self.process_fn = process_fn
+        self.process_batch_fn = process_batch_fn
+        self.process_batch_size = process_batch_size
+        self.write_fn = write_fn
+        self.n_fetchers = n_fetchers
+        self.n_processors = n_processors
+        self.write_batch_size = write_batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.rate_limiter = HostRateLimiter(host_rate) if host_rate else None
+        self.url_fn = url_fn
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + n
+
+    def _fetch_worker(self, in_q, out_q):
+        while True:
+            item = in_q.get()
+            if item is _DONE:
+                return
+            try:
+                url = self.url_fn(item) if self.rate_limiter is not None else None
+                if url is not None:
+                    self.rate_limiter.wait(url)
+                fetched = self.fetch_fn(item)
+            except Exception as e:
+                print('fetch failed:', repr(e))
+                self.count('errors')
+                continue
+
+            if fetched is None:
+                self.count('skipped')
+                continue
+            self.count('fetched')
+            out_q.put(fetched)
+
+    def _process_worker(self, in_q, out_q):
+        done = False
+        while not done:
+            item = in_q.get()
+            if item is _DONE:
+                return
+
+            if self.process_batch_fn is None:
+                try:
+                    results = [self.process_fn(item)]
+                except Exception as e:
+                    print('processing failed:', repr(e))
+                    self.count('errors')
+                    continue
+            else:
+                # take whatever else is already waiting, up to the batch size
+                batch = [item]
+                while len(batch) < self.process_batch_size:
+                    try:
+                        item = in_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        done = True
+                        break
+                    batch.append(item)
+                try:
+                    results = self.process_batch_fn(batch)
+                except Exception as e:
+                    print('processing failed:', repr(e))
+                    self.count('errors', len(batch))
+                    continue
+
+            for result in results:
+                if result is None:
+                    self.count('skipped')
+                    continue
+                self.count('processed')
+                out_q.put(result)
+
+    def _write_worker(self, in_q):
+        batch = []
+        last_flush = time.time()
+        done = False
+        while not done:
+            try:
+                item = in_q.get(timeout=self.flush_interval)
+                if item is _DONE:
+                    done = True
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            full = len(batch) >= self.write_batch_size
+            stale = time.time() - last_flush >= self.flush_interval
+            if batch and (full or stale or done):
+                try:
+                    self.write_fn(batch)
+                    self.count('written', len(batch))
+                except Exception as e:
+                    print('write failed:', repr(e))
+                    self.count('errors', len(batch))
+                batch = []
+                last_flush = time.time()
+
+    def run(self, items):
+        """
+        pushes every item through the pipeline and waits for it to drain
+
+        returns stats dict with counts per stage, elapsed seconds and stories/sec
+        """
+        self.stats = {'items': 0, 'skipped': 0, 'fetched': 0, 'processed': 0, 'written': 0, 'errors': 0}
+        fetch_q = queue.Queue(self.queue_size)
+        process_q = queue.Queue(self.queue_size)
+        write_q = queue.Queue(self.queue_size)
+
+        fetchers = [threading.Thread(target=self._fetch_worker, args=(fetch_q, process_q), daemon=True)
+                    for _ in range(self.n_fetchers)]
+        processors = [threading.Thread(target=self._process_worker, args=(process_q, write_q), daemon=True)
+                      for _ in range(self.n_processors)]
+        writer = threading.Thread(target=self._write_worker, args=(write_q,), daemon=True)
+        for t in fetchers + processors + [writer]:
+            t.start()
+
+        start = time.time()
+        try:
+            for item in items:
+                fetch_q.put(item)
+                self.count('items')
+        finally:
+            # shut the stages down in order so nothing is left in a queue, also when
+            # items raised: what was already queued still gets written
+            for _ in fetchers:
+                fetch_q.put(_DONE)
+            for t in fetchers:
+                t.join()
+            for _ in processors:
+                process_q.put(_DONE)
+            for t in processors:
+                t.join()
+            write_q.put(_DONE)
+            writer.join()
+
+        elapsed = time.time() - start
+        self.stats['seconds'] = elapsed
+        self.stats['stories_per_sec'] = self.stats['written'] / elapsed if elapsed > 0 else 0
+        print('pipeline finished:', self.stats)
+        return self.stats
@@ -0,0 +1,173 @@
+"""
+durable queue of stories to scrape, in a story_jobs table
+
+each story (canonical link) is one job:
+
+pending -> running -> done
+              |
+              +-> pending again after a failure, with a backoff delay
+              +-> dead once it has failed max_attempts times
+
+workers claim jobs in batches with one UPDATE ... RETURNING; on postgres the rows
+are picked with FOR UPDATE SKIP LOCKED so any number of worker processes can drain
+the queue without handing out the same job twice. sqlite (e.g. as a local
+stand-in) runs the same statement, where it's atomic since sqlite has one writer
+at a time. a claimed job is leased to its worker for lease_seconds; if the worker
+dies, the job can be claimed again after that, so a stopped run picks up where it
+left off
+"""
+
+import os
+import time
+import socket
+
+import pandas as pd
+from sqlalchemy import text
+
+from feed_poller import backoff_delay
+from story_db import STORY_TABLE
+
+JOB_TABLE = 'story_jobs'
+
+
+def default_worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class StoryQueue:
+    """
+    args:
+    engine -- SQL engine (postgres, or sqlite as a stand-in)
+    max_attempts -- failures before a job is dead-lettered
+    lease_seconds -- how long a claimed job stays with its worker
+    retry_base, retry_cap -- seconds, for the jittered backoff between attempts
+    """
+    def __init__(self, engine, max_attempts=5, lease_seconds=600, retry_base=60, retry_cap=3600):
+        self.engine = engine
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.skip_locked = engine.dialect.name == 'postgresql'
+        self.ensure_table()
+
+    def ensure_table(self):
+        with self.engine.begin() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS {} ('
+                         'feedburner_origlink text PRIMARY KEY, '
+                         'title text, '
+                         "state text NOT NULL DEFAULT 'pending', "
+                         'attempts integer NOT NULL DEFAULT 0, '
+                         'available_at double precision NOT NULL DEFAULT 0, '
+                         'locked_by text, '
+                         'locked_at double precision, '
+                         'updated_at double precision, '
+                         'last_error text);'.format(JOB_TABLE))
+            conn.execute('CREATE INDEX IF NOT EXISTS {0}_state_idx ON {0} (state, available_at);'.format(JOB_TABLE))
+
+    def enqueue(self, stories_df):
+        """
+        adds jobs for a DataFrame with feedburner_origlink and title columns; links
+        that already have a job (in any state) are left alone
+        """
+        rows = [{'link': link, 'title': title}
+                for link, title in zip(stories_df['feedburner_origlink'], stories_df['title'])]
+        if len(rows) == 0:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text('INSERT INTO {} (feedburner_origlink, title) VALUES (:link, :title) '
+                              'ON CONFLICT (feedburner_origlink) DO NOTHING;'.format(JOB_TABLE)), rows)
+
+    def enqueue_stories(self, since=None):
+        """
+        adds jobs for everything in reuters_stories (added since `since`, if given)
+        that doesn't have one yet
+        """
+        sql = 'INSERT INTO {} (feedburner_origlink, title) SELECT feedburner_origlink, title FROM {}'.format(JOB_TABLE, STORY_TABLE)
+        params = {}
+        if since is not None:
+            sql += ' WHERE time_added >= :since'
+            params['since'] = since
+        sql += ' ON CONFLICT (feedburner_origlink) DO NOTHING;'
+        with self.engine.begin() as conn:
+            res = conn.execute(text(sql), **params)
+        print('queued', res.rowcount, 'new stories')
+
+    def claim(self, n, worker_id=None):
+        """
+        claims up to n jobs that are due (or whose lease ran out)
+
+        returns DataFrame with feedburner_origlink, title and attempts
+        """
+        worker_id = worker_id or default_worker_id()
+        now = time.time()
+        expired = now - self.lease_seconds
+        with self.engine.begin() as conn:
+            # jobs that keep killing their worker never get marked failed, so they
+            # are dead-lettered here instead
+            conn.execute(text("UPDATE {} SET state = 'dead', updated_at = :now, "
+                              "last_error = 'lease expired on the last attempt' "
+                              "WHERE state = 'running' AND locked_at < :expired "
+                              "AND attempts >= :max_attempts;".format(JOB_TABLE)),
+                         now=now, expired=expired, max_attempts=self.max_attempts)
+            res = conn.execute(text("UPDATE {0} SET state = 'running', attempts = attempts + 1, "
+                                    "locked_by = :worker, locked_at = :now, updated_at = :now "
+                                    "WHERE feedburner_origlink IN ("
+                                    "SELECT feedburner_origlink FROM {0} "
+                                    "WHERE (state = 'pending' AND available_at <= :now) "
+                                    "OR (state = 'running' AND locked_at < :expired) "
+                                    "ORDER BY available_at LIMIT :n{1}) "
+                                    "RETURNING feedburner_origlink, title, attempts;".format(
+                                        JOB_TABLE, ' FOR UPDATE SKIP LOCKED' if self.skip_locked else '')),
+                               worker=worker_id, now=now, expired=expired, n=n)
+            rows = res.fetchall()
+
+        return pd.DataFrame(rows, columns=['feedburner_origlink', 'title', 'attempts'])
+
+    def complete(self, links):
+        rows = [{'link': link, 'now': time.time()} for link in links]
+        if len(rows) == 0:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text("UPDATE {} SET state = 'done', locked_by = NULL, updated_at = :now "
+                              "WHERE feedburner_origlink = :link;".format(JOB_TABLE)), rows)
+
+    def fail(self, link, error):
+        """
+        puts the job back with a backoff delay, or dead-letters it if it's out of attempts
+        """
+        now = time.time()
+        with self.engine.begin() as conn:
+            row = conn.execute(text('SELECT attempts FROM {} WHERE feedburner_origlink = :link;'.format(JOB_TABLE)),
+                               link=link).fetchone()
+            if row is None:
+                return
+            attempts = row[0]
+            state = 'dead' if attempts >= self.max_attempts else 'pending'
+            available_at = now + backoff_delay(attempts, self.retry_base, self.retry_cap)
+            conn.execute(text('UPDATE {} SET state = :state, available_at = :available_at, locked_by = NULL, '
+                              'updated_at = :now, last_error = :error '
+                              'WHERE feedburner_origlink = :link;'.format(JOB_TABLE)),
+                         state=state, available_at=available_at, now=now, error=str(error)[:1000], link=link)
+        if state == 'dead':
+            print('dead-lettered', link, 'after', attempts, 'attempts:', error)
+
+    def counts(self):
+        """
+        dict of state -> number of jobs
+        """
+        res = self.engine.execute('SELECT state, count(*) FROM {} GROUP BY state;'.format(JOB_TABLE))
+        return {state: n for state, n in res}
+
+    def dead_letters(self):
+        return pd.read_sql('SELECT feedburner_origlink, title, attempts, last_error FROM {} '
+                           "WHERE state = 'dead' ORDER BY updated_at;".format(JOB_TABLE), con=self.engine)
+
+    def requeue_dead(self):
+        """
+        gives every dead job a fresh set of attempts, e.g. after fixing a parser
+        """
+        with self.engine.begin() as conn:
+            res = conn.execute(text("UPDATE {} SET state = 'pending', attempts = 0, available_at = 0 "
+                                    "WHERE state = 'dead';".format(JOB_TABLE)))
+        return res.rowcount
@@ -0,0 +1,215 @@
+"""
+one record per story across all feeds
+
+the same story comes in from several feeds ('biz', 'company', 'top', ...), each
+time with its own ?feedType=RSS&feedName=... link. reuters_stories keeps one row
+per canonical link with the set of feeds it showed up in (a text[] column). story
+scraping reads from this table, so each story is fetched and analyzed once
+
+a story whose title is a near-duplicate (SimHash within a few bits) of a recent
+one is only a candidate duplicate, since recurring headlines ("Stocks to watch",
+"BRIEF-...") look alike too: it gets its own row with near_dup_of set, and is
+folded into the other story once scraping finds their bodies are near-duplicates
+as well
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from rss_dedup import canonical_url, canonical_url_sql, simhash, to_signed64, NearDupIndex
+from story_db import RAW_RSS_TABLE, BODY_TABLE, SENT_TABLE, STORY_TABLE, table_exists, links_in_table
+
+_near_dup_engines = set()
+_near_dup_lock = threading.Lock()
+
+
+def ensure_story_table(engine):
+    """
+    creates reuters_stories if it's missing, filling it the first time from
+    reuters_raw_rss (exact canonical-link matches only)
+
+    stored bodies and sentiments are left alone; see canonicalize_stored_links()
+    """
+    if table_exists(engine, STORY_TABLE):
+        return
+
+    print('creating', STORY_TABLE)
+    with engine.begin() as conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS {} ('
+                     'feedburner_origlink text PRIMARY KEY, '
+                     'title text, '
+                     'published_parsed timestamp, '
+                     'time_added timestamp, '
+                     'categories text[], '
+                     'title_simhash bigint, '
+                     'near_dup_of text);'.format(STORY_TABLE))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_time_added_idx ON {0} (time_added);'.format(STORY_TABLE))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_categories_idx ON {0} USING gin (categories);'.format(STORY_TABLE))
+
+        if table_exists(engine, RAW_RSS_TABLE):
+            conn.execute('INSERT INTO {} (feedburner_origlink, title, published_parsed, time_added, categories) '
+                         'SELECT {} AS link, min(title), min(published_parsed), min(time_added), '
+                         'array_agg(DISTINCT category) FROM {} GROUP BY link '
+                         'ON CONFLICT DO NOTHING;'.format(STORY_TABLE, canonical_url_sql('feedburner_origlink'), RAW_RSS_TABLE))
+
+
+def canonicalize_stored_links(engine, backup=True):
+    """
+    one-off migration: rewrites the links in reuters_story_bodies and
+    reuters_story_sentiments to their canonical form and deletes the extra copies
+    of stories that were stored once per feed they came in from
+
+    not needed for scraping: story_db looks these tables up by the canonical form
+    of their links either way. it tidies up the duplicates, and deletes rows,
+    so with backup=True each table is first copied to <table>_pre_canonical; run
+    it by hand, e.g.
+
+    canonicalize_stored_links(scrape_reuters_rss.get_engine())
+    """
+    for tablename in [BODY_TABLE, SENT_TABLE]:
+        if not table_exists(engine, tablename):
+            continue
+        with engine.begin() as conn:
+            if backup:
+                conn.execute('CREATE TABLE {0}_pre_canonical AS SELECT * FROM {0};'.format(tablename))
+            res = conn.execute("UPDATE {} SET feedburner_origlink = {} "
+                               "WHERE position('?' in feedburner_origlink) > 0;".format(tablename, canonical_url_sql('feedburner_origlink')))
+            print(tablename + ':', res.rowcount, 'links canonicalized')
+            res = conn.execute('DELETE FROM {0} a USING {0} b '
+                               'WHERE a.ctid < b.ctid '
+                               'AND a.feedburner_origlink = b.feedburner_origlink;'.format(tablename))
+            print(tablename + ':', res.rowcount, 'duplicate rows deleted')
+
+
+def ensure_near_dup_column(engine):
+    """
+    adds near_dup_of to a reuters_stories made before it; once per engine per process
+    """
+    with _near_dup_lock:
+        if engine in _near_dup_engines:
+            return
+        if table_exists(engine, STORY_TABLE):
+            engine.execute('ALTER TABLE {} ADD COLUMN IF NOT EXISTS near_dup_of text;'.format(STORY_TABLE))
+            _near_dup_engines.add(engine)
+
+
+def near_dup_candidates(engine, links):
+    """
+    returns dict of link -> link of the story its title is a near-duplicate of,
+    for the links that are candidate duplicates; meant for a batch of links at a time
+    """
+    links = list(links)
+    if len(links) == 0 or not table_exists(engine, STORY_TABLE):
+        return {}
+    ensure_near_dup_column(engine)
+
+    stmt = text('SELECT feedburner_origlink, near_dup_of FROM {} '
+                'WHERE near_dup_of IS NOT NULL AND feedburner_origlink = ANY(:links);'.format(STORY_TABLE))
+    return dict(engine.execute(stmt, links=links).fetchall())
+
+
+def fold_near_duplicate(engine, link, dup):
+    """
+    adds the feeds of link's story to dup's, once their bodies turned out to be
+    near-duplicates too
+    """
+    engine.execute(text('UPDATE {0} d SET categories = ARRAY(SELECT DISTINCT unnest(d.categories || s.categories)) '
+                        'FROM {0} s WHERE d.feedburner_origlink = :dup AND s.feedburner_origlink = :link;'.format(STORY_TABLE)),
+                   dup=dup, link=link)
+
+
+class StoryRegistry:
+    """
+    adds new raw rss entries to reuters_stories
+
+    args:
+    engine -- SQL engine
+    index -- NearDupIndex of recent stories' title fingerprints
+
+    near_duplicates counts the candidate duplicates added
+    """
+    def __init__(self, engine, index=None):
+        self.engine = engine
+        self.index = index or NearDupIndex()
+        self.near_duplicates = 0
+
+    @classmethod
+    def from_db(cls, engine, window_days=7):
+        """
+        makes sure the table exists and indexes the titles of stories from the last
+        window_days, so near-duplicates of those are caught
+        """
+        ensure_story_table(engine)
+        ensure_near_dup_column(engine)
+        since = datetime.utcnow() - timedelta(days=window_days)
+        res = engine.execute(text('SELECT feedburner_origlink, title, title_simhash FROM {} '
+                                  'WHERE time_added >= :since;'.format(STORY_TABLE)), since=since)
+        registry = cls(engine)
+        for link, title, h in res:
+            if h is None:
+                # rows filled in from reuters_raw_rss don't have one yet
+                h = simhash(title or '')
+            registry.index.add(link, h & 0xFFFFFFFFFFFFFFFF)
+        print('indexed', len(registry.index), 'recent story titles')
+        return registry
+
+    def add(self, rss_df):
+        """
+        records the stories in rss_df (new reuters_raw_rss rows); stories already
+        known by link just get the new feeds added to their categories, and ones with
+        a near-duplicate title are added as candidate duplicates
+
+        returns number of new stories
+        """
+        return len(self.add_new(rss_df))
+
+    def add_new(self, rss_df):
+        """
+        same as add(), but returns the canonical links of the new stories
+        """
+        rss_df = rss_df.assign(link=rss_df['feedburner_origlink'].map(canonical_url))
+        stories = rss_df.groupby('link').agg(title=('title', 'first'),
+                                             published_parsed=('published_parsed', 'min'),
+                                             time_added=('time_added', 'min'),
+                                             categories=('category', lambda c: sorted(set(c))))
+        known = links_in_table(self.engine, stories.index, STORY_TABLE)
+        new_rows = []
+        merges = []
+        for link, story in stories.iterrows():
+            if link in known:
+                merges.append({'link': link, 'categories': story['categories']})
+                continue
+
+            h = simhash(story['title'])
+            dup = self.index.find(h)
+            if dup is not None:
+                self.near_duplicates += 1
+            else:
+                self.index.add(link, h)
+            new_rows.append({'link': link,
+                             'title': story['title'],
+                             'published_parsed': story['published_parsed'],
+                             'time_added': story['time_added'],
+                             'categories': story['categories'],
+                             'title_simhash': to_signed64(h),
+                             'near_dup_of': dup})
+
+        with self.engine.begin() as conn:
+            if len(new_rows) > 0:
+                # another scraper process could have added the link in the meantime
+                conn.execute(text('INSERT INTO {0} (feedburner_origlink, title, published_parsed, time_added, '
+                                  'categories, title_simhash, near_dup_of) '
+                                  'VALUES (:link, :title, :published_parsed, :time_added, '
+                                  'CAST(:categories AS text[]), :title_simhash, :near_dup_of) '
+                                  'ON CONFLICT (feedburner_origlink) DO UPDATE SET categories = '
+                                  'ARRAY(SELECT DISTINCT unnest({0}.categories || EXCLUDED.categories));'.format(STORY_TABLE)),
+                             new_rows)
+            if len(merges) > 0:
+                conn.execute(text('UPDATE {} SET categories = '
+                                  'ARRAY(SELECT DISTINCT unnest(categories || CAST(:categories AS text[]))) '
+                                  'WHERE feedburner_origlink = :link;'.format(STORY_TABLE)),
+                             merges)
+
+        return [row['link'] for row in new_rows]